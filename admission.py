@@ -0,0 +1,196 @@
+"""
+Admission control for expensive requests, shared by every worker on a host.
+
+Capacity is a fixed number of slots, each a lock file in a shared folder held
+with ``flock``. A request takes as many slots as its estimated cost (from the
+page count and file size of the document it works on) plus one of the
+per-operation slots that cap how many of each operation run at once. Locks
+belong to the open file, so a worker that dies releases its slots with it.
+
+Interactive operations (previews, page images, edits) may use every slot;
+batch operations (conversions, merges, extraction) may not use the first
+``reserved`` slots and step aside while an interactive request is waiting.
+A request that cannot start waits in a bounded queue; when the queue is full
+or the wait times out it is rejected, and the caller answers 503 with
+Retry-After instead of letting workers thrash. A waiting request that needs
+several slots keeps each one it manages to lock until it has enough, one such
+request per priority at a time, and other requests step aside meanwhile, so
+a stream of single-slot requests cannot starve it.
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: admission control is turned off in create_app
+    fcntl = None
+
+PAGES_PER_UNIT = 50
+BYTES_PER_UNIT = 16 * 1024 * 1024
+POLL_INTERVAL = 0.05
+WAIT_SECONDS = {'interactive': 10, 'batch': 20}
+RETRY_AFTER = {'interactive': 1, 'batch': 5}
+
+
+class Rejected(Exception):
+    """Raised by :meth:`AdmissionController.acquire` when a request may not start"""
+
+    def __init__(self, operation, priority, reason):
+        super().__init__(f'{operation} rejected: {reason}')
+        self.operation = operation
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = RETRY_AFTER[priority]
+
+
+class Ticket:
+    """Slots held by one admitted request; release them exactly once"""
+
+    def __init__(self, slots, cost, waited):
+        self._slots = slots
+        self.cost = cost
+        self.waited = waited
+
+    def release(self):
+        slots, self._slots = self._slots, []
+        for slot in slots:
+            slot.close()  # closing the file drops its flock
+
+
+class AdmissionController:
+    """Host-wide concurrency and cost limits, kept in lock files under ``folder``"""
+
+    def __init__(self, folder, capacity=8, reserved=2, limits=None, queue_size=8):
+        self.folder = folder
+        self.capacity = capacity
+        self.reserved = reserved
+        self.limits = limits or {}
+        self.queue_size = queue_size
+
+    def cost(self, pages=0, size=0):
+        """Slots a request needs: one, plus one per ``PAGES_PER_UNIT`` pages and ``BYTES_PER_UNIT`` bytes"""
+        return 1 + int(pages or 0) // PAGES_PER_UNIT + int(size or 0) // BYTES_PER_UNIT
+
+    def acquire(self, operation, priority, cost):
+        """
+        Take the slots for one request, waiting in the queue if needed.
+
+        Returns a :class:`Ticket`; raises :class:`Rejected` when the queue is
+        full or the wait times out.
+        """
+        first_slot = 0 if priority == 'interactive' else self.reserved
+        # A request costlier than everything it may use would never start
+        cost = max(1, min(cost, self.capacity - first_slot))
+
+        started = time.monotonic()
+        ticket = self._try_acquire(operation, priority, cost, first_slot, started)
+        if ticket is not None:
+            return ticket
+
+        place = self._lock_any(f'wait-{priority}', self.queue_size)
+        if place is None:
+            raise Rejected(operation, priority, 'queue full')
+        gather = None
+        held = {'operation': None, 'units': []}
+        try:
+            deadline = started + WAIT_SECONDS[priority]
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                if gather is None and cost > 1:
+                    # Needing several slots free at once, a large request would
+                    # lose every race to single-slot ones; one at a time per
+                    # priority keeps the slots it finds until it has enough
+                    gather = self._lock(f'gather-{priority}')
+                ticket = self._try_acquire(
+                    operation, priority, cost, first_slot, started, held if gather is not None else None
+                )
+                if ticket is not None:
+                    return ticket
+        finally:
+            place.close()
+            self._drop(held)
+            if gather is not None:
+                gather.close()
+        raise Rejected(operation, priority, 'timed out waiting for capacity')
+
+    def _try_acquire(self, operation, priority, cost, first_slot, started, held=None):
+        """
+        Take ``cost`` slots (and the operation's slot) or none of them.
+
+        ``held`` belongs to the request gathering capacity: slots it takes are
+        kept there across attempts until there are enough. Other requests step
+        aside while it waits.
+        """
+        if priority != 'interactive' and self._interactive_waiting():
+            # A batch request gathering capacity gives it back as well
+            self._drop(held)
+            return None
+        if held is None and self._gatherer_waiting(priority):
+            return None
+
+        state = held if held is not None else {'operation': None, 'units': []}
+        limit = self.limits.get(operation)
+        if limit and state['operation'] is None:
+            state['operation'] = self._lock_any(f'op-{operation}', limit)
+            if state['operation'] is None:
+                return None
+
+        # Interactive requests fill the reserved slots first, leaving the rest to batch work.
+        # Slots this request already holds fail to lock again and are skipped.
+        for index in range(first_slot, self.capacity):
+            if len(state['units']) == cost:
+                break
+            slot = self._lock(f'slot-{index}')
+            if slot is not None:
+                state['units'].append(slot)
+
+        if len(state['units']) < cost:
+            if held is None:
+                self._drop(state)
+            return None
+        slots = state['units'] + ([state['operation']] if state['operation'] is not None else [])
+        state['units'], state['operation'] = [], None
+        return Ticket(slots, cost, time.monotonic() - started)
+
+    def _gatherer_waiting(self, priority):
+        """True while a large request that goes before this one is gathering slots"""
+        for gatherer in ('interactive',) if priority == 'interactive' else ('interactive', 'batch'):
+            lock = self._lock(f'gather-{gatherer}')
+            if lock is None:
+                return True
+            lock.close()
+        return False
+
+    def _drop(self, state):
+        if state is None:
+            return
+        for slot in state['units']:
+            slot.close()
+        if state['operation'] is not None:
+            state['operation'].close()
+        state['units'], state['operation'] = [], None
+
+    def _interactive_waiting(self):
+        for index in range(self.queue_size):
+            place = self._lock(f'wait-interactive-{index}')
+            if place is None:
+                return True
+            place.close()
+        return False
+
+    def _lock_any(self, prefix, count):
+        for index in range(count):
+            slot = self._lock(f'{prefix}-{index}')
+            if slot is not None:
+                return slot
+        return None
+
+    def _lock(self, name):
+        """Open and lock ``name`` without blocking; returns the open file or None if held elsewhere"""
+        slot = open(os.path.join(self.folder, f'{name}.lock'), 'a')
+        try:
+            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            slot.close()
+            return None
+        return slot
@@ -1,54 +1,646 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
+import time
+
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, send_file, session, g, url_for
 from flask_cors import CORS
+import functools
+import itertools
+import json
 import os
+import threading
 import uuid
 from werkzeug.utils import secure_filename
-import PyPDF2
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
 import fitz  # PyMuPDF
-import io
-import base64
-from PIL import Image
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.style import WD_STYLE_TYPE
-from docx.oxml.shared import OxmlElement, qn
-
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'
-CORS(app)
+from page_cache import PageCache
+from admission import PAGES_PER_UNIT, AdmissionController, Rejected
+from edit_history import DocumentVersions, EditHistory
+from fingerprints import FingerprintStore, changed_pages
+from ingest import IngestStore
+from singleflight import SingleFlight
+import metrics
+import executor
+import pdf_operations
+from profiler import RequestProfiler, list_profiles
+# python-docx and PyPDF2 are imported by pdf_operations when first needed, so a
+# worker only pays for Flask and PyMuPDF at boot. preload_shared_state()
+# imports them up front when running under a preforking server.
+
+bp = Blueprint('editor', __name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
+HISTORY_FOLDER = os.path.join(PROCESSED_FOLDER, 'history')
+FINGERPRINTS_FOLDER = os.path.join(PROCESSED_FOLDER, 'fingerprints')
+INGEST_FOLDER = os.path.join(PROCESSED_FOLDER, 'ingest')
+ADMISSION_FOLDER = os.path.join(PROCESSED_FOLDER, 'admission')
+# Lock and hand-over files for coalesced requests; /dev/shm keeps them off disk
+SINGLEFLIGHT_FOLDER = os.environ.get('PDF_EDITOR_SINGLEFLIGHT_DIR', os.path.join(PROCESSED_FOLDER, 'singleflight'))
+METRICS_FOLDER = os.path.join(PROCESSED_FOLDER, 'metrics')
+PROFILES_FOLDER = 'profiles'
 ALLOWED_EXTENSIONS = {'pdf'}
+PREVIEW_ZOOM = 1.5  # Page images are rendered at 1.5x for sharper previews
+# Lossy encoder quality for scanned/photographic pages; text-only pages are always lossless
+PREVIEW_QUALITY_TIERS = {'low': 50, 'medium': 75, 'high': 90}
+
+# Endpoints under admission control: (operation, priority). Interactive work
+# keeps reserved capacity and goes ahead of waiting batch work.
+ADMISSION_OPERATIONS = {
+    'editor.preview_pdf': ('preview', 'interactive'),
+    'editor.page_image': ('page_image', 'interactive'),
+    'editor.get_text_blocks': ('text_blocks', 'interactive'),
+    'editor.add_text': ('add_text', 'interactive'),
+    'editor.edit_text': ('edit_text', 'interactive'),
+    'editor.extract_text': ('extract_text', 'batch'),
+    'editor.extract_images': ('extract_images', 'batch'),
+    'editor.ocr_text': ('ocr_text', 'batch'),
+    'editor.convert_to_word': ('convert_to_word', 'batch'),
+    'editor.merge_pdfs': ('merge', 'batch'),
+    'editor.split_pdf': ('split', 'batch'),
+    'editor.optimize_pdf': ('optimize', 'batch')
+}
+# Operations that do one page's work at most: page images render one page and
+# previews only read page sizes, usually from the cache or ingest facts
+SINGLE_PAGE_OPERATIONS = {'preview', 'page_image'}
+
+# Per-page caches. Edits always write a new file, so entries are keyed by
+# filename and unchanged pages are carried over from the parent version.
+render_cache = PageCache(max_entries=4096, max_bytes=256 * 1024 * 1024)
+text_cache = PageCache(max_entries=16384, max_bytes=64 * 1024 * 1024)
+edit_history = EditHistory(HISTORY_FOLDER)
+document_versions = DocumentVersions(os.path.join(HISTORY_FOLDER, 'documents'))
+fingerprint_store = FingerprintStore(FINGERPRINTS_FOLDER)
+ingest_store = IngestStore(INGEST_FOLDER)
+admission = AdmissionController(ADMISSION_FOLDER)
+single_flight = SingleFlight(SINGLEFLIGHT_FOLDER)
+
+# Seconds spent importing this module, building the app and preloading
+startup_timings = {}
+
+def create_app(config=None):
+    """Build and configure the Flask application; folders are created here, not at import"""
+    started = time.perf_counter()
+    
+    app = Flask(__name__)
+    app.secret_key = 'your-secret-key-here'
+    CORS(app)
+    
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
+    app.config['HISTORY_FOLDER'] = HISTORY_FOLDER
+    app.config['FINGERPRINTS_FOLDER'] = FINGERPRINTS_FOLDER
+    app.config['INGEST_FOLDER'] = INGEST_FOLDER
+    app.config['ADMISSION_FOLDER'] = ADMISSION_FOLDER
+    app.config['SINGLEFLIGHT_FOLDER'] = SINGLEFLIGHT_FOLDER
+    app.config['METRICS_FOLDER'] = METRICS_FOLDER
+    app.config['PROFILES_FOLDER'] = PROFILES_FOLDER
+    # Per-request profiling (X-Profile: 1 header or ?profile=1) is off unless enabled here
+    app.config['PROFILING_ENABLED'] = os.environ.get('PDF_EDITOR_PROFILING', '0') == '1'
+    app.config['MAX_CONTENT_LENGTH'] = 80 * 1024 * 1024  # 80MB max file size
+    # Processes per worker for page renders and text extraction; 0 runs them inline
+    app.config['RENDER_WORKERS'] = int(os.environ.get('PDF_EDITOR_RENDER_WORKERS', '0'))
+    # /events holds a connection open per browser tab, so gunicorn.conf.py turns
+    # it off for sync workers; clients then rely on the edit responses alone
+    app.config['EVENTS_ENABLED'] = os.environ.get('PDF_EDITOR_EVENTS', '1') == '1'
+    app.config['EVENTS_POLL_INTERVAL'] = 0.2
+    app.config['EVENTS_STREAM_SECONDS'] = 55  # EventSource reconnects after this
+    # Background analysis of uploads (page facts, thumbnails, text); threads per worker
+    app.config['INGEST_ENABLED'] = os.environ.get('PDF_EDITOR_INGEST', '1') == '1'
+    app.config['INGEST_THREADS'] = 2
+    # Host-wide limits for expensive requests (see admission.py); needs flock, so not on Windows
+    app.config['ADMISSION_ENABLED'] = os.environ.get(
+        'PDF_EDITOR_ADMISSION', '1' if os.name == 'posix' else '0'
+    ) == '1'
+    app.config['ADMISSION_CAPACITY'] = int(
+        os.environ.get('PDF_EDITOR_ADMISSION_CAPACITY', max(4, (os.cpu_count() or 1) * 2))
+    )
+    app.config['ADMISSION_RESERVED'] = max(1, app.config['ADMISSION_CAPACITY'] // 4)
+    app.config['ADMISSION_QUEUE_SIZE'] = 8  # waiting requests per priority
+    app.config['ADMISSION_LIMITS'] = {
+        'ingest': 2,
+        'convert_to_word': 2,
+        'ocr_text': 2,
+        'extract_images': 2,
+        'optimize': 2,
+        'merge': 2,
+        'split': 2,
+        'extract_text': 4
+    }
+    # Identical concurrent renders and extractions share one computation (see singleflight.py)
+    app.config['SINGLEFLIGHT_ENABLED'] = os.environ.get('PDF_EDITOR_SINGLEFLIGHT', '1') == '1'
+    # Default for /optimize's linearize option (needs the qpdf command)
+    app.config['LINEARIZE_OUTPUT'] = os.environ.get('PDF_EDITOR_LINEARIZE', '0') == '1'
+    if config:
+        app.config.update(config)
+    
+    # Create directories if they don't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['HISTORY_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['FINGERPRINTS_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['INGEST_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['ADMISSION_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['SINGLEFLIGHT_FOLDER'], mode=0o700, exist_ok=True)  # private: see singleflight.py
+    os.makedirs('static/temp', exist_ok=True)
+    
+    edit_history.folder = app.config['HISTORY_FOLDER']
+    document_versions.folder = os.path.join(app.config['HISTORY_FOLDER'], 'documents')
+    fingerprint_store.folder = app.config['FINGERPRINTS_FOLDER']
+    ingest_store.folder = app.config['INGEST_FOLDER']
+    admission.folder = app.config['ADMISSION_FOLDER']
+    single_flight.folder = app.config['SINGLEFLIGHT_FOLDER']
+    admission.capacity = app.config['ADMISSION_CAPACITY']
+    admission.reserved = app.config['ADMISSION_RESERVED']
+    admission.queue_size = app.config['ADMISSION_QUEUE_SIZE']
+    admission.limits = app.config['ADMISSION_LIMITS']
+    # Each gunicorn worker writes its metrics here so /metrics can merge them
+    metrics.registry.folder = app.config['METRICS_FOLDER']
+    executor.configure(app.config['RENDER_WORKERS'])
+    
+    app.register_blueprint(bp)
+    
+    startup_timings['create_app'] = time.perf_counter() - started
+    _report_startup_timings(app.logger)
+    return app
+
+def preload_shared_state():
+    """
+    Import the lazily loaded subsystems and build read-only tables once.
+    
+    Call this in the gunicorn master (see gunicorn.conf.py) so every forked
+    worker inherits the loaded modules and tables instead of building its own.
+    """
+    started = time.perf_counter()
+    
+    import docx  # noqa: F401
+    import PyPDF2  # noqa: F401
+    pdf_operations._word_template_bytes()
+    
+    startup_timings['preload'] = time.perf_counter() - started
+
+def _report_startup_timings(logger):
+    for phase, seconds in startup_timings.items():
+        metrics.registry.set('pdf_startup_seconds', seconds, phase=phase, pid=os.getpid())
+    logger.info('Startup timings: ' + ', '.join(
+        f'{phase} {seconds * 1000:.1f} ms' for phase, seconds in startup_timings.items()
+    ))
+
+_default_app = None
 
-# Create directories if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-os.makedirs('static/temp', exist_ok=True)
+def __getattr__(name):
+    # ``app`` is built on first access (``gunicorn app:app``, ``from app import app``)
+    # so that importing this module has no side effects
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 80 * 1024 * 1024  # 80MB max file size
+def _collect_cache_metrics():
+    samples = []
+    for cache_name, cache in (('render', render_cache), ('text', text_cache)):
+        stats = cache.stats()
+        samples.append(('pdf_cache_hits_total', {'cache': cache_name}, stats['hits']))
+        samples.append(('pdf_cache_misses_total', {'cache': cache_name}, stats['misses']))
+        samples.append(('pdf_cache_entries', {'cache': cache_name}, stats['entries']))
+        samples.append(('pdf_cache_bytes', {'cache': cache_name}, stats['bytes']))
+    return samples
+
+metrics.registry.add_collector(_collect_cache_metrics)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+def _open_pdf(filepath):
+    """Open a PDF with PyMuPDF, recording the time spent in the open stage"""
+    with metrics.stage('fitz_open'):
+        return pdf_operations.open_document(filepath)
+
+def _cached_page_count(cache, filename, filepath):
+    """Return the page count of ``filename``, opening it only on a cache miss"""
+    page_count = cache.get((filename, 'page_count'))
+    if page_count is None:
+        facts = ingest_store.facts(filename)
+        if facts is not None:
+            page_count = facts['page_count']
+        else:
+            doc = _open_pdf(filepath)
+            page_count = len(doc)
+            doc.close()
+        cache.put((filename, 'page_count'), page_count)
+    return page_count
+
+def _coalesced(operation, key, compute):
+    """Run ``compute`` once for concurrent requests with the same operation and key"""
+    if not current_app.config['SINGLEFLIGHT_ENABLED']:
+        return compute()
+    value, shared = single_flight.run((operation,) + key, compute)
+    metrics.registry.inc('pdf_singleflight_total', operation=operation, outcome='shared' if shared else 'computed')
+    return value
+
+_ingest_pool = None
+_ingest_pool_lock = threading.Lock()
+
+def _start_ingest(filename, filepath):
+    """Queue the background analysis of a new upload; returns immediately"""
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            # Created on first use in the serving worker, after gevent has patched threading
+            _ingest_pool = ThreadPoolExecutor(
+                max_workers=current_app.config['INGEST_THREADS'], thread_name_prefix='ingest'
+            )
+    ingest_store.start(filename)
+    _ingest_pool.submit(
+        _ingest_document, current_app.logger, filename, filepath, current_app.config['ADMISSION_ENABLED']
+    )
+
+# Admission attempts an ingest makes before giving up; routes then work from the PDF itself
+INGEST_ADMISSION_ATTEMPTS = 6
+
+def _ingest_document(logger, filename, filepath, admitted=False):
+    """Fingerprint and analyze an upload so first interactions need no PDF parsing"""
+    ticket = None
+    try:
+        if admitted:
+            ticket = _admit_ingest(filename, filepath)
+        with metrics.stage('fingerprint'):
+            fingerprint_store.structural(filename, filepath)
+        with metrics.stage('ingest'):
+            facts = ingest_store.run(filename, filepath)
+        metrics.pages_processed('ingest', facts['page_count'])
+        logger.info(f"Ingested {filename}: {facts['page_count']} pages in {facts['seconds']:.2f}s")
+    except Exception as e:
+        logger.warning(f'Ingest failed for {filename}: {str(e)}')
+        ingest_store.mark_failed(filename, str(e))
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def _admit_ingest(filename, filepath):
+    """
+    Take batch-priority slots for ingesting an upload, like a batch request.
+    
+    There is no client to answer 503 to, so a rejected ingest waits the
+    Retry-After time and tries again; raises Rejected once it has tried
+    INGEST_ADMISSION_ATTEMPTS times.
+    """
+    cost = admission.cost(size=os.path.getsize(filepath))
+    for attempt in range(INGEST_ADMISSION_ATTEMPTS):
+        try:
+            ticket = admission.acquire('ingest', 'batch', cost)
+        except Rejected as e:
+            metrics.registry.inc('pdf_admission_total', operation='ingest', outcome='rejected')
+            if attempt == INGEST_ADMISSION_ATTEMPTS - 1:
+                raise
+            time.sleep(e.retry_after)
+            continue
+        metrics.registry.inc('pdf_admission_total', operation='ingest', outcome='admitted')
+        metrics.registry.observe('pdf_admission_wait_seconds', ticket.waited, priority='batch')
+        return ticket
+
+def _immutable_response(response):
+    """
+    Mark a response for a fixed document version as cacheable forever.
+    
+    Edits always write a new file, so anything derived from a given filename
+    never changes. The ETag is a hash of the body and matching If-None-Match
+    requests get a 304.
+    """
+    response.add_etag()
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+@functools.lru_cache(maxsize=1024)
+def _content_hash(filepath, mtime_ns, size):
+    import hashlib
+    
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as content_file:
+        for chunk in iter(lambda: content_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _file_etag(filepath):
+    """Content hash of a file, computed once per path, size and modification time"""
+    stat = os.stat(filepath)
+    return _content_hash(os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+def _parse_pages_param(value, page_count):
+    """Parse a ``pages=1-3,5`` query value (numbers and ranges) into valid 1-based page numbers"""
+    if not value:
+        return list(range(1, page_count + 1))
+    
+    pages = {}  # ordered, without duplicates
+    for part in value.split(','):
+        first, _, last = part.strip().partition('-')
+        if not first.isdigit() or not (last.isdigit() or not last):
+            continue
+        start, end = int(first), int(last or first)
+        for page in range(max(start, 1), min(end, page_count) + 1):
+            pages[page] = None
+    return list(pages)
+
+def _history_session_id():
+    """Return the edit history id for this browser session, creating one if needed"""
+    if 'history_id' not in session:
+        session['history_id'] = uuid.uuid4().hex
+    return session['history_id']
+
+def _version_path(filename):
+    """Path of a document version, which lives in either the upload or the processed folder"""
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
+    return filepath
+
+def _fingerprint_changes(parent, filename, pages):
+    """
+    Pages that differ between ``parent`` and ``filename`` by structural fingerprint.
+    
+    Falls back to ``pages`` (what the edit meant to touch) if either version
+    cannot be fingerprinted or the page count changed.
+    """
+    try:
+        with metrics.stage('fingerprint'):
+            base = fingerprint_store.structural(parent, _version_path(parent))
+            target = fingerprint_store.structural(filename, _version_path(filename))
+    except Exception as e:
+        current_app.logger.warning(f'Could not fingerprint {parent} -> {filename}: {str(e)}')
+        return pages
+    if len(base) != len(target):
+        return pages
+    return changed_pages(base, target)
+
+def _serialized_edit(view):
+    """
+    Run an edit route under its document's lock, against the document's latest version.
+    
+    The request's ``filename`` is the version the client edited, and the
+    document is the upload it descends from. If the document has moved on
+    since (an edit from another tab, session or worker), the edit is rebased
+    onto the latest version when the page it touches is unchanged there, and
+    rejected with 409 otherwise. Requests without a ``page_num`` change the
+    whole document, so any changed page is a conflict. Routes read the
+    version to edit from ``g.edit_base``.
+    """
+    @functools.wraps(view)
+    def wrapper():
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+        if not filename:
+            return view()
+        
+        document = document_versions.document(filename)
+        page_num = data.get('page_num')
+        try:
+            with document_versions.lock(document):
+                g.edit_document = document
+                g.edit_base = filename
+                head = document_versions.head(document)
+                if head != filename and os.path.exists(_version_path(head)):
+                    changed = _fingerprint_changes(filename, head, None)
+                    if changed is None or (page_num in changed if page_num is not None else changed):
+                        current_app.logger.info(f'Rejected stale edit of {filename}; latest version is {head}')
+                        return jsonify({
+                            'error': 'This page was changed by another edit; showing the latest version',
+                            'conflict': True,
+                            'current': head,
+                            'history': edit_history.state(_history_session_id())
+                        }), 409
+                    # The edited page is the same in both versions, so apply the edit to the latest
+                    current_app.logger.info(f'Rebased edit of {filename} onto {head}')
+                    g.edit_base = head
+                return view()
+        except TimeoutError:
+            response = jsonify({'error': 'Document is busy with another edit, retry shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+    
+    return wrapper
+
+def _next_version_filename(document):
+    """``<document>_v<n>.pdf`` for the next version of ``document``; call under its edit lock"""
+    name_part, ext = os.path.splitext(document)
+    # Uploads start with a uuid, so 60 characters stay unique and keep paths
+    # under Windows' 260-character limit
+    name_part = name_part[:60]
+    while True:
+        output_filename = f"{name_part}_v{document_versions.next_version(document)}{ext or '.pdf'}"
+        if not os.path.exists(os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)):
+            return output_filename
+
+def _record_edit(parent, filename, pages):
+    """
+    Record an edit in the session history and carry unchanged cached pages over.
+    
+    Returns ``(history, changed_pages)``; the changed pages come from the page
+    fingerprints of both versions, with ``pages`` as the fallback.
+    """
+    pages = _fingerprint_changes(parent, filename, pages)
+    # Edit routes run under the document lock (see _serialized_edit)
+    document_versions.record(g.edit_document, parent, filename)
+    discarded = edit_history.record(_history_session_id(), parent, filename, pages)
+    session['current_pdf'] = filename
+    
+    for cache in (render_cache, text_cache):
+        cache.copy_pages(parent, filename, skip_pages=pages)
+        # Versions dropped from the redo stack can never be reached again
+        for entry in discarded:
+            cache.invalidate(entry['filename'])
+    
+    return edit_history.state(_history_session_id()), pages
+
+@bp.before_app_request
+def _start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_started = time.perf_counter()
+    metrics.registry.inc('pdf_http_requests_in_flight', 1, route=g.metrics_route)
+    
+    if current_app.config['PROFILING_ENABLED'] and (
+            request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'):
+        profiler = RequestProfiler(current_app.config['PROFILES_FOLDER'])
+        if profiler.start():
+            g.profiler = profiler
+        else:
+            current_app.logger.info('Profiling skipped: another request is already being profiled')
+
+@bp.after_app_request
+def _record_request_metrics(response):
+    route = g.get('metrics_route', 'unmatched')
+    
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        filename = (request.view_args or {}).get('filename')
+        if filename is None and request.is_json:
+            filename = (request.get_json(silent=True) or {}).get('filename')
+        try:
+            profile_id = profiler.stop(route, filename, response.status_code)
+            response.headers['X-Profile-Id'] = profile_id
+            current_app.logger.info(f'Saved request profile {profile_id} for {route} ({filename})')
+        except Exception as e:
+            current_app.logger.warning(f'Failed to save request profile: {e}')
+    
+    if 'request_started' in g:
+        metrics.registry.observe(
+            'pdf_http_request_duration_seconds',
+            time.perf_counter() - g.request_started,
+            route=route
+        )
+    metrics.registry.inc('pdf_http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.registry.inc('pdf_http_request_bytes_total', request.content_length or 0, route=route)
+    metrics.registry.inc('pdf_http_response_bytes_total', response.content_length or 0, route=route)
+    return response
+
+@bp.teardown_app_request
+def _finish_request_metrics(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.abort()
+    
+    if 'metrics_route' in g:
+        metrics.registry.inc('pdf_http_requests_in_flight', -1, route=g.metrics_route)
+        metrics.registry.maybe_flush()
+
+def _admission_cost(operation):
+    """Estimate a request's cost from the pages it touches and the size of its documents"""
+    if operation in SINGLE_PAGE_OPERATIONS:
+        return admission.cost(pages=1)
+    
+    data = (request.get_json(silent=True) or {}) if request.is_json else {}
+    filenames = data.get('filenames') or [(request.view_args or {}).get('filename') or data.get('filename')]
+    pages = 0
+    size = 0
+    for filename in filenames:
+        if not isinstance(filename, str) or not filename:
+            continue
+        filepath = _version_path(filename)
+        if not os.path.exists(filepath):
+            continue  # the route answers 404
+        size += os.path.getsize(filepath)
+        # Only known page counts are used; opening the file here would cost what we are limiting
+        facts = ingest_store.facts(filename)
+        page_count = facts['page_count'] if facts else (
+            render_cache.peek((filename, 'page_count')) or text_cache.peek((filename, 'page_count'))
+        )
+        pages += page_count or 0
+    
+    if operation == 'text_blocks':
+        return admission.cost(pages=_uncached_text_pages(filenames[0], pages))
+    if operation in ('add_text', 'edit_text'):
+        return admission.cost(pages=1, size=size)  # one page changes, the whole file is saved
+    return admission.cost(pages=pages, size=size)
+
+def _uncached_text_pages(filename, page_count):
+    """Number of requested pages whose text blocks are neither cached nor stored at ingest"""
+    if ingest_store.facts(filename) is not None:
+        return 0
+    requested = request.args.get('pages')
+    if not page_count:
+        # Never opened in this worker, so nothing is cached yet; pages past
+        # what the whole capacity stands for cannot raise the cost further
+        return len(_parse_pages_param(requested, admission.capacity * PAGES_PER_UNIT)) if requested else 0
+    return sum(
+        1 for page_number in _parse_pages_param(requested, page_count)
+        if text_cache.peek((filename, page_number)) is None
+    )
+
+@bp.before_app_request
+def _admit_request():
+    entry = ADMISSION_OPERATIONS.get(request.endpoint)
+    if entry is None or not current_app.config['ADMISSION_ENABLED']:
+        return None
+    
+    operation, priority = entry
+    try:
+        ticket = admission.acquire(operation, priority, _admission_cost(operation))
+    except Rejected as e:
+        metrics.registry.inc('pdf_admission_total', operation=operation, outcome='rejected')
+        current_app.logger.warning(f'Rejected {operation} request: {e.reason}')
+        response = jsonify({'error': f'Server busy, retry in {e.retry_after}s', 'reason': e.reason})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    g.admission_ticket = ticket
+    metrics.registry.inc('pdf_admission_total', operation=operation, outcome='admitted')
+    metrics.registry.observe('pdf_admission_wait_seconds', ticket.waited, priority=priority)
+    return None
+
+@bp.after_app_request
+def _release_streamed_admission(response):
+    # A streamed body is produced after the request context is torn down, so
+    # its slots are held until the response is closed
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        if response.is_streamed:
+            response.call_on_close(ticket.release)
+        else:
+            ticket.release()
+    return response
+
+@bp.teardown_app_request
+def _release_admission(exc):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        ticket.release()
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Expose request, stage, page and cache metrics in Prometheus text format"""
+    return current_app.response_class(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@bp.route('/profiles')
+def get_profiles():
+    """List saved request profiles (route, file, duration, peak memory)"""
+    if not current_app.config['PROFILING_ENABLED']:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    
+    return jsonify({
+        'success': True,
+        'profiles': list_profiles(current_app.config['PROFILES_FOLDER'])
+    })
+
+@bp.route('/profiles/<profile_id>')
+def download_profile(profile_id):
+    """Download a saved profile: the pstats dump, or its JSON summary with ?format=json"""
+    if not current_app.config['PROFILING_ENABLED']:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    
+    extension = 'json' if request.args.get('format') == 'json' else 'prof'
+    filepath = os.path.join(current_app.config['PROFILES_FOLDER'], f"{secure_filename(profile_id)}.{extension}")
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'Profile not found'}), 404
+    
+    return send_file(os.path.abspath(filepath), as_attachment=True)
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/favicon.ico')
+@bp.route('/service-worker.js')
+def service_worker():
+    """Serve the service worker from the root so its scope covers the whole app"""
+    response = send_file(
+        os.path.join(current_app.static_folder, 'js', 'service-worker.js'),
+        mimetype='application/javascript'
+    )
+    # Browsers must always check for a new worker version
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@bp.route('/favicon.ico')
 def favicon():
     return '', 204  # No content
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'error': 'No file selected'}), 400
@@ -60,94 +652,217 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
         file.save(filepath)
         
-        # Store in session
+        if current_app.config['INGEST_ENABLED']:
+            _start_ingest(unique_filename, filepath)
+        
+        # Store in session and start a fresh undo/redo history
         session['current_pdf'] = unique_filename
+        edit_history.reset(_history_session_id(), unique_filename)
         
         return jsonify({
             'success': True,
             'filename': unique_filename,
+            'history': edit_history.state(_history_session_id()),
             'message': 'File uploaded successfully'
         })
     
     return jsonify({'error': 'Invalid file type. Please upload a PDF file.'}), 400
 
-@app.route('/preview/<filename>')
+@bp.route('/preview/<filename>')
 def preview_pdf(filename):
     try:
         # Check both upload and processed folders (processed first for edited files)
-        filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         
         if not os.path.exists(filepath):
-            app.logger.error(f'File not found: {filename}')
+            current_app.logger.error(f'File not found: {filename}')
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        app.logger.info(f'Loading preview for: {filename} from {filepath}')
-        
-        # Convert PDF pages to images for preview
-        doc = fitz.open(filepath)
-        pages = []
+        current_app.logger.info(f'Loading preview for: {filename} from {filepath}')
+        
+        ingest_status = ingest_store.status(filename)
+        facts = ingest_store.facts(filename) if ingest_status == 'ready' else None
+        page_count = _cached_page_count(render_cache, filename, filepath)
+        page_numbers = _parse_pages_param(request.args.get('pages'), page_count)
+        
+        # Images are fetched per page from /page_image so the browser loads
+        # (and caches) them independently; only their sizes are needed here
+        sizes = {}
+        unknown = []
+        for page_number in page_numbers:
+            size = render_cache.get((filename, page_number, 'size'))
+            if size is not None:
+                sizes[page_number] = size
+            elif facts is not None:
+                page_facts = facts['pages'][page_number - 1]
+                sizes[page_number] = _preview_size(fitz.Rect(0, 0, page_facts['width'], page_facts['height']))
+            else:
+                unknown.append(page_number)
         
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))  # Higher resolution
-            img_data = pix.tobytes("png")
-            img_base64 = base64.b64encode(img_data).decode()
-            
-            pages.append({
-                'page_num': page_num + 1,
-                'image': f"data:image/png;base64,{img_base64}",
-                'width': pix.width,
-                'height': pix.height
-            })
+        if unknown:
+            sizes.update(_coalesced('preview_sizes', (filename, tuple(unknown)),
+                                    lambda: _page_preview_sizes(filepath, unknown)))
         
-        doc.close()
+        pages = []
+        for page_number in page_numbers:
+            page = {
+                'page_num': page_number,
+                'image': url_for('editor.page_image', filename=filename, page_num=page_number),
+                'width': sizes[page_number][0],
+                'height': sizes[page_number][1]
+            }
+            if facts is not None:
+                page_facts = facts['pages'][page_number - 1]
+                page['thumbnail'] = url_for('editor.page_thumbnail', filename=filename, page_num=page_number)
+                page['is_image_based'] = page_facts['is_image_based']
+                page['classification'] = page_facts['classification']
+            pages.append(page)
+        metrics.pages_processed('preview', len(pages))
         
         response = jsonify({
             'success': True,
             'pages': pages,
-            'total_pages': len(pages),
-            'filename': filename,
-            'timestamp': str(uuid.uuid4())  # Unique identifier for cache busting
+            'total_pages': page_count,
+            'zoom': PREVIEW_ZOOM,
+            'filename': filename
         })
+        if ingest_status == 'pending':
+            # Thumbnails and page classes are added once ingest finishes
+            response.add_etag()
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        # A filename always refers to the same document version, so this never changes
+        return _immutable_response(response)
         
-        # Add cache control headers to prevent caching of preview data
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+    except Exception as e:
+        return jsonify({'error': f'Error processing PDF: {str(e)}'}), 500
+
+def _preview_size(rect):
+    rect = rect * fitz.Matrix(PREVIEW_ZOOM, PREVIEW_ZOOM)
+    return (rect.irect.width, rect.irect.height)
+
+def _page_preview_sizes(filepath, page_numbers):
+    """Rendered preview size of each page, read from the document"""
+    doc = _open_pdf(filepath)
+    try:
+        return {page_number: _preview_size(doc.load_page(page_number - 1).rect) for page_number in page_numbers}
+    finally:
+        doc.close()
+
+@bp.route('/thumbnail/<filename>/<int:page_num>')
+def page_thumbnail(filename, page_num):
+    """Serve the small JPEG made for a page when the document was ingested"""
+    thumbnail = ingest_store.thumbnail(filename, page_num)
+    if thumbnail is None:
+        return jsonify({'error': f'No thumbnail for page {page_num} of {filename}'}), 404
+    return _immutable_response(current_app.response_class(thumbnail, mimetype='image/jpeg'))
+
+@bp.route('/document_info/<filename>')
+def document_info(filename):
+    """Facts computed at upload: page sizes and classes, fonts, text layer; 202 while pending"""
+    status = ingest_store.status(filename)
+    if status is None:
+        return jsonify({'error': f'No upload analysis for {filename}'}), 404
+    if status == 'pending':
+        response = jsonify({'success': False, 'status': 'pending'})
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    
+    facts = ingest_store.facts(filename)
+    if facts is None:
+        return jsonify({'error': 'Document analysis failed'}), 500
+    return _immutable_response(jsonify(dict(facts, success=True)))
+
+@bp.route('/page_image/<filename>/<int:page_num>')
+def page_image(filename, page_num):
+    """Serve one rendered page in a format negotiated from Accept, rendering it on a cache miss"""
+    try:
+        quality_tier = request.args.get('quality', 'medium')
+        if quality_tier not in PREVIEW_QUALITY_TIERS:
+            return jsonify({'error': f'Unknown quality: {quality_tier}. Use one of: {", ".join(PREVIEW_QUALITY_TIERS)}'}), 400
         
-        return response
+        # Only clients that name WebP explicitly get it (browsers do for <img>)
+        webp = any(mimetype == 'image/webp' for mimetype, _ in request.accept_mimetypes)
+        variant = f"{'webp' if webp else 'classic'}:{quality_tier}"
+        
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
+        if not os.path.exists(filepath):
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        
+        if not os.path.exists(filepath):
+            return jsonify({'error': f'File not found: {filename}'}), 404
+        
+        page_count = _cached_page_count(render_cache, filename, filepath)
+        if page_num < 1 or page_num > page_count:
+            return jsonify({'error': f'Invalid page number: {page_num}'}), 404
+        
+        # Pages rendered for this version (or carried over from the version it
+        # was edited from) are served from the cache
+        page_data = render_cache.get((filename, page_num, variant))
+        if page_data is None:
+            # Users opening the same document at once wait for one render
+            img_data, mimetype, width, height = _coalesced(
+                'page_image', (filename, page_num, variant),
+                lambda: _render_page(filepath, page_num, webp, quality_tier)
+            )
+            page_data = {'image': img_data, 'mimetype': mimetype}
+            render_cache.put((filename, page_num, variant), page_data, size=len(img_data))
+            render_cache.put((filename, page_num, 'size'), (width, height))
+        
+        metrics.pages_processed('page_image', 1)
+        response = current_app.response_class(page_data['image'], mimetype=page_data['mimetype'])
+        response.vary.add('Accept')
+        return _immutable_response(response)
         
     except Exception as e:
-        return jsonify({'error': f'Error processing PDF: {str(e)}'}), 500
+        current_app.logger.error(f'Error rendering page {page_num} of {filename}: {str(e)}')
+        return jsonify({'error': f'Error rendering page: {str(e)}'}), 500
+
+def _render_page(filepath, page_num, webp, quality_tier):
+    """Render one preview image: ``(bytes, mimetype, width, height)``"""
+    # Rendered inline, or in the process pool in async mode
+    results = executor.map_pages(
+        executor.render_pages, filepath, [page_num], PREVIEW_ZOOM,
+        webp, PREVIEW_QUALITY_TIERS[quality_tier]
+    )
+    img_data, mimetype, width, height, seconds = results[page_num]
+    metrics.observe_stage('render_page', seconds)
+    return img_data, mimetype, width, height
+
+def _ingested_pages_text(filename, page_count):
+    """Plain text of every page as stored at ingest time, in /extract_text's format"""
+    pages_text = []
+    for page_number in range(1, page_count + 1):
+        ingested = ingest_store.page_text(filename, page_number)
+        pages_text.append({
+            'page_num': page_number,
+            'text': ingested['text'] if ingested else ''
+        })
+    metrics.pages_processed('extract_text', len(pages_text))
+    return pages_text
 
-@app.route('/extract_text/<filename>')
+@bp.route('/extract_text/<filename>')
 def extract_text(filename):
     try:
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        doc = fitz.open(filepath)
-        pages_text = []
-        
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text = page.get_text()
-            pages_text.append({
-                'page_num': page_num + 1,
-                'text': text
-            })
-        
-        doc.close()
+        facts = ingest_store.facts(filename)
+        if facts is not None:
+            pages_text = _ingested_pages_text(filename, facts['page_count'])
+        else:
+            pages_text = pdf_operations.extract_text(filepath)
         
         return jsonify({
             'success': True,
@@ -155,117 +870,127 @@ def extract_text(filename):
         })
         
     except Exception as e:
-        app.logger.error(f'Error extracting text from {filename}: {str(e)}')
+        current_app.logger.error(f'Error extracting text from {filename}: {str(e)}')
         return jsonify({'error': f'Error extracting text: {str(e)}'}), 500
 
-@app.route('/get_text_blocks/<filename>')
+@bp.route('/extract_images/<filename>')
+def extract_images(filename):
+    """
+    Stream a zip of every image in the PDF, written as it is read.
+    
+    Images shared by several pages are extracted once, and JPEG/JPEG 2000
+    images are copied out as their original streams, so large catalogues are
+    bound by I/O rather than by decoding. manifest.json maps images to pages.
+    
+    With a process pool (async serving) the zip is written to the processed
+    folder by a pool process and sent from there instead.
+    """
+    download_name = f"{os.path.splitext(filename)[0]}_images.zip"
+    try:
+        filepath = _version_path(filename)
+        if not os.path.exists(filepath):
+            return jsonify({'error': f'File not found: {filename}'}), 404
+        
+        if executor.enabled():
+            zip_path = os.path.join(current_app.config['PROCESSED_FOLDER'], download_name)
+            if not os.path.exists(zip_path):
+                executor.run(pdf_operations.write_images_zip, filepath, zip_path)
+            return _send_download(zip_path, download_name, 'application/zip')
+        
+        chunks = pdf_operations.images_zip(filepath)
+        # Opens the document and reads the first image before the response
+        # starts, so a broken file still gets a JSON error
+        first_chunk = next(chunks)
+    except Exception as e:
+        current_app.logger.error(f'Error extracting images from {filename}: {str(e)}')
+        return jsonify({'error': f'Error extracting images: {str(e)}'}), 500
+    
+    response = current_app.response_class(itertools.chain([first_chunk], chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    # Output for a filename never changes, like downloads
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/get_text_blocks/<filename>')
 def get_text_blocks(filename):
     try:
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
-            app.logger.error(f'File not found: {filename}')
+            current_app.logger.error(f'File not found: {filename}')
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        doc = fitz.open(filepath)
-        pages_blocks = []
+        page_count = _cached_page_count(text_cache, filename, filepath)
+        page_numbers = _parse_pages_param(request.args.get('pages'), page_count)
+        
+        extracted = {}
+        missing = []
+        for page_number in page_numbers:
+            text_blocks = text_cache.get((filename, page_number))
+            if text_blocks is None:
+                # Uploads have their text blocks extracted at ingest time
+                ingested = ingest_store.page_text(filename, page_number)
+                if ingested is not None:
+                    text_blocks = ingested['blocks']
+                    text_cache.put(
+                        (filename, page_number),
+                        text_blocks,
+                        size=sum(len(block['text']) + 100 for block in text_blocks)
+                    )
+            if text_blocks is None:
+                missing.append(page_number)
+            else:
+                extracted[page_number] = text_blocks
         
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text_blocks = []
-            
-            try:
-                # Try to get structured text blocks first
-                blocks = page.get_text("dict")
-                
-                for block in blocks["blocks"]:
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                if span["text"].strip():  # Only include non-empty text
-                                    text_blocks.append({
-                                        'text': span["text"],
-                                        'bbox': span["bbox"],  # [x0, y0, x1, y1]
-                                        'font': span.get("font", "unknown"),
-                                        'size': span.get("size", 12),
-                                        'flags': span.get("flags", 0),
-                                        'color': span.get("color", 0)
-                                    })
-                
-                # If no structured text found, try alternative methods
-                if not text_blocks:
-                    # Try getting text with bboxes using a different method
-                    text_dict = page.get_text("rawdict")
-                    for block in text_dict.get("blocks", []):
-                        if block.get("type") == 0:  # Text block
-                            for line in block.get("lines", []):
-                                for span in line.get("spans", []):
-                                    if span.get("text", "").strip():
-                                        text_blocks.append({
-                                            'text': span["text"],
-                                            'bbox': span["bbox"],
-                                            'font': span.get("font", "unknown"),
-                                            'size': span.get("size", 12),
-                                            'flags': span.get("flags", 0),
-                                            'color': span.get("color", 0)
-                                        })
-                
-                # If still no text, try simple text extraction with manual bbox estimation
-                if not text_blocks:
-                    simple_text = page.get_text()
-                    if simple_text.strip():
-                        # Create a single text block for the entire page content
-                        page_rect = page.rect
-                        text_blocks.append({
-                            'text': simple_text,
-                            'bbox': [50, 50, page_rect.width - 50, page_rect.height - 50],
-                            'font': "unknown",
-                            'size': 12,
-                            'flags': 0,
-                            'color': 0
-                        })
-                
-            except Exception as text_error:
-                # Fallback for problematic pages
-                try:
-                    simple_text = page.get_text()
-                    if simple_text.strip():
-                        page_rect = page.rect
-                        text_blocks.append({
-                            'text': simple_text,
-                            'bbox': [50, 50, page_rect.width - 50, page_rect.height - 50],
-                            'font': "unknown",
-                            'size': 12,
-                            'flags': 0,
-                            'color': 0
-                        })
-                except:
-                    pass  # Skip problematic pages
-            
-            pages_blocks.append({
-                'page_num': page_num + 1,
-                'blocks': text_blocks
-            })
+        if missing:
+            results = _coalesced('text_blocks', (filename, tuple(missing)),
+                                 lambda: _extract_text_blocks(filepath, missing))
+        else:
+            results = {}
+        for page_number, text_blocks in results.items():
+            text_cache.put(
+                (filename, page_number),
+                text_blocks,
+                size=sum(len(block['text']) + 100 for block in text_blocks)
+            )
+            extracted[page_number] = text_blocks
         
-        doc.close()
+        pages_blocks = [
+            {'page_num': page_number, 'blocks': extracted[page_number]}
+            for page_number in page_numbers
+        ]
         
-        return jsonify({
+        metrics.pages_processed('text_blocks', len(pages_blocks))
+        
+        return _immutable_response(jsonify({
             'success': True,
             'pages_blocks': pages_blocks
-        })
+        }))
         
     except Exception as e:
-        app.logger.error(f'Error getting text blocks from {filename}: {str(e)}')
+        current_app.logger.error(f'Error getting text blocks from {filename}: {str(e)}')
         return jsonify({'error': f'Error getting text blocks: {str(e)}'}), 500
 
-@app.route('/add_text', methods=['POST'])
+def _extract_text_blocks(filepath, page_numbers):
+    """Text blocks of ``page_numbers``, extracted inline or in the process pool"""
+    results = executor.map_pages(executor.extract_text_blocks, filepath, page_numbers)
+    extracted = {}
+    for page_number, (text_blocks, seconds) in results.items():
+        metrics.observe_stage('text_extraction', seconds)
+        extracted[page_number] = text_blocks
+    return extracted
+
+@bp.route('/add_text', methods=['POST'])
+@_serialized_edit
 def add_text():
     try:
         data = request.json
-        filename = data.get('filename')
+        filename = g.get('edit_base') or data.get('filename')
         page_num = data.get('page_num', 1)
         text = data.get('text', '')
         x = data.get('x', 100)
@@ -276,48 +1001,28 @@ def add_text():
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
         
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
         
-        # Create new PDF with added text
-        doc = fitz.open(filepath)
-        page = doc.load_page(page_num - 1)
-        
-        # Get page dimensions for coordinate conversion
-        page_rect = page.rect
-        page_height = page_rect.height
-        
-        # Convert coordinates - PDF coordinate system has origin at bottom-left
-        # but user interface expects top-left origin
-        pdf_x = x
-        pdf_y = page_height - y  # Flip Y coordinate
-        
-        # Create text rectangle for better positioning
-        text_rect = fitz.Rect(pdf_x, pdf_y - font_size, pdf_x + 200, pdf_y + 5)
-        
-        # Insert text with better formatting
-        page.insert_textbox(
-            text_rect,
-            text,
-            fontsize=font_size,
-            color=color,
-            fontname="helv",  # Helvetica font
-            align=0  # Left align
+        output_filename = _next_version_filename(g.edit_document)
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
+        pdf_x, pdf_y = executor.run(
+            pdf_operations.add_text, filepath, output_path, page_num, text, x, y, font_size, color
         )
         
-        # Save modified PDF
-        output_filename = f"modified_{uuid.uuid4()}_{filename}"
-        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-        doc.save(output_path)
-        doc.close()
+        history, changed = _record_edit(filename, output_filename, [page_num])
         
         return jsonify({
             'success': True,
             'modified_filename': output_filename,
+            'parent': filename,
+            'rebased': filename != data.get('filename'),
+            'changed_pages': changed,
+            'history': history,
             'message': 'Text added successfully',
             'coordinates': {'x': pdf_x, 'y': pdf_y, 'original_y': y}
         })
@@ -325,290 +1030,204 @@ def add_text():
     except Exception as e:
         return jsonify({'error': f'Error adding text: {str(e)}'}), 500
 
-@app.route('/edit_text', methods=['POST'])
+@bp.route('/edit_text', methods=['POST'])
+@_serialized_edit
 def edit_text():
     try:
         data = request.json
-        app.logger.info(f'Edit text request: {data}')
+        current_app.logger.info(f'Edit text request: {data}')
         
-        filename = data.get('filename')
+        filename = g.get('edit_base') or data.get('filename')
         page_num = data.get('page_num', 1)
         old_text = data.get('old_text', '')
         new_text = data.get('new_text', '')
         bbox = data.get('bbox')  # [x0, y0, x1, y1]
+        mode = data.get('mode', 'redact')
         
         if not filename:
-            app.logger.error('No filename provided')
+            current_app.logger.error('No filename provided')
             return jsonify({'error': 'No filename provided'}), 400
+        
+        if mode not in ('redact', 'cover'):
+            return jsonify({'error': f'Unknown edit mode: {mode}'}), 400
             
         if not bbox or len(bbox) != 4:
-            app.logger.error(f'Invalid bbox: {bbox}')
+            current_app.logger.error(f'Invalid bbox: {bbox}')
             return jsonify({'error': 'Invalid bounding box coordinates'}), 400
         
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
-            app.logger.error(f'File not found: {filename}')
+            current_app.logger.error(f'File not found: {filename}')
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        app.logger.info(f'Opening PDF: {filepath}')
-        
-        # Open the PDF
-        doc = fitz.open(filepath)
-        
-        if page_num < 1 or page_num > len(doc):
-            doc.close()
-            app.logger.error(f'Invalid page number: {page_num}')
+        if page_num < 1 or page_num > _cached_page_count(render_cache, filename, filepath):
+            current_app.logger.error(f'Invalid page number: {page_num}')
             return jsonify({'error': f'Invalid page number: {page_num}'}), 400
         
-        page = doc.load_page(page_num - 1)
-        
-        # Validate and adjust bbox coordinates if needed
-        page_rect = page.rect
-        bbox[0] = max(0, min(bbox[0], page_rect.width))
-        bbox[1] = max(0, min(bbox[1], page_rect.height))
-        bbox[2] = max(bbox[0], min(bbox[2], page_rect.width))
-        bbox[3] = max(bbox[1], min(bbox[3], page_rect.height))
-        
-        # Create a white rectangle to cover the old text with minimal padding
-        padding = 1  # Minimal padding to avoid covering adjacent text
-        rect = fitz.Rect(
-            max(0, bbox[0] - padding), 
-            max(0, bbox[1] - padding), 
-            min(page_rect.width, bbox[2] + padding), 
-            min(page_rect.height, bbox[3] + padding)
-        )
-        page.draw_rect(rect, color=None, fill=(1, 1, 1))  # White fill
-        app.logger.info(f'Covered old text area: {rect}')
-        
-        # Add the new text at the same position if provided
-        if new_text and new_text.strip():
-            # Get font preservation settings
-            font_info = data.get('font_info', {})
-            preserve_formatting = data.get('preserve_formatting', True)
-            
-            if preserve_formatting and font_info:
-                # Use original font properties
-                font_size = font_info.get('size', 12)
-                font_name = font_info.get('font', 'Arial')
-                font_color = font_info.get('color', 0)
-                font_flags = font_info.get('flags', 0)
-                
-                app.logger.info(f'Using preserved formatting - Font: {font_name}, Size: {font_size}, Color: {font_color}, Flags: {font_flags}')
-                
-                # Convert font color from integer to RGB tuple
-                if isinstance(font_color, int):
-                    if font_color == 0:
-                        color_rgb = (0, 0, 0)  # Black
-                    else:
-                        # Extract RGB components from integer (BGR format in PyMuPDF)
-                        b = (font_color & 0xFF) / 255.0
-                        g = ((font_color >> 8) & 0xFF) / 255.0
-                        r = ((font_color >> 16) & 0xFF) / 255.0
-                        color_rgb = (r, g, b)
-                else:
-                    color_rgb = (0, 0, 0)  # Default to black
-                
-                # Enhanced font mapping with better support for common fonts
-                base_font = 'helv'  # Default fallback
-                font_name_lower = font_name.lower()
-                
-                # Map common font families
-                if any(name in font_name_lower for name in ['arial', 'helvetica']):
-                    base_font = 'helv'
-                elif any(name in font_name_lower for name in ['times', 'roman']):
-                    base_font = 'times'
-                elif any(name in font_name_lower for name in ['courier', 'mono']):
-                    base_font = 'cour'
-                elif 'symbol' in font_name_lower:
-                    base_font = 'symb'
-                elif 'zapf' in font_name_lower:
-                    base_font = 'zadb'
-                
-                # Apply style flags more robustly
-                is_bold = bool(font_flags & (1 << 4)) or 'bold' in font_name_lower
-                is_italic = bool(font_flags & (1 << 6)) or any(style in font_name_lower for style in ['italic', 'oblique'])
-                
-                if is_bold and is_italic:
-                    if base_font == 'times':
-                        base_font = 'times-bolditalic'
-                    elif base_font == 'helv':
-                        base_font = 'helv-boldoblique'
-                    elif base_font == 'cour':
-                        base_font = 'cour-boldoblique'
-                elif is_bold:
-                    base_font += '-bold'
-                elif is_italic:
-                    if base_font == 'times':
-                        base_font += '-italic'
-                    else:
-                        base_font += '-oblique'
-                
-                app.logger.info(f'Mapped font: {font_name} -> {base_font}')
-            else:
-                # Use default formatting
-                bbox_height = bbox[3] - bbox[1]
-                font_size = min(12, max(8, bbox_height * 0.7))
-                base_font = 'helv'
-                color_rgb = (0, 0, 0)
-            
-            # Calculate text position - use more accurate positioning
-            text_x = bbox[0]
-            text_y = bbox[3] - 2  # Slightly above the bottom of the original text bbox
-            
-            # Try multiple insertion methods with better error handling
-            text_inserted = False
-            
-            # Method 1: Try with preserved font
-            if preserve_formatting and font_info:
-                try:
-                    page.insert_text(
-                        (text_x, text_y), 
-                        new_text, 
-                        fontsize=font_size, 
-                        color=color_rgb,
-                        fontname=base_font
-                    )
-                    app.logger.info(f'Text inserted with preserved font: {base_font}')
-                    text_inserted = True
-                except Exception as font_error:
-                    app.logger.warning(f'Preserved font insertion failed: {font_error}')
-            
-            # Method 2: Try with basic helvetica
-            if not text_inserted:
-                try:
-                    page.insert_text(
-                        (text_x, text_y), 
-                        new_text, 
-                        fontsize=font_size, 
-                        color=color_rgb,
-                        fontname='helv'
-                    )
-                    app.logger.info('Text inserted with helvetica fallback')
-                    text_inserted = True
-                except Exception as helv_error:
-                    app.logger.warning(f'Helvetica insertion failed: {helv_error}')
-            
-            # Method 3: Try with no font specification
-            if not text_inserted:
-                try:
-                    page.insert_text(
-                        (text_x, text_y), 
-                        new_text, 
-                        fontsize=font_size, 
-                        color=(0, 0, 0)
-                    )
-                    app.logger.info('Text inserted with default font')
-                    text_inserted = True
-                except Exception as default_error:
-                    app.logger.warning(f'Default font insertion failed: {default_error}')
-            
-            # Method 4: Last resort - use textbox
-            if not text_inserted:
-                try:
-                    text_rect = fitz.Rect(bbox[0], bbox[1], bbox[2], bbox[3])
-                    page.insert_textbox(
-                        text_rect,
-                        new_text,
-                        fontsize=font_size,
-                        color=(0, 0, 0),
-                        align=0
-                    )
-                    app.logger.info('Text inserted using textbox fallback')
-                    text_inserted = True
-                except Exception as textbox_error:
-                    app.logger.error(f'All text insertion methods failed: {textbox_error}')
-            
-            if not text_inserted:
-                raise Exception("Failed to insert text using any method")
-        
-        # Generate a shorter, more manageable filename
-        base_name = os.path.basename(filename)
+        # Versions are numbered per document under its edit lock, so concurrent
+        # edits never write the same file
+        output_filename = _next_version_filename(g.edit_document)
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
+        os.makedirs(current_app.config['PROCESSED_FOLDER'], exist_ok=True)
         
-        # If filename is too long, truncate it but keep the extension
-        if len(base_name) > 50:
-            name_part, ext = os.path.splitext(base_name)
-            base_name = name_part[:40] + "..." + ext
-        
-        # Create output filename with timestamp for uniqueness
-        import time
-        timestamp = int(time.time())
-        output_filename = f"edited_{timestamp}_{base_name}"
+        current_app.logger.info(f'Editing {filepath} into {output_path}')
+        executor.run(
+            pdf_operations.edit_text, filepath, output_path, page_num, bbox, new_text, mode,
+            data.get('origin'), data.get('font_info', {}), data.get('preserve_formatting', True)
+        )
         
-        # Ensure the full path isn't too long for Windows (260 char limit)
-        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-        if len(output_path) > 250:  # Leave some buffer
-            # Use just timestamp and extension if still too long
-            name_part, ext = os.path.splitext(base_name)
-            output_filename = f"edited_{timestamp}{ext}"
-            output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+        history, changed = _record_edit(filename, output_filename, [page_num])
         
-        app.logger.info(f'Saving edited PDF to: {output_path}')
+        return jsonify({
+            'success': True,
+            'modified_filename': output_filename,
+            'parent': filename,
+            'rebased': filename != data.get('filename'),
+            'changed_pages': changed,
+            'history': history,
+            'message': 'Text edited successfully'
+        })
         
-        # Ensure the output directory exists
-        os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
+    except Exception as e:
+        current_app.logger.error(f'Error editing text: {str(e)}', exc_info=True)
+        return jsonify({'error': f'Error editing text: {str(e)}'}), 500
+
+@bp.route('/undo', methods=['POST'])
+def undo_edit():
+    """Step back to the previous version in this session's edit history"""
+    return _step_history(edit_history.undo, 'Nothing to undo')
+
+@bp.route('/redo', methods=['POST'])
+def redo_edit():
+    """Step forward to the next version in this session's edit history"""
+    return _step_history(edit_history.redo, 'Nothing to redo')
+
+@bp.route('/history')
+def get_history():
+    """Report whether undo and redo are currently available"""
+    return jsonify({
+        'success': True,
+        'history': edit_history.state(_history_session_id())
+    })
+
+@bp.route('/events')
+def version_events():
+    """
+    Server-Sent Events stream announcing each new document version in this session.
+    
+    Sends ``event: version`` with the version number, the new filename, its
+    parent and the changed pages as soon as a save (or undo/redo) completes.
+    The history file is polled, so a change made by any worker is seen.
+    """
+    if not current_app.config['EVENTS_ENABLED']:
+        return jsonify({'error': 'Change notifications are disabled'}), 404
+    
+    sid = _history_session_id()
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_seen = int(last_event_id) if last_event_id.isdigit() else edit_history.last_change(sid)[0]
+    poll_interval = current_app.config['EVENTS_POLL_INTERVAL']
+    stream_seconds = current_app.config['EVENTS_STREAM_SECONDS']
+    
+    def stream(last_seen):
+        # The id lets a reconnecting EventSource resume from this version
+        yield f"retry: 1000\nid: {last_seen}\n\n"
+        deadline = time.monotonic() + stream_seconds
+        idle_polls = 0
+        while time.monotonic() < deadline:
+            version, change = edit_history.last_change(sid)
+            if version > last_seen and change:
+                payload = {
+                    'version': version,
+                    'filename': change['filename'],
+                    'parent': change['parent'],
+                    'changed_pages': change['pages'],
+                    'history': edit_history.state(sid)
+                }
+                yield f"id: {version}\nevent: version\ndata: {json.dumps(payload)}\n\n"
+                idle_polls = 0
+            elif idle_polls * poll_interval >= 15:
+                yield ': keep-alive\n\n'
+                idle_polls = 0
+            last_seen = max(last_seen, version)
+            idle_polls += 1
+            time.sleep(poll_interval)
+    
+    response = current_app.response_class(stream(last_seen), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+def _step_history(step, empty_message):
+    try:
+        parent = edit_history.state(_history_session_id())['current']
+        result = step(_history_session_id())
+        if result is None:
+            return jsonify({'error': empty_message}), 400
+        
+        filename, changed_pages = result
+        if not os.path.exists(os.path.join(current_app.config['PROCESSED_FOLDER'], filename)) and \
+                not os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], filename)):
+            return jsonify({'error': f'File not found: {filename}'}), 404
         
-        # Try to save with different methods if the first fails
-        save_successful = False
+        session['current_pdf'] = filename
+        # Later edits of the document start from the version stepped to
+        document = document_versions.document(filename)
+        with document_versions.lock(document):
+            document_versions.set_head(document, filename)
+        current_app.logger.info(f'History moved to {filename} (pages changed: {changed_pages})')
         
-        try:
-            # Method 1: Standard save
-            doc.save(output_path)
-            save_successful = True
-            app.logger.info('PDF saved successfully with standard method')
-        except Exception as save_error:
-            app.logger.warning(f'Standard save failed: {save_error}')
-            
-            # Method 2: Try with different save options
-            try:
-                doc.save(output_path, garbage=0, clean=False, deflate=False)
-                save_successful = True
-                app.logger.info('PDF saved successfully with alternative options')
-            except Exception as alt_save_error:
-                app.logger.warning(f'Alternative save failed: {alt_save_error}')
-                
-                # Method 3: Try saving to a temporary file first, then move
-                try:
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-                        temp_path = temp_file.name
-                    
-                    doc.save(temp_path)
-                    
-                    # Move the temp file to the final location
-                    import shutil
-                    shutil.move(temp_path, output_path)
-                    save_successful = True
-                    app.logger.info('PDF saved successfully using temporary file method')
-                    
-                except Exception as temp_save_error:
-                    app.logger.error(f'All save methods failed: {temp_save_error}')
-                    # Clean up temp file if it exists
-                    try:
-                        if 'temp_path' in locals() and os.path.exists(temp_path):
-                            os.unlink(temp_path)
-                    except:
-                        pass
+        # Only the pages touched by the edit differ between the two versions;
+        # everything else is already cached for the target version.
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'parent': parent,
+            'changed_pages': changed_pages,
+            'history': edit_history.state(_history_session_id())
+        })
         
-        doc.close()
+    except Exception as e:
+        current_app.logger.error(f'Error stepping edit history: {str(e)}')
+        return jsonify({'error': f'Error updating edit history: {str(e)}'}), 500
+
+@bp.route('/diff/<base>/<target>')
+def diff_versions(base, target):
+    """
+    List the pages that differ between two document versions.
+    
+    Uses the stored page fingerprints; pages whose structure changed are
+    compared again at low resolution, so rewrites that render the same (like
+    a lossless /optimize) are not reported.
+    """
+    try:
+        base_path = _version_path(base)
+        target_path = _version_path(target)
+        for filename, filepath in ((base, base_path), (target, target_path)):
+            if not os.path.exists(filepath):
+                return jsonify({'error': f'File not found: {filename}'}), 404
         
-        if not save_successful:
-            raise Exception("Failed to save PDF using any method")
+        with metrics.stage('fingerprint_diff'):
+            changed, added, removed = fingerprint_store.diff(base, base_path, target, target_path)
         
-        return jsonify({
+        # Both versions are immutable, so their diff is too
+        return _immutable_response(jsonify({
             'success': True,
-            'modified_filename': output_filename,
-            'message': 'Text edited successfully'
-        })
+            'base': base,
+            'target': target,
+            'changed_pages': changed,
+            'added_pages': added,
+            'removed_pages': removed
+        }))
         
     except Exception as e:
-        app.logger.error(f'Error editing text: {str(e)}', exc_info=True)
-        return jsonify({'error': f'Error editing text: {str(e)}'}), 500
+        current_app.logger.error(f'Error comparing {base} with {target}: {str(e)}')
+        return jsonify({'error': f'Error comparing versions: {str(e)}'}), 500
 
-@app.route('/merge_pdfs', methods=['POST'])
+@bp.route('/merge_pdfs', methods=['POST'])
 def merge_pdfs():
     try:
         data = request.json
@@ -617,20 +1236,13 @@ def merge_pdfs():
         if len(filenames) < 2:
             return jsonify({'error': 'At least 2 files required for merging'}), 400
         
-        merger = PyPDF2.PdfMerger()
-        
-        for filename in filenames:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                merger.append(filepath)
+        filepaths = [
+            os.path.join(current_app.config['UPLOAD_FOLDER'], filename) for filename in filenames
+        ]
         
         output_filename = f"merged_{uuid.uuid4()}.pdf"
-        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-        
-        with open(output_path, 'wb') as output_file:
-            merger.write(output_file)
-        
-        merger.close()
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
+        executor.run(pdf_operations.merge_pdfs, [path for path in filepaths if os.path.exists(path)], output_path)
         
         return jsonify({
             'success': True,
@@ -641,7 +1253,7 @@ def merge_pdfs():
     except Exception as e:
         return jsonify({'error': f'Error merging PDFs: {str(e)}'}), 500
 
-@app.route('/split_pdf', methods=['POST'])
+@bp.route('/split_pdf', methods=['POST'])
 def split_pdf():
     try:
         data = request.json
@@ -652,29 +1264,19 @@ def split_pdf():
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
         
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
         
-        with open(filepath, 'rb') as input_file:
-            reader = PyPDF2.PdfReader(input_file)
-            writer = PyPDF2.PdfWriter()
-            
-            total_pages = len(reader.pages)
-            if not end_page:
-                end_page = total_pages
-            
-            for page_num in range(start_page - 1, min(end_page, total_pages)):
-                writer.add_page(reader.pages[page_num])
-            
-            output_filename = f"split_{start_page}-{end_page}_{uuid.uuid4()}_{filename}"
-            output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-            
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+        if not end_page:
+            end_page = _cached_page_count(render_cache, filename, filepath)
+        
+        output_filename = f"split_{start_page}-{end_page}_{uuid.uuid4()}_{filename}"
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
+        executor.run(pdf_operations.split_pdf, filepath, output_path, start_page, end_page)
         
         return jsonify({
             'success': True,
@@ -685,34 +1287,105 @@ def split_pdf():
     except Exception as e:
         return jsonify({'error': f'Error splitting PDF: {str(e)}'}), 500
 
-@app.route('/download/<filename>')
+# Optimization presets: which images get resampled (above dpi_threshold, down
+# to dpi_target at the given JPEG quality) and whether fonts are subset.
+# Every preset collects garbage, deduplicates objects and deflates streams.
+OPTIMIZE_PRESETS = {
+    'lossless': {'dpi_threshold': None, 'dpi_target': 0, 'quality': 0, 'subset_fonts': True},
+    'balanced': {'dpi_threshold': 225, 'dpi_target': 150, 'quality': 80, 'subset_fonts': True},
+    'small': {'dpi_threshold': 120, 'dpi_target': 96, 'quality': 60, 'subset_fonts': True},
+}
+
+@bp.route('/optimize', methods=['POST'])
+@_serialized_edit
+def optimize_pdf():
+    """Write a smaller copy of a PDF using one of the OPTIMIZE_PRESETS, as the document's next version"""
+    try:
+        data = request.json
+        filename = g.get('edit_base') or data.get('filename')
+        preset_name = data.get('preset', 'balanced')
+        linearize = data.get('linearize', current_app.config['LINEARIZE_OUTPUT'])
+        
+        if not filename:
+            return jsonify({'error': 'No filename provided'}), 400
+        
+        preset = OPTIMIZE_PRESETS.get(preset_name)
+        if preset is None:
+            return jsonify({'error': f'Unknown preset: {preset_name}. Use one of: {", ".join(OPTIMIZE_PRESETS)}'}), 400
+        
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
+        if not os.path.exists(filepath):
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        
+        if not os.path.exists(filepath):
+            return jsonify({'error': f'File not found: {filename}'}), 404
+        
+        output_filename = _next_version_filename(g.edit_document)
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
+        
+        page_count = executor.run(pdf_operations.optimize, filepath, output_path, preset)
+        
+        linearized = False
+        if linearize:
+            with metrics.stage('linearize'):
+                linearized = _linearize_pdf(output_path)
+        
+        before_bytes = os.path.getsize(filepath)
+        after_bytes = os.path.getsize(output_path)
+        current_app.logger.info(
+            f'Optimized {filename} with preset {preset_name}: {before_bytes} -> {after_bytes} bytes'
+        )
+        
+        metrics.pages_processed('optimize', page_count)
+        # Resampled images and subset fonts can change how any page renders;
+        # /diff tells which pages actually look different
+        history, _ = _record_edit(filename, output_filename, list(range(1, page_count + 1)))
+        
+        return jsonify({
+            'success': True,
+            'optimized_filename': output_filename,
+            'parent': filename,
+            'rebased': filename != data.get('filename'),
+            'preset': preset_name,
+            'bytes_before': before_bytes,
+            'bytes_after': after_bytes,
+            'bytes_saved': before_bytes - after_bytes,
+            'linearized': linearized,
+            'history': history,
+            'message': f'PDF optimized ({before_bytes} -> {after_bytes} bytes)'
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f'Error optimizing PDF: {str(e)}')
+        return jsonify({'error': f'Error optimizing PDF: {str(e)}'}), 500
+
+@bp.route('/download/<filename>')
 def download_file(filename):
     try:
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         
         if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True)
+            return _send_download(filepath, filename)
         else:
             return jsonify({'error': 'File not found'}), 404
             
     except Exception as e:
         return jsonify({'error': f'Error downloading file: {str(e)}'}), 500
 
-@app.route('/download_word/<filename>')
+@bp.route('/download_word/<filename>')
 def download_word_file(filename):
     """Download Word document files"""
     try:
         # Word files are always in processed folder
-        filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if os.path.exists(filepath):
-            return send_file(
-                filepath, 
-                as_attachment=True,
-                download_name=filename,
+            return _send_download(
+                filepath,
+                filename,
                 mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
             )
         else:
@@ -721,28 +1394,79 @@ def download_word_file(filename):
     except Exception as e:
         return jsonify({'error': f'Error downloading Word file: {str(e)}'}), 500
 
-@app.route('/ocr_text/<filename>')
+def _linearize_pdf(path):
+    """
+    Rewrite ``path`` in place as a linearized (fast web view) PDF.
+    
+    MuPDF no longer writes linearized files, so this uses the ``qpdf`` command
+    when it is installed; returns False if it is missing or fails.
+    """
+    import shutil
+    import subprocess
+    
+    qpdf = shutil.which('qpdf')
+    if not qpdf:
+        current_app.logger.warning('Linearization skipped: qpdf is not installed')
+        return False
+    
+    temp_path = f"{path}.linear"
+    result = subprocess.run([qpdf, '--linearize', path, temp_path], capture_output=True, text=True)
+    # qpdf exits with 3 when it succeeded with warnings
+    if result.returncode not in (0, 3) or not os.path.exists(temp_path):
+        current_app.logger.warning(f'Linearization failed for {path}: {result.stderr.strip()}')
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    
+    os.replace(temp_path, path)
+    return True
+
+def _send_download(filepath, download_name, mimetype=None):
+    """
+    Send a file with conditional (content-hash ETag/Last-Modified) and Range support.
+    
+    Accept-Ranges is advertised on full responses too, so browser PDF viewers
+    know they can fetch a linearized file's first page and resume interrupted
+    downloads. ``?inline=1`` serves the file for viewing instead of saving.
+    """
+    response = send_file(
+        os.path.abspath(filepath),  # relative paths would resolve against the app root
+        as_attachment=request.args.get('inline') != '1',
+        download_name=download_name,
+        mimetype=mimetype,
+        conditional=True,
+        etag=_file_etag(filepath),
+        max_age=31536000
+    )
+    # Output files are never rewritten under the same name
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@bp.route('/ocr_text/<filename>')
 def ocr_text(filename):
     """Simple OCR text extraction for image-based PDFs"""
     try:
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
-            app.logger.error(f'File not found for OCR: {filename}')
+            current_app.logger.error(f'File not found for OCR: {filename}')
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        doc = fitz.open(filepath)
+        facts = ingest_store.facts(filename)
+        if facts is not None:
+            page_texts = [page['text'] for page in _ingested_pages_text(filename, facts['page_count'])]
+        else:
+            doc = _open_pdf(filepath)
+            page_texts = [doc.load_page(page_num).get_text() for page_num in range(len(doc))]
+            doc.close()
         pages_text = []
         
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            
-            # First try regular text extraction
-            text = page.get_text()
-            
+        for page_num, text in enumerate(page_texts):
             # If no text found, provide a message about OCR
             if not text.strip():
                 text = "This appears to be an image-based PDF. OCR functionality requires additional setup (Tesseract OCR). For now, you can still add new text to this document using the 'Add Text' feature."
@@ -753,8 +1477,6 @@ def ocr_text(filename):
                 'method': 'basic_extraction'
             })
         
-        doc.close()
-        
         return jsonify({
             'success': True,
             'pages_text': pages_text,
@@ -763,330 +1485,59 @@ def ocr_text(filename):
         })
         
     except Exception as e:
-        app.logger.error(f'Error in text extraction from {filename}: {str(e)}')
+        current_app.logger.error(f'Error in text extraction from {filename}: {str(e)}')
         return jsonify({'error': f'Error in text extraction: {str(e)}'}), 500
 
-@app.route('/convert_to_word/<filename>')
+@bp.route('/convert_to_word/<filename>')
 def convert_to_word(filename):
     """Convert PDF to Word document with formatting preservation"""
     try:
         # Check both upload and processed folders
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         
         if not os.path.exists(filepath):
-            app.logger.error(f'File not found for Word conversion: {filename}')
+            current_app.logger.error(f'File not found for Word conversion: {filename}')
             return jsonify({'error': f'File not found: {filename}'}), 404
         
-        app.logger.info(f'Converting PDF to Word: {filename}')
-        
-        # Open PDF document
-        doc = fitz.open(filepath)
-        
-        # Create Word document
-        word_doc = Document()
-        
-        # Set document margins (narrower for better content fit)
-        sections = word_doc.sections
-        for section in sections:
-            section.top_margin = Inches(0.5)
-            section.bottom_margin = Inches(0.5)
-            section.left_margin = Inches(0.75)
-            section.right_margin = Inches(0.75)
-        
-        # Process each page
-        total_text_blocks = 0
-        for page_num in range(len(doc)):
-            try:
-                page = doc.load_page(page_num)
-                
-                # Add page break for pages after the first
-                if page_num > 0:
-                    word_doc.add_page_break()
-                
-                # Add page header (optional, can be disabled for cleaner output)
-                if len(doc) > 1:  # Only add page numbers for multi-page documents
-                    page_header = word_doc.add_paragraph()
-                    page_header.add_run(f"Page {page_num + 1}").bold = True
-                    page_header.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    page_header.space_after = Pt(6)
-                
-                # Extract text blocks with formatting
-                text_blocks = _extract_formatted_text_blocks(page)
-                total_text_blocks += len(text_blocks)
-                
-                if text_blocks:
-                    # Group text blocks by approximate lines
-                    lines = _group_text_blocks_into_lines(text_blocks)
-                    
-                    # Convert lines to Word paragraphs
-                    for line in lines:
-                        _add_line_to_word_doc(word_doc, line)
-                else:
-                    # Fallback: extract simple text
-                    simple_text = page.get_text()
-                    if simple_text.strip():
-                        # Split into paragraphs more intelligently
-                        paragraphs = []
-                        current_para = []
-                        
-                        for line in simple_text.split('\n'):
-                            line = line.strip()
-                            if line:
-                                current_para.append(line)
-                            else:
-                                if current_para:
-                                    paragraphs.append(' '.join(current_para))
-                                    current_para = []
-                        
-                        # Add the last paragraph
-                        if current_para:
-                            paragraphs.append(' '.join(current_para))
-                        
-                        # Add paragraphs to Word document
-                        for para_text in paragraphs:
-                            if para_text.strip():
-                                para = word_doc.add_paragraph(para_text.strip())
-                                para.space_after = Pt(6)
-                
-                # Add some spacing between pages (but not after the last page)
-                if page_num < len(doc) - 1:
-                    word_doc.add_paragraph()
-                    
-            except Exception as page_error:
-                app.logger.error(f'Error processing page {page_num + 1}: {str(page_error)}')
-                # Add error message to document
-                error_para = word_doc.add_paragraph()
-                error_run = error_para.add_run(f"[Error processing page {page_num + 1}: {str(page_error)}]")
-                error_run.font.color.rgb = RGBColor(255, 0, 0)  # Red color
-                error_run.italic = True
-        
-        # Store page count before closing document
-        total_pages = len(doc)
-        doc.close()
+        current_app.logger.info(f'Converting PDF to Word: {filename}')
         
         # Generate output filename
         base_name = os.path.splitext(os.path.basename(filename))[0]
         if len(base_name) > 50:
             base_name = base_name[:50] + "..."
         
-        import time
         timestamp = int(time.time())
         output_filename = f"converted_{timestamp}_{base_name}.docx"
-        output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+        output_path = os.path.join(current_app.config['PROCESSED_FOLDER'], output_filename)
         
-        # Save Word document
-        word_doc.save(output_path)
+        result = executor.run(pdf_operations.convert_to_word, filepath, output_path)
         
-        app.logger.info(f'PDF converted to Word successfully: {output_filename}')
+        current_app.logger.info(f'PDF converted to Word successfully: {output_filename}')
         
         return jsonify({
             'success': True,
             'word_filename': output_filename,
             'message': 'PDF converted to Word document successfully',
-            'pages_processed': total_pages,
-            'text_blocks_processed': total_text_blocks,
+            'pages_processed': result['pages'],
+            'text_blocks_processed': result['text_blocks'],
+            'images_processed': result['images'],
             'output_path': output_path,
             'file_size': os.path.getsize(output_path) if os.path.exists(output_path) else 0
         })
         
     except Exception as e:
-        app.logger.error(f'Error converting PDF to Word: {str(e)}', exc_info=True)
+        current_app.logger.error(f'Error converting PDF to Word: {str(e)}', exc_info=True)
         return jsonify({'error': f'Error converting PDF to Word: {str(e)}'}), 500
 
-def _extract_formatted_text_blocks(page):
-    """Extract text blocks with detailed formatting information"""
-    text_blocks = []
-    
-    try:
-        # Get structured text data
-        text_dict = page.get_text("dict")
-        
-        for block in text_dict.get("blocks", []):
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        if span["text"].strip():
-                            # Extract formatting details
-                            font_info = {
-                                'text': span["text"],
-                                'bbox': span["bbox"],
-                                'font': span.get("font", "Arial"),
-                                'size': span.get("size", 12),
-                                'flags': span.get("flags", 0),
-                                'color': span.get("color", 0),
-                                'origin': span.get("origin", [0, 0])
-                            }
-                            
-                            # Determine text properties
-                            font_info['is_bold'] = bool(font_info['flags'] & (1 << 4))
-                            font_info['is_italic'] = bool(font_info['flags'] & (1 << 6))
-                            font_info['is_underline'] = bool(font_info['flags'] & (1 << 2))
-                            
-                            # Convert color to RGB
-                            color_int = font_info['color']
-                            if color_int == 0:
-                                font_info['rgb_color'] = (0, 0, 0)  # Black
-                            else:
-                                b = (color_int & 0xFF)
-                                g = ((color_int >> 8) & 0xFF)
-                                r = ((color_int >> 16) & 0xFF)
-                                font_info['rgb_color'] = (r, g, b)
-                            
-                            text_blocks.append(font_info)
-    
-    except Exception as e:
-        app.logger.warning(f'Error extracting formatted text blocks: {str(e)}')
-    
-    return text_blocks
-
-def _group_text_blocks_into_lines(text_blocks):
-    """Group text blocks into logical lines based on Y coordinates"""
-    if not text_blocks:
-        return []
-    
-    # Sort blocks by Y coordinate (top to bottom), then X coordinate (left to right)
-    sorted_blocks = sorted(text_blocks, key=lambda b: (b['bbox'][1], b['bbox'][0]))
-    
-    lines = []
-    current_line = []
-    current_y = None
-    y_tolerance = 5  # Pixels tolerance for same line
-    
-    for block in sorted_blocks:
-        block_y = block['bbox'][1]  # Top Y coordinate
-        
-        if current_y is None or abs(block_y - current_y) <= y_tolerance:
-            # Same line
-            current_line.append(block)
-            current_y = block_y
-        else:
-            # New line
-            if current_line:
-                lines.append(current_line)
-            current_line = [block]
-            current_y = block_y
-    
-    # Add the last line
-    if current_line:
-        lines.append(current_line)
-    
-    return lines
-
-def _add_line_to_word_doc(word_doc, line_blocks):
-    """Add a line of text blocks to Word document with formatting"""
-    if not line_blocks:
-        return
-    
-    # Create paragraph
-    paragraph = word_doc.add_paragraph()
-    
-    # Determine paragraph alignment based on text position
-    page_width = 595  # Approximate A4 width in points
-    avg_x = sum(block['bbox'][0] for block in line_blocks) / len(line_blocks)
-    
-    if avg_x < page_width * 0.2:
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-    elif avg_x > page_width * 0.8:
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    elif page_width * 0.4 < avg_x < page_width * 0.6:
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    else:
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-    
-    # Add text runs with formatting
-    for block in line_blocks:
-        run = paragraph.add_run(block['text'])
-        
-        # Apply font formatting
-        try:
-            # Font size
-            run.font.size = Pt(max(8, min(72, block['size'])))
-            
-            # Font family (map PDF fonts to Word fonts)
-            font_name = _map_pdf_font_to_word(block['font'])
-            run.font.name = font_name
-            
-            # Font style
-            run.font.bold = block['is_bold']
-            run.font.italic = block['is_italic']
-            run.font.underline = block['is_underline']
-            
-            # Font color
-            r, g, b = block['rgb_color']
-            run.font.color.rgb = RGBColor(r, g, b)
-            
-        except Exception as e:
-            app.logger.warning(f'Error applying formatting to text run: {str(e)}')
-        
-        # Add space between blocks if they're not adjacent
-        if block != line_blocks[-1]:  # Not the last block
-            next_block = line_blocks[line_blocks.index(block) + 1]
-            current_right = block['bbox'][2]
-            next_left = next_block['bbox'][0]
-            
-            # Add space if there's a gap
-            if next_left - current_right > 5:  # 5 pixel threshold
-                paragraph.add_run(' ')
-
-def _map_pdf_font_to_word(pdf_font):
-    """Map PDF font names to Word-compatible font names"""
-    font_mapping = {
-        # Helvetica family
-        'helv': 'Arial',
-        'helvetica': 'Arial',
-        'helveticabold': 'Arial',
-        'helvetica-bold': 'Arial',
-        'helveticaneue': 'Arial',
-        'helveticaneueb': 'Arial',
-        
-        # Times family
-        'times': 'Times New Roman',
-        'times-roman': 'Times New Roman',
-        'times-bold': 'Times New Roman',
-        'times-italic': 'Times New Roman',
-        'times-bolditalic': 'Times New Roman',
-        'timesnewroman': 'Times New Roman',
-        
-        # Courier family
-        'cour': 'Courier New',
-        'courier': 'Courier New',
-        'courier-bold': 'Courier New',
-        'courier-oblique': 'Courier New',
-        'couriernew': 'Courier New',
-        
-        # Other common fonts
-        'arial': 'Arial',
-        'calibri': 'Calibri',
-        'verdana': 'Verdana',
-        'georgia': 'Georgia',
-        'trebuchet': 'Trebuchet MS',
-    }
-    
-    # Clean and normalize font name
-    clean_font = pdf_font.lower().replace('-', '').replace(' ', '')
-    
-    # Try exact match first
-    if clean_font in font_mapping:
-        return font_mapping[clean_font]
-    
-    # Try partial matches
-    for pdf_name, word_name in font_mapping.items():
-        if pdf_name in clean_font or clean_font in pdf_name:
-            return word_name
-    
-    # Default fallback
-    return 'Arial'
-
-def cleanup_old_files():
+def cleanup_old_files(app):
     """Clean up old processed files to prevent disk space issues"""
     try:
-        import time
         current_time = time.time()
         max_age = 24 * 60 * 60  # 24 hours in seconds
         
-        for folder in [app.config['PROCESSED_FOLDER'], app.config['UPLOAD_FOLDER']]:
+        for folder in [app.config['PROCESSED_FOLDER'], app.config['UPLOAD_FOLDER'], app.config['FINGERPRINTS_FOLDER']]:
             if os.path.exists(folder):
                 for filename in os.listdir(folder):
                     filepath = os.path.join(folder, filename)
@@ -1098,22 +1549,28 @@ def cleanup_old_files():
                                 app.logger.info(f'Cleaned up old file: {filename}')
                             except Exception as e:
                                 app.logger.warning(f'Failed to clean up {filename}: {e}')
+        
+        ingest_folder = app.config['INGEST_FOLDER']
+        if os.path.exists(ingest_folder):
+            for filename in os.listdir(ingest_folder):
+                if current_time - os.path.getmtime(os.path.join(ingest_folder, filename)) > max_age:
+                    ingest_store.remove(filename)
     except Exception as e:
         app.logger.error(f'Cleanup process failed: {e}')
 
-@app.route('/debug_pdf/<filename>')
+@bp.route('/debug_pdf/<filename>')
 def debug_pdf(filename):
     """Debug endpoint to check PDF content after editing"""
     try:
         # Check both folders
-        filepath = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+        filepath = os.path.join(current_app.config['PROCESSED_FOLDER'], filename)
         if not os.path.exists(filepath):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
         
-        doc = fitz.open(filepath)
+        doc = _open_pdf(filepath)
         debug_info = {
             'filename': filename,
             'filepath': filepath,
@@ -1140,7 +1597,10 @@ def debug_pdf(filename):
     except Exception as e:
         return jsonify({'error': f'Debug error: {str(e)}'}), 500
 
+startup_timings['import'] = time.perf_counter() - _import_started
+
 if __name__ == '__main__':
+    app = create_app()
     # Clean up old files on startup
-    cleanup_old_files()
+    cleanup_old_files(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Batch runner for the headless PDF operations in pdf_operations.py.
+
+Processes every PDF in a directory (recursively) or listed in a manifest file
+across a process pool, without going through HTTP. Each file runs in its own
+task, so a bad file only fails itself. A worker process that dies breaks the
+whole pool: it is replaced, and the files that were in flight are retried in
+the new pool one at a time, so only a file that breaks a pool on its own is
+marked failed. Outputs always stay inside the output directory and never
+replace an input. Finished files are appended to a progress log in the output
+directory, and a rerun skips every file already done, so an interrupted job
+picks up where it stopped.
+
+Examples:
+    python batch.py extract_text /data/inbox --output /data/text
+    python batch.py convert_to_word --manifest nightly.txt --output /data/word --workers 8
+    python batch.py split /data/inbox --output /data/first --start-page 1 --end-page 1
+    python batch.py extract_images /data/catalogues --output /data/images
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+OPERATIONS = ('extract_text', 'convert_to_word', 'split', 'extract_images')
+OUTPUT_EXTENSIONS = {'extract_text': '.txt', 'convert_to_word': '.docx', 'split': '.pdf', 'extract_images': '.zip'}
+PROGRESS_FILENAME = '.batch_progress.jsonl'
+
+
+def collect_inputs(source=None, manifest=None):
+    """Return ``[(path, relative_path)]`` for a directory tree or a manifest file"""
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        inputs = []
+        with open(manifest, 'r', encoding='utf-8') as manifest_file:
+            for line in manifest_file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                path = os.path.join(base, line)
+                inputs.append((path, _relative_name(path, base)))
+        return inputs
+
+    inputs = []
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                path = os.path.join(root, name)
+                inputs.append((path, os.path.relpath(path, source)))
+    return inputs
+
+
+def _relative_name(path, base):
+    """
+    Name of ``path`` relative to ``base``, used to place its output.
+
+    Paths outside ``base`` (absolute or ``../`` manifest entries) would give a
+    name starting with ``..``, so they go under ``external/`` by their full
+    path instead, which keeps their output inside the output directory.
+    """
+    path = os.path.abspath(path)
+    try:
+        relative = os.path.relpath(path, os.path.abspath(base))
+    except ValueError:  # another drive on Windows
+        relative = os.pardir
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        drive, absolute = os.path.splitdrive(path)
+        relative = os.path.join('external', drive.strip(':\\/'), absolute.lstrip('\\/'))
+    return relative
+
+
+def _output_error(path, output_path, output_root, claimed):
+    """Why ``output_path`` must not be written for ``path``, or None if it is safe"""
+    real_output = os.path.realpath(output_path)
+    if os.path.commonpath([real_output, output_root]) != output_root:
+        return f'output {output_path} is outside the output directory'
+    if real_output == os.path.realpath(path):
+        return f'output {output_path} would overwrite the input'
+    if real_output in claimed:
+        return f'output {output_path} is already written for {claimed[real_output]}'
+    claimed[real_output] = path
+    return None
+
+
+def process_file(operation, path, output_path, options):
+    """
+    Run one operation on one file in a pool process.
+
+    Returns a progress record; errors are caught here and reported in the
+    record so they never reach the pool.
+    """
+    import pdf_operations
+
+    started = time.perf_counter()
+    record = {'path': path, 'output': output_path, 'status': 'ok', 'pages': 0, 'error': None}
+    try:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        if operation == 'extract_text':
+            pages_text = pdf_operations.extract_text(path)
+            with open(output_path, 'w', encoding='utf-8') as output_file:
+                output_file.write('\f'.join(page['text'] for page in pages_text))
+            record['pages'] = len(pages_text)
+        elif operation == 'convert_to_word':
+            record['pages'] = pdf_operations.convert_to_word(path, output_path)['pages']
+        elif operation == 'split':
+            _, record['pages'] = pdf_operations.split_pdf(
+                path, output_path, options['start_page'], options['end_page']
+            )
+        elif operation == 'extract_images':
+            summary = pdf_operations.write_images_zip(path, output_path)
+            record['pages'] = summary['pages']
+            record['images'] = summary['images']
+        else:
+            raise ValueError(f'Unknown operation: {operation}')
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['seconds'] = round(time.perf_counter() - started, 6)
+    return record
+
+
+def load_progress(progress_path):
+    """Paths already processed successfully according to the progress log"""
+    done = set()
+    if not os.path.exists(progress_path):
+        return done
+    with open(progress_path, 'r', encoding='utf-8') as progress_file:
+        for line in progress_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get('status') == 'ok':
+                done.add(record['path'])
+            else:
+                done.discard(record['path'])
+    return done
+
+
+def run(args):
+    inputs = collect_inputs(args.source, args.manifest)
+    os.makedirs(args.output, exist_ok=True)
+    progress_path = os.path.join(args.output, PROGRESS_FILENAME)
+    done = set() if args.restart else load_progress(progress_path)
+
+    extension = OUTPUT_EXTENSIONS[args.operation]
+    output_root = os.path.realpath(args.output)
+    claimed = {}  # real output path -> input path
+    pending = []
+    refused = []
+    for path, relative in inputs:
+        path = os.path.abspath(path)
+        if path in done:
+            continue
+        output_path = os.path.join(args.output, os.path.splitext(relative)[0] + extension)
+        error = _output_error(path, output_path, output_root, claimed)
+        if error:
+            refused.append((path, output_path, error))
+        else:
+            pending.append((path, output_path))
+    total = len(pending) + len(refused)
+    options = {'start_page': args.start_page, 'end_page': args.end_page}
+    print(f'{len(inputs)} files, {len(inputs) - total} already done, '
+          f'{total} to process with {args.workers} workers')
+
+    totals = {'ok': 0, 'failed': 0, 'pages': 0}
+    started = time.perf_counter()
+    last_report = started
+    mode = 'w' if args.restart else 'a'
+    with open(progress_path, mode, encoding='utf-8') as progress_file:
+        def finish(record):
+            progress_file.write(json.dumps(record) + '\n')
+            progress_file.flush()
+            totals[record['status']] += 1
+            totals['pages'] += record['pages']
+            if record['status'] == 'failed':
+                print(f"  failed: {record['path']}: {record['error']}", file=sys.stderr)
+
+        for path, output_path, error in refused:
+            finish(_failed(path, output_path, error))
+
+        queue = list(reversed(pending))
+        # Files that were in flight when a pool broke; any of them may be the
+        # cause, so each is retried alone before the queue goes on
+        suspects = []
+        while queue or suspects:
+            pool = ProcessPoolExecutor(max_workers=args.workers, max_tasks_per_child=args.tasks_per_child)
+            in_flight = {}
+            try:
+                while queue or suspects or in_flight:
+                    source = suspects if suspects else queue
+                    limit = 1 if suspects else args.workers * 2
+                    while source and len(in_flight) < limit:
+                        path, output_path = source[-1]
+                        future = pool.submit(process_file, args.operation, path, output_path, options)
+                        in_flight[future] = source.pop()
+
+                    completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    broken = False
+                    for future in completed:
+                        try:
+                            record = future.result()
+                        except BrokenProcessPool:
+                            broken = True  # the file stays in flight and is handled below
+                            continue
+                        except Exception as e:
+                            record = _failed(*in_flight[future], f'{type(e).__name__}: {e}')
+                        in_flight.pop(future)
+                        finish(record)
+                    if broken:
+                        raise BrokenProcessPool('a worker process died')
+
+                    now = time.perf_counter()
+                    if now - last_report >= args.report_interval:
+                        last_report = now
+                        _print_throughput(totals, now - started, total)
+            except BrokenProcessPool:
+                # Also raised by submit(), which leaves its file on the queue.
+                # A file that broke the pool while running alone is the cause;
+                # the others go back to be retried in the replacement pool.
+                if len(in_flight) == 1:
+                    finish(_failed(*in_flight.popitem()[1], 'worker process died'))
+                suspects.extend(in_flight.values())
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    print('done: ', end='')
+    _print_throughput(totals, elapsed, total)
+    return {
+        'files': len(inputs),
+        'skipped': len(inputs) - total,
+        'ok': totals['ok'],
+        'failed': totals['failed'],
+        'pages': totals['pages'],
+        'seconds': round(elapsed, 3),
+        'files_per_second': round((totals['ok'] + totals['failed']) / elapsed, 2) if elapsed else None,
+        'pages_per_second': round(totals['pages'] / elapsed, 2) if elapsed else None
+    }
+
+
+def _failed(path, output_path, error):
+    return {'path': path, 'output': output_path, 'status': 'failed', 'pages': 0, 'error': error, 'seconds': None}
+
+
+def _print_throughput(totals, elapsed, total):
+    processed = totals['ok'] + totals['failed']
+    elapsed = max(elapsed, 1e-9)
+    print(f'{processed}/{total} files ({totals["failed"]} failed), {totals["pages"]} pages in {elapsed:.1f}s: '
+          f'{processed / elapsed:.1f} files/s, {totals["pages"] / elapsed:.1f} pages/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a PDF operation over many files in parallel')
+    parser.add_argument('operation', choices=OPERATIONS, help='operation to run on every file')
+    parser.add_argument('source', nargs='?', help='directory searched recursively for .pdf files')
+    parser.add_argument('--manifest', help='text file listing one PDF path per line (relative to the manifest); '
+                             'files outside its folder are written under external/ in the output')
+    parser.add_argument('--output', required=True, help='output directory; also holds the progress log')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--tasks-per-child', type=int, default=200,
+                        help='files a worker handles before it is replaced (bounds leaks)')
+    parser.add_argument('--start-page', type=int, default=1, help='first page for split')
+    parser.add_argument('--end-page', type=int, help='last page for split (default: last page)')
+    parser.add_argument('--restart', action='store_true', help='ignore the progress log and process every file')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--summary', help='write the final summary as JSON to this path')
+    args = parser.parse_args()
+
+    if bool(args.source) == bool(args.manifest):
+        parser.error('give either a source directory or --manifest')
+    if args.source and not os.path.isdir(args.source):
+        parser.error(f'not a directory: {args.source}')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    summary = run(args)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Synthetic-corpus benchmark for the PDF editor endpoints.
+
+Generates reproducible PDFs with reportlab (text-dense, image-heavy and mixed
+layouts, from 1 up to 5,000 pages), then times every operation in-process
+through the Flask test client: preview, text blocks, extract, edit, split,
+merge and convert_to_word. Results are written as JSON so runs can be
+compared to catch throughput regressions. Module import, app creation and
+shared-state preload times are measured in fresh interpreters as well.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --pages 1,100,1000,5000 --layouts text --output bench.json
+    python benchmark.py --compare bench_baseline.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LAYOUTS = ('text', 'image', 'mixed')
+OPERATIONS = ('preview', 'text_blocks', 'extract', 'edit', 'split', 'merge', 'convert_to_word')
+
+WORDS = (
+    'invoice total amount payable customer account balance period summary '
+    'service charge tax rate reference number statement date due payment '
+    'report quarter revenue growth margin forecast analysis region product'
+).split()
+
+
+def generate_pdf(path, pages, layout, seed=1234):
+    """Write a deterministic synthetic PDF with the given layout and page count"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(seed)
+    width, height = A4
+    images = [ImageReader(io.BytesIO(_photo_jpeg(rng, index))) for index in range(8)]
+
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for page_index in range(pages):
+        if layout in ('text', 'mixed'):
+            line_count = 60 if layout == 'text' else 25
+            pdf.setFont('Helvetica-Bold', 14)
+            pdf.drawString(50, height - 50, f"Synthetic document - page {page_index + 1}")
+            pdf.setFont('Helvetica', 9)
+            for line in range(line_count):
+                words = ' '.join(rng.choice(WORDS) for _ in range(14))
+                pdf.drawString(50, height - 75 - line * 12, words)
+
+        if layout == 'image':
+            for slot in range(4):
+                x = 40 + (slot % 2) * 265
+                y = 80 + (slot // 2) * 360
+                pdf.drawImage(images[(page_index + slot) % len(images)], x, y, width=250, height=330)
+        elif layout == 'mixed':
+            pdf.drawImage(images[page_index % len(images)], 50, 60, width=300, height=300)
+
+        pdf.showPage()
+    pdf.save()
+
+
+def _photo_jpeg(rng, index, size=(600, 800)):
+    """Build a noisy gradient JPEG that compresses like a photograph"""
+    from PIL import Image
+
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40 + index * 5)
+    channels = [Image.blend(gradient, noise, rng.uniform(0.3, 0.7)) for _ in range(3)]
+    image = Image.merge('RGB', channels)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def run_operation(client, app_module, operation, filename, page_count):
+    """Run one operation through the test client; returns the response"""
+    if operation == 'preview':
+        # The preview lists page image URLs; fetch them all as the browser would
+        response = client.get(f'/preview/{filename}')
+        for page in response.get_json()['pages']:
+            client.get(page['image'])
+        return response
+    if operation == 'text_blocks':
+        return client.get(f'/get_text_blocks/{filename}')
+    if operation == 'extract':
+        return client.get(f'/extract_text/{filename}')
+    if operation == 'edit':
+        # Edits are made to the document's latest version, as a browser tab
+        # would after each save; editing the upload again would be a stale edit (409)
+        return client.post('/edit_text', json={
+            'filename': app_module.document_versions.head(filename),
+            'page_num': 1,
+            'old_text': 'Synthetic',
+            'new_text': 'Benchmark',
+            'bbox': [50, 40, 250, 60]
+        })
+    if operation == 'split':
+        return client.post('/split_pdf', json={
+            'filename': filename,
+            'start_page': 1,
+            'end_page': max(1, page_count // 2)
+        })
+    if operation == 'merge':
+        return client.post('/merge_pdfs', json={'filenames': [filename, filename]})
+    if operation == 'convert_to_word':
+        return client.get(f'/convert_to_word/{filename}')
+    raise ValueError(f'Unknown operation: {operation}')
+
+
+STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+app.preload_shared_state()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'create_app_seconds': created - imported,
+    'preload_seconds': time.perf_counter() - created
+}))
+"""
+
+
+def measure_startup(repo_dir, workdir, runs=5):
+    """Median import, create_app and preload times, each run in a fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=repo_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        key: round(statistics.median(sample[key] for sample in samples), 6)
+        for key in samples[0]
+    }
+
+
+def clear_caches(app_module):
+    app_module.render_cache.clear()
+    app_module.text_cache.clear()
+
+
+def benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='pdf-bench-')
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+
+    startup = measure_startup(repo_dir, workdir)
+    print('startup: ' + ', '.join(f'{key[:-8]} {value * 1000:.1f} ms' for key, value in startup.items()))
+
+    # The app creates its working folders relative to the current directory
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app as app_module
+        app_module.app.logger.disabled = True
+        client = app_module.app.test_client()
+
+        results = []
+        for layout in args.layouts:
+            for page_count in args.pages:
+                source = os.path.join(workdir, f'{layout}_{page_count}.pdf')
+                started = time.perf_counter()
+                generate_pdf(source, page_count, layout, seed=args.seed)
+                generate_seconds = time.perf_counter() - started
+
+                filename = f'bench_{layout}_{page_count}.pdf'
+                shutil.copy(source, os.path.join(app_module.app.config['UPLOAD_FOLDER'], filename))
+                size_bytes = os.path.getsize(source)
+                print(f'{layout:>6} {page_count:>5} pages  {size_bytes / 1024:>10.1f} KB  '
+                      f'(generated in {generate_seconds:.2f}s)')
+
+                for operation in args.operations:
+                    timings = []
+                    response_bytes = 0
+                    status = None
+                    for _ in range(args.repeat):
+                        clear_caches(app_module)
+                        started = time.perf_counter()
+                        response = run_operation(client, app_module, operation, filename, page_count)
+                        elapsed = time.perf_counter() - started
+                        status = response.status_code
+                        response_bytes = len(response.get_data())
+                        if status != 200:
+                            # An error path is not the operation; its timing would hide a breakage
+                            break
+                        timings.append(elapsed)
+
+                    median = statistics.median(timings) if status == 200 else None
+                    result = {
+                        'layout': layout,
+                        'pages': page_count,
+                        'operation': operation,
+                        'file_bytes': size_bytes,
+                        'status': status,
+                        'response_bytes': response_bytes,
+                        'seconds': [round(value, 6) for value in timings],
+                        'median_seconds': round(median, 6) if median is not None else None,
+                        'pages_per_second': round(page_count / median, 2) if median else None
+                    }
+                    results.append(result)
+                    if median is None:
+                        print(f'        {operation:<16} {"FAILED":>10}     status {status}: '
+                              f'{response.get_data(as_text=True)[:200]}')
+                        continue
+                    print(f'        {operation:<16} {median * 1000:>10.1f} ms  '
+                          f'{result["pages_per_second"] or 0:>10.1f} pages/s  status {status}')
+    finally:
+        os.chdir(previous_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'library_versions': _library_versions(),
+        'settings': {
+            'pages': args.pages,
+            'layouts': args.layouts,
+            'operations': args.operations,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'startup': startup,
+        'results': results
+    }
+
+
+def compare(current, baseline_path, threshold):
+    """Print per-operation changes against a baseline; returns the number of regressions"""
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+
+    previous = {
+        (row['layout'], row['pages'], row['operation']): row
+        for row in baseline.get('results', [])
+    }
+
+    regressions = 0
+    print(f'\nComparison against {baseline_path} (threshold {threshold:.0%}):')
+    for row in current['results']:
+        key = (row['layout'], row['pages'], row['operation'])
+        if key not in previous or not previous[key]['median_seconds'] or row['median_seconds'] is None:
+            continue
+        ratio = row['median_seconds'] / previous[key]['median_seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'  {key[0]:>6} {key[1]:>5} {key[2]:<16} {ratio:>6.2f}x{flag}')
+    return regressions
+
+
+def _library_versions():
+    versions = {}
+    for module_name in ('fitz', 'PyPDF2', 'reportlab', 'docx', 'PIL', 'flask'):
+        try:
+            module = __import__(module_name)
+            versions[module_name] = getattr(module, 'VersionBind', None) or getattr(module, '__version__', 'unknown')
+        except Exception:
+            versions[module_name] = None
+    return versions
+
+
+def _csv(value, cast=str):
+    return [cast(part.strip()) for part in value.split(',') if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF editor operations on a synthetic corpus')
+    parser.add_argument('--pages', default='1,10,100', help='comma-separated page counts (up to 5000)')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='comma-separated layouts: text, image, mixed')
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='comma-separated operations to time')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per operation (caches cleared each run)')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for the synthetic corpus')
+    parser.add_argument('--output', default='bench_output.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown ratio counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='keep the generated corpus and outputs')
+    args = parser.parse_args()
+
+    args.pages = _csv(args.pages, int)
+    args.layouts = _csv(args.layouts)
+    args.operations = _csv(args.operations)
+
+    unknown = [name for name in args.layouts if name not in LAYOUTS] + \
+        [name for name in args.operations if name not in OPERATIONS]
+    if unknown:
+        parser.error(f'unknown layout or operation: {", ".join(unknown)}')
+    if any(count < 1 or count > 5000 for count in args.pages):
+        parser.error('page counts must be between 1 and 5000')
+
+    report = benchmark(args)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    failures = [row for row in report['results'] if row['status'] != 200]
+    if failures:
+        print(f'{len(failures)} operation(s) failed: ' + ', '.join(
+            f"{row['operation']} ({row['layout']}, {row['pages']} pages): status {row['status']}" for row in failures
+        ))
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions:
+            print(f'{regressions} regression(s) detected')
+            sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
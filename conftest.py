@@ -0,0 +1,59 @@
+"""
+Shared fixtures: an app whose folders live in a temporary directory, and
+small generated PDFs to upload to it.
+"""
+import io
+
+import fitz
+import pytest
+
+
+def make_pdf(pages=3, lines=6, prefix='Page'):
+    """Bytes of a PDF whose pages hold ``lines`` lines of 11pt text on 12pt leading"""
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=612, height=792)
+        for line in range(1, lines + 1):
+            page.insert_text((72, 72 + line * 12), f'{prefix} {page_number} line number {line}', fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    import app as app_module
+
+    # create_app makes static/temp relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    # The page caches are per process, like in a worker
+    app_module.render_cache.clear()
+    app_module.text_cache.clear()
+    processed = tmp_path / 'processed'
+    return app_module.create_app({
+        'TESTING': True,
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'PROCESSED_FOLDER': str(processed),
+        'HISTORY_FOLDER': str(processed / 'history'),
+        'FINGERPRINTS_FOLDER': str(processed / 'fingerprints'),
+        'INGEST_FOLDER': str(processed / 'ingest'),
+        'ADMISSION_FOLDER': str(processed / 'admission'),
+        'SINGLEFLIGHT_FOLDER': str(processed / 'singleflight'),
+        'METRICS_FOLDER': str(processed / 'metrics'),
+        'PROFILES_FOLDER': str(tmp_path / 'profiles'),
+        'INGEST_ENABLED': False,
+        'ADMISSION_ENABLED': False,
+        'EVENTS_STREAM_SECONDS': 1
+    })
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def upload(client, data, name='doc.pdf'):
+    """Upload PDF bytes and return the stored filename"""
+    response = client.post('/upload', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['filename']
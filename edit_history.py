@@ -0,0 +1,247 @@
+"""
+Per-session undo/redo history for edited PDFs.
+
+Every edit produces a new file, so the history is just a stack of filenames.
+Each step also records which pages the edit touched, which lets callers
+refresh only those pages when stepping back and forth.
+
+State lives in one small JSON file per session so that it survives across
+gunicorn workers, and is only changed under an flock so that workers do not
+overwrite each other's updates. Every change bumps a per-session version
+number and keeps the latest change, which the /events stream polls to notify
+clients.
+
+DocumentVersions keeps the lineage of each document, shared by every
+session and tab that has it open: which document every version belongs to,
+the document's latest version (its head) and a version counter. It is only
+changed under a per-document flock, so every edit of a document gets the next
+number, no two edits can write the same file, and an edit is always checked
+against the head of its own document.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within each process
+    fcntl = None
+
+LOCK_POLL_INTERVAL = 0.005
+
+
+@contextmanager
+def file_lock(path, timeout=None):
+    """
+    Hold an exclusive flock on ``path`` for the ``with`` block.
+
+    Polls instead of blocking so a gevent worker keeps serving other requests
+    while it waits; raises TimeoutError after ``timeout`` seconds.
+    """
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError(f'Timed out waiting for {path}')
+                    time.sleep(LOCK_POLL_INTERVAL)
+        yield
+
+
+class EditHistory:
+    """Undo/redo stacks of document versions, keyed by session id"""
+
+    def __init__(self, folder, max_depth=50):
+        self.folder = folder
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    def reset(self, session_id, filename):
+        """Start a fresh history whose current version is ``filename``"""
+        with self._locked(session_id):
+            state = self._load(session_id) or {}
+            self._save(session_id, {
+                'current': filename,
+                'undo': [],
+                'redo': [],
+                'version': state.get('version', 0) + 1,
+                'last_change': None
+            })
+
+    def record(self, session_id, parent, filename, pages):
+        """
+        Record that ``filename`` was produced from ``parent`` by editing ``pages``.
+
+        Returns the redo entries that were discarded by branching off, so the
+        caller can drop anything cached for those versions.
+        """
+        with self._locked(session_id):
+            state = self._load(session_id) or {'current': parent, 'undo': [], 'redo': []}
+            state['undo'].append({'filename': parent, 'pages': sorted(set(pages))})
+            del state['undo'][:-self.max_depth]
+            discarded = state['redo']
+            state['redo'] = []
+            state['current'] = filename
+            self._bump(state, parent, pages)
+            self._save(session_id, state)
+        return discarded
+
+    def undo(self, session_id):
+        """Step back one version; returns ``(filename, changed_pages)`` or None"""
+        return self._step(session_id, 'undo', 'redo')
+
+    def redo(self, session_id):
+        """Step forward one version; returns ``(filename, changed_pages)`` or None"""
+        return self._step(session_id, 'redo', 'undo')
+
+    def state(self, session_id):
+        state = self._load(session_id) or {'current': None, 'undo': [], 'redo': []}
+        return {
+            'current': state['current'],
+            'version': state.get('version', 0),
+            'can_undo': bool(state['undo']),
+            'can_redo': bool(state['redo']),
+            'undo_depth': len(state['undo']),
+            'redo_depth': len(state['redo'])
+        }
+
+    def last_change(self, session_id):
+        """
+        Return ``(version, change)`` for the session's latest version.
+
+        ``change`` holds the new ``filename``, its ``parent`` and the changed
+        ``pages``; it is None when the version came from a fresh upload.
+        """
+        state = self._load(session_id) or {}
+        return state.get('version', 0), state.get('last_change')
+
+    def _step(self, session_id, source, target):
+        with self._locked(session_id):
+            state = self._load(session_id)
+            if not state or not state[source]:
+                return None
+
+            entry = state[source].pop()
+            parent = state['current']
+            state[target].append({'filename': parent, 'pages': entry['pages']})
+            state['current'] = entry['filename']
+            self._bump(state, parent, entry['pages'])
+            self._save(session_id, state)
+        return entry['filename'], entry['pages']
+
+    def _bump(self, state, parent, pages):
+        state['version'] = state.get('version', 0) + 1
+        state['last_change'] = {
+            'filename': state['current'],
+            'parent': parent,
+            'pages': sorted(set(pages))
+        }
+
+    @contextmanager
+    def _locked(self, session_id):
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock, file_lock(f"{self._path(session_id)}.lock"):
+            yield
+
+    def _path(self, session_id):
+        return os.path.join(self.folder, f"{session_id}.json")
+
+    def _load(self, session_id):
+        try:
+            with open(self._path(session_id), 'r', encoding='utf-8') as history_file:
+                return json.load(history_file)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, session_id, state):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(session_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as history_file:
+            json.dump(state, history_file)
+        os.replace(temp_path, path)
+
+
+class DocumentVersions:
+    """
+    Per-document edit lock, version counter and lineage, shared by every worker.
+
+    A document is named by its uploaded filename. Every saved version records
+    the document it belongs to and its parent, and the document records its
+    head, the version new edits should start from.
+    """
+
+    def __init__(self, folder, lock_timeout=30):
+        self.folder = folder
+        self.lock_timeout = lock_timeout
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @contextmanager
+    def lock(self, document):
+        """
+        Serialize edits of ``document`` across threads and workers.
+
+        Raises TimeoutError if another edit holds the document for longer than ``lock_timeout``.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with self._locks_lock:
+            process_lock = self._locks.setdefault(document, threading.Lock())
+        if not process_lock.acquire(timeout=self.lock_timeout):
+            raise TimeoutError(f'Timed out waiting for {document}')
+        try:
+            with file_lock(self._path(document, '.lock'), self.lock_timeout):
+                yield
+        finally:
+            process_lock.release()
+
+    def document(self, filename):
+        """The document ``filename`` is a version of; uploads (and unknown files) are their own document"""
+        version = self._load(self._path(filename, '.version.json'))
+        return version['document'] if version else filename
+
+    def head(self, document):
+        """The latest version of ``document``: its newest recorded version, or the upload itself"""
+        state = self._load(self._path(document, '.json'))
+        return state.get('head') or document
+
+    def next_version(self, document):
+        """Return the next version number of ``document``; call while holding :meth:`lock`"""
+        state = self._load(self._path(document, '.json'))
+        state['version'] = state.get('version', 0) + 1
+        self._save(self._path(document, '.json'), state)
+        return state['version']
+
+    def record(self, document, parent, filename):
+        """Register ``filename``, made from ``parent``, as the new head of ``document``; call while holding :meth:`lock`"""
+        self._save(self._path(filename, '.version.json'), {'document': document, 'parent': parent})
+        self.set_head(document, filename)
+
+    def set_head(self, document, filename):
+        """Make ``filename`` the version edits of ``document`` start from (after undo/redo); call while holding :meth:`lock`"""
+        state = self._load(self._path(document, '.json'))
+        state['head'] = filename
+        self._save(self._path(document, '.json'), state)
+
+    def _path(self, name, suffix):
+        return os.path.join(self.folder, f"{name}{suffix}")
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as version_file:
+                return json.load(version_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, path, state):
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as version_file:
+            json.dump(state, version_file)
+        os.replace(temp_path, path)
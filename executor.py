@@ -0,0 +1,243 @@
+"""
+Bounded executor for CPU-heavy PyMuPDF work.
+
+PyMuPDF holds the GIL while it renders or extracts text, so running it on a
+thread does not let anything else in the worker make progress. In async
+serving mode (gevent workers, see gunicorn.conf.py) PDF work is therefore sent
+to a small process pool: page renders and text extraction split by page with
+:func:`map_pages`, and whole-document work (edits, optimisation, conversion,
+split and merge, fingerprinting) with :func:`run`. The greenlet serving the
+request waits on the result while the worker keeps accepting downloads,
+history and metadata requests. When no pool is configured the same task
+functions run inline, exactly as a sync worker would.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+_settings = {'max_workers': 0, 'max_pending': 0, 'chunk_size': 8}
+
+
+def configure(max_workers, max_pending=None, chunk_size=8):
+    """Enable offloading to ``max_workers`` processes (0 runs everything inline)"""
+    shutdown()
+    _settings['max_workers'] = max_workers
+    _settings['max_pending'] = max_pending or max_workers * 4
+    _settings['chunk_size'] = chunk_size
+
+
+def enabled():
+    return _settings['max_workers'] > 0
+
+
+def shutdown():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            _slots = None
+
+
+def map_pages(task, filepath, page_numbers, *args):
+    """
+    Run ``task(filepath, chunk, *args)`` over ``page_numbers`` and merge the results.
+
+    Tasks return a dict keyed by page number. Pages are split into chunks so a
+    large document spreads across the pool; at most ``max_pending`` chunks are
+    queued at once and further callers wait for a free slot.
+    """
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return {}
+    if not enabled():
+        return task(filepath, page_numbers, *args)
+
+    pool, slots = _get_pool()
+    chunk_size = _settings['chunk_size']
+    futures = []
+    try:
+        for start in range(0, len(page_numbers), chunk_size):
+            slots.acquire()
+            try:
+                future = pool.submit(task, filepath, page_numbers[start:start + chunk_size], *args)
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+
+        results = {}
+        for future in futures:
+            results.update(future.result())
+        return results
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def run(task, *args):
+    """
+    Run ``task(*args)`` in the pool and return its result.
+
+    For work on a whole document that does not split by page. Counters and
+    histograms the task records in the pool process are added to this
+    process's metrics, so pooled work is reported like inline work.
+    """
+    if not enabled():
+        return task(*args)
+
+    pool, slots = _get_pool()
+    slots.acquire()
+    try:
+        future = pool.submit(_run_recorded, task, args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        result, recorded = future.result()
+    except BaseException:
+        future.cancel()
+        raise
+    metrics.registry.absorb(recorded)
+    return result
+
+
+def _run_recorded(task, args):
+    """Pool side of :func:`run`: the task's result and the metrics it recorded"""
+    # Drop anything left behind by an earlier task that failed
+    metrics.registry.take()
+    result = task(*args)
+    return result, metrics.registry.take()
+
+
+def _get_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            # Created on first use inside the serving worker, after gevent has
+            # patched threading, and spawned rather than forked so pool
+            # processes never inherit an event loop or held locks
+            _pool = ProcessPoolExecutor(
+                max_workers=_settings['max_workers'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _slots = threading.BoundedSemaphore(_settings['max_pending'])
+        return _pool, _slots
+
+
+# Task functions. They take a file path and page numbers, open the document
+# themselves and return plain data so they can run in any process.
+
+def render_pages(filepath, page_numbers, zoom, webp=False, quality=75):
+    """
+    Render and encode pages; returns ``{page: (data, mimetype, width, height, seconds)}``.
+
+    Text-only pages are encoded losslessly so glyph edges stay crisp, while
+    scanned or photographic pages use a lossy codec at ``quality``. WebP is
+    used for both when the client accepts it, otherwise PNG and JPEG.
+    """
+    import fitz
+    from pdf_operations import open_document
+
+    rendered = {}
+    with open_document(filepath) as doc:
+        for page_number in page_numbers:
+            started = time.perf_counter()
+            page = doc.load_page(page_number - 1)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            data, mimetype = _encode_pixmap(pix, _is_photographic(page), webp, quality)
+            rendered[page_number] = (data, mimetype, pix.width, pix.height, time.perf_counter() - started)
+    return rendered
+
+
+# Pages where images cover at least this share of the area are encoded lossily
+PHOTOGRAPHIC_COVERAGE = 0.25
+
+
+def _is_photographic(page):
+    """True for scanned or image-heavy pages, judged by the area their images cover"""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    if not page_area:
+        return False
+
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = page_rect & info['bbox']
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return covered / page_area >= PHOTOGRAPHIC_COVERAGE
+
+
+def _encode_pixmap(pix, lossy, webp, quality):
+    if not lossy and not webp:
+        return pix.tobytes('png'), 'image/png'
+
+    import io
+    from PIL import Image
+
+    image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    buffer = io.BytesIO()
+    if webp:
+        # method=0 is the fastest encoder setting; it still beats PNG and JPEG on size
+        if lossy:
+            image.save(buffer, format='WEBP', quality=quality, method=0)
+        else:
+            image.save(buffer, format='WEBP', lossless=True, method=0)
+        return buffer.getvalue(), 'image/webp'
+
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue(), 'image/jpeg'
+
+
+def extract_text_blocks(filepath, page_numbers):
+    """Extract positioned text spans; returns ``{page: (blocks, seconds)}``"""
+    from pdf_operations import _extract_page_text_blocks, open_document
+
+    extracted = {}
+    with open_document(filepath) as doc:
+        for page_number in page_numbers:
+            started = time.perf_counter()
+            blocks = _extract_page_text_blocks(doc.load_page(page_number - 1))
+            extracted[page_number] = (blocks, time.perf_counter() - started)
+    return extracted
+
+
+def page_fingerprints(filepath):
+    """Structural fingerprint of every page, see :mod:`fingerprints`"""
+    from fingerprints import structural_fingerprints
+    from pdf_operations import open_document
+
+    with open_document(filepath) as doc:
+        return structural_fingerprints(doc)
+
+
+def page_raster_fingerprints(filepath, page_numbers):
+    """Low-resolution render hashes; returns ``{page: digest}``"""
+    from fingerprints import raster_fingerprints
+    from pdf_operations import open_document
+
+    with open_document(filepath) as doc:
+        return raster_fingerprints(doc, page_numbers)
+
+
+def extract_plain_text(filepath, page_numbers):
+    """Extract plain page text; returns ``{page: (text, seconds)}``"""
+    from pdf_operations import open_document
+
+    extracted = {}
+    with open_document(filepath) as doc:
+        for page_number in page_numbers:
+            started = time.perf_counter()
+            text = doc.load_page(page_number - 1).get_text()
+            extracted[page_number] = (text, time.perf_counter() - started)
+    return extracted
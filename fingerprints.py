@@ -0,0 +1,185 @@
+"""
+Per-page fingerprints for telling which pages differ between two versions.
+
+A page's structural fingerprint hashes everything that decides how it looks:
+its content streams, the resources they use by name (fonts, images, forms)
+and its annotations followed through every reference, plus its boxes and
+rotation. Only used resources count because pages often share one resource
+dictionary, and a font added for an edit on one page must not mark every
+other page as changed. References are replaced by the hash of the object they
+point to, so renumbering objects on save does not change a fingerprint.
+
+Pages whose structural fingerprints differ can be checked again with a hash
+of a low-resolution grayscale render, which filters out rewrites that do not
+change the output (recompressed streams, subset fonts).
+
+Fingerprints are computed once per file, when a version is saved, and kept in
+a small JSON file per document so every gunicorn worker can reuse them.
+"""
+import hashlib
+import json
+import os
+import re
+
+import executor
+
+# Page attributes that affect rendering besides resources; Parent is left out
+# as it links to every other page
+PAGE_KEYS = ('Contents', 'Annots', 'Group', 'UserUnit')
+RESOURCE_TYPES = ('Font', 'XObject', 'ExtGState', 'ColorSpace', 'Pattern', 'Shading', 'Properties')
+RASTER_ZOOM = 0.5  # 36 dpi is enough to show a changed word
+
+_REFERENCE = re.compile(r'(\d+) \d+ R')
+_NAME = re.compile(rb'/([^\s/<>\[\]()]+)')
+
+
+def structural_fingerprints(doc):
+    """Return one hex digest per page of an open PyMuPDF document"""
+    # Page objects and the page tree are only ever referenced, never hashed,
+    # so that links and annotations pointing at pages do not pull in the whole tree
+    memo = {}
+    for page in doc:
+        xref = page.xref
+        while xref and xref not in memo:
+            memo[xref] = 'page'
+            kind, value = doc.xref_get_key(xref, 'Parent')
+            xref = int(value.split()[0]) if kind == 'xref' else 0
+
+    prints = []
+    for page in doc:
+        digest = hashlib.sha1()
+        digest.update(f'{tuple(page.mediabox)}{tuple(page.cropbox)}{page.rotation}'.encode())
+        for key in PAGE_KEYS:
+            kind, value = doc.xref_get_key(page.xref, key)
+            digest.update(f'/{key} {kind} {_resolve(doc, value, memo, set())}'.encode())
+
+        owner = _resources_owner(doc, page.xref)
+        if owner:
+            used_names = sorted({name.decode('latin-1') for name in _NAME.findall(page.read_contents())})
+            for resource_type in RESOURCE_TYPES:
+                for name in used_names:
+                    kind, value = doc.xref_get_key(owner, f'Resources/{resource_type}/{name}')
+                    if kind != 'null':
+                        digest.update(f'/{resource_type}/{name} {_resolve(doc, value, memo, set())}'.encode())
+        prints.append(digest.hexdigest())
+    return prints
+
+
+def raster_fingerprints(doc, page_numbers, zoom=RASTER_ZOOM):
+    """Hash a low-resolution grayscale render of each page; returns ``{page: digest}``"""
+    import fitz
+
+    prints = {}
+    for page_number in page_numbers:
+        pix = doc.load_page(page_number - 1).get_pixmap(
+            matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False
+        )
+        prints[page_number] = hashlib.sha1(pix.samples).hexdigest()
+    return prints
+
+
+def changed_pages(base, target):
+    """1-based pages whose fingerprints differ, including pages only one side has"""
+    return [
+        index + 1
+        for index in range(max(len(base), len(target)))
+        if index >= len(base) or index >= len(target) or base[index] != target[index]
+    ]
+
+
+def _resources_owner(doc, xref):
+    """The page, or the page tree node it inherits from, that holds its Resources"""
+    while xref:
+        if doc.xref_get_key(xref, 'Resources')[0] != 'null':
+            return xref
+        kind, parent = doc.xref_get_key(xref, 'Parent')
+        xref = int(parent.split()[0]) if kind == 'xref' else 0
+    return 0
+
+
+def _resolve(doc, source, memo, active):
+    return _REFERENCE.sub(lambda match: _object_digest(doc, int(match.group(1)), memo, active), source)
+
+
+def _object_digest(doc, xref, memo, active):
+    if xref in memo:
+        return memo[xref]
+    if xref in active:
+        return 'cycle'
+
+    active.add(xref)
+    digest = hashlib.sha1()
+    digest.update(_resolve(doc, doc.xref_object(xref, compressed=True), memo, active).encode())
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref) or b'')
+    active.discard(xref)
+
+    memo[xref] = digest.hexdigest()
+    return memo[xref]
+
+
+class FingerprintStore:
+    """Fingerprints per filename, stored as one JSON file per document version"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def structural(self, filename, filepath):
+        """Return the page fingerprints of ``filename``, computing them on first use"""
+        state = self._load(filename)
+        if state is None:
+            state = {'pages': executor.run(executor.page_fingerprints, filepath), 'raster': {}}
+            self._save(filename, state)
+        return state['pages']
+
+    def raster(self, filename, filepath, page_numbers):
+        """Return ``{page: digest}`` render hashes for ``page_numbers``, computing missing ones"""
+        self.structural(filename, filepath)
+        state = self._load(filename)
+        missing = [page for page in page_numbers if str(page) not in state['raster']]
+        if missing:
+            for page, digest in executor.run(executor.page_raster_fingerprints, filepath, missing).items():
+                state['raster'][str(page)] = digest
+            self._save(filename, state)
+        return {page: state['raster'][str(page)] for page in page_numbers}
+
+    def diff(self, base_name, base_path, target_name, target_path):
+        """
+        Compare two versions page by page.
+
+        Returns ``(changed, added, removed)`` lists of 1-based page numbers.
+        Pages present in both whose structure differs only count as changed
+        if their low-resolution renders differ too.
+        """
+        base = self.structural(base_name, base_path)
+        target = self.structural(target_name, target_path)
+        common = min(len(base), len(target))
+
+        candidates = [page for page in changed_pages(base, target) if page <= common]
+        changed = []
+        if candidates:
+            base_raster = self.raster(base_name, base_path, candidates)
+            target_raster = self.raster(target_name, target_path, candidates)
+            changed = [page for page in candidates if base_raster[page] != target_raster[page]]
+
+        added = list(range(common + 1, len(target) + 1))
+        removed = list(range(common + 1, len(base) + 1))
+        return changed, added, removed
+
+    def _path(self, filename):
+        return os.path.join(self.folder, f"{filename}.json")
+
+    def _load(self, filename):
+        try:
+            with open(self._path(filename), 'r', encoding='utf-8') as fingerprint_file:
+                return json.load(fingerprint_file)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, filename, state):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(filename)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as fingerprint_file:
+            json.dump(state, fingerprint_file)
+        os.replace(temp_path, path)
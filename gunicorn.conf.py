@@ -0,0 +1,59 @@
+"""
+Gunicorn settings for PDF Editor Pro.
+
+    gunicorn -c gunicorn.conf.py app:app
+    PDF_EDITOR_ASYNC=1 gunicorn -c gunicorn.conf.py app:app
+
+The app is loaded once in the master and the lazily imported subsystems
+(python-docx, PyPDF2, the Word template and font tables) are preloaded there
+too, so forked workers start instantly and share those pages copy-on-write.
+
+With PDF_EDITOR_ASYNC=1 the workers are gevent based and hold thousands of
+idle connections each; renders, text extraction, edits, conversions and other
+PDF work go to a per-worker process pool (see executor.py) because PyMuPDF
+holds the GIL while it works. The standard library is patched for gevent
+before the app is preloaded, so the locks its modules create at import time
+(edit history, caches, metrics) are gevent locks: a native lock held across
+a yielding call such as a file lock's sleep would block the whole worker.
+"""
+import os
+
+if os.environ.get('PDF_EDITOR_ASYNC', '0') == '1':
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import multiprocessing
+
+bind = os.environ.get('PDF_EDITOR_BIND', '0.0.0.0:5000')
+timeout = 120
+preload_app = True
+
+if os.environ.get('PDF_EDITOR_ASYNC', '0') == '1':
+    worker_class = 'gevent'
+    workers = int(os.environ.get('PDF_EDITOR_WORKERS', 2))
+    worker_connections = int(os.environ.get('PDF_EDITOR_WORKER_CONNECTIONS', 4000))
+    keepalive = 75
+    # Split the CPUs between the workers' render pools
+    os.environ.setdefault('PDF_EDITOR_RENDER_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+else:
+    workers = int(os.environ.get('PDF_EDITOR_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    # Each /events stream would hold a sync worker for its whole lifetime
+    os.environ.setdefault('PDF_EDITOR_EVENTS', '0')
+
+
+def on_starting(server):
+    import app
+
+    app.preload_shared_state()
+    server.log.info(
+        'Preloaded shared state: ' + ', '.join(
+            f'{phase} {seconds * 1000:.1f} ms' for phase, seconds in app.startup_timings.items()
+        )
+    )
+
+
+def worker_exit(server, worker):
+    import executor
+
+    executor.shutdown()
@@ -0,0 +1,161 @@
+"""
+Upload-time analysis of a document, run in the background after upload.
+
+For every page it records the size, whether the page has a text layer or is
+image-only, the fonts it uses, a small thumbnail, its plain text and its
+positioned text blocks. Results go to one folder per document so all gunicorn
+workers can answer previews, edit mode and text extraction from them instead
+of opening and parsing the PDF on the user's first click:
+
+    <folder>/<filename>/facts.json        page count, sizes, classes, fonts
+    <folder>/<filename>/pages/<n>.json    plain text and text blocks of page n
+    <folder>/<filename>/thumbs/<n>.jpg    thumbnail of page n
+
+facts.json is written last, so its presence means every other file is there;
+a failed ingest writes it with ``status: failed`` instead.
+"""
+import json
+import os
+import shutil
+import time
+
+THUMBNAIL_WIDTH = 150  # pixels; a placeholder while the full page image loads
+
+
+def analyze_pages(filepath, page_numbers):
+    """
+    Executor task: analyze pages of one document.
+
+    Returns ``{page: (facts, text, blocks, thumbnail)}`` where ``facts`` holds
+    the page size in points, its classification and fonts.
+    """
+    import fitz
+    from executor import _is_photographic
+    from pdf_operations import _extract_page_text_blocks, open_document
+
+    analyzed = {}
+    with open_document(filepath) as doc:
+        for page_number in page_numbers:
+            page = doc.load_page(page_number - 1)
+            text = page.get_text()
+            if text.strip():
+                classification = 'text'
+            elif page.get_images() or _is_photographic(page):
+                classification = 'image'
+            else:
+                classification = 'empty'
+
+            zoom = THUMBNAIL_WIDTH / page.rect.width if page.rect.width else 0.2
+            thumbnail = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes('jpg', jpg_quality=70)
+
+            facts = {
+                'page_num': page_number,
+                'width': page.rect.width,
+                'height': page.rect.height,
+                'classification': classification,
+                'is_image_based': classification == 'image',
+                'fonts': sorted({font[3] for font in page.get_fonts() if font[3]})
+            }
+            blocks = _extract_page_text_blocks(page)
+            analyzed[page_number] = (facts, text, blocks, thumbnail)
+    return analyzed
+
+
+class IngestStore:
+    """Per-document analysis results on disk, shared by every worker"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def run(self, filename, filepath):
+        """Analyze every page of ``filepath`` and store the results under ``filename``"""
+        import executor
+        from pdf_operations import page_count
+
+        started = time.perf_counter()
+        document_folder = self._document_folder(filename)
+        os.makedirs(os.path.join(document_folder, 'pages'), exist_ok=True)
+        os.makedirs(os.path.join(document_folder, 'thumbs'), exist_ok=True)
+
+        total_pages = page_count(filepath)
+        # Runs inline, or spread over the process pool in async mode
+        results = executor.map_pages(analyze_pages, filepath, range(1, total_pages + 1))
+
+        pages = []
+        fonts = set()
+        for page_number in range(1, total_pages + 1):
+            facts, text, blocks, thumbnail = results[page_number]
+            self._write(os.path.join(document_folder, 'pages', f'{page_number}.json'),
+                        json.dumps({'text': text, 'blocks': blocks}).encode('utf-8'))
+            self._write(self._thumbnail_path(filename, page_number), thumbnail)
+            pages.append(facts)
+            fonts.update(facts['fonts'])
+
+        classes = {page['classification'] for page in pages}
+        facts = {
+            'status': 'ready',
+            'filename': filename,
+            'page_count': total_pages,
+            'pages': pages,
+            'fonts': sorted(fonts),
+            'has_text_layer': 'text' in classes,
+            'is_image_based': 'image' in classes and 'text' not in classes,
+            'seconds': round(time.perf_counter() - started, 6)
+        }
+        self._write(os.path.join(document_folder, 'facts.json'), json.dumps(facts).encode('utf-8'))
+        return facts
+
+    def start(self, filename):
+        """Mark ``filename`` as being ingested, before the analysis is queued"""
+        os.makedirs(self._document_folder(filename), exist_ok=True)
+
+    def mark_failed(self, filename, error):
+        os.makedirs(self._document_folder(filename), exist_ok=True)
+        self._write(os.path.join(self._document_folder(filename), 'facts.json'),
+                    json.dumps({'status': 'failed', 'filename': filename, 'error': error}).encode('utf-8'))
+
+    def status(self, filename):
+        """``ready``, ``pending``, ``failed``, or None for files that were never ingested"""
+        facts = self._read_json(os.path.join(self._document_folder(filename), 'facts.json'))
+        if facts is not None:
+            return facts['status']
+        return 'pending' if os.path.isdir(self._document_folder(filename)) else None
+
+    def facts(self, filename):
+        """Document facts, or None unless ingest has finished successfully"""
+        facts = self._read_json(os.path.join(self._document_folder(filename), 'facts.json'))
+        return facts if facts and facts['status'] == 'ready' else None
+
+    def page_text(self, filename, page_number):
+        """``{'text': ..., 'blocks': [...]}`` for one page, or None if not ingested"""
+        return self._read_json(os.path.join(self._document_folder(filename), 'pages', f'{page_number}.json'))
+
+    def thumbnail(self, filename, page_number):
+        """JPEG thumbnail bytes for one page, or None if not ingested"""
+        try:
+            with open(self._thumbnail_path(filename, page_number), 'rb') as thumbnail_file:
+                return thumbnail_file.read()
+        except OSError:
+            return None
+
+    def remove(self, filename):
+        shutil.rmtree(self._document_folder(filename), ignore_errors=True)
+
+    def _document_folder(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def _thumbnail_path(self, filename, page_number):
+        return os.path.join(self._document_folder(filename), 'thumbs', f'{page_number}.jpg')
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as output_file:
+            output_file.write(data)
+        os.replace(temp_path, path)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Concurrent-session load generator for the PDF editor.
+
+Simulates N users running the same workflow as app.js: upload, preview
+(and its page images), enter edit mode (text blocks of the mounted pages),
+several /edit_text calls each followed by a refresh of only the pages the
+edit changed (their preview entries, images and text blocks), then
+convert_to_word. Users run either
+in-process against the Flask app or over HTTP against a local server such as
+gunicorn. Only the standard library is used, so nothing leaves the box.
+
+Reports throughput and p50/p95/p99 latency per route, plus CPU time and RSS
+for the worker processes.
+
+Examples:
+    python loadgen.py --users 8 --edits 3
+    gunicorn -w 4 -b 127.0.0.1:5000 app:app &
+    python loadgen.py --url http://127.0.0.1:5000 --gunicorn-pid $(pgrep -o gunicorn) --users 32
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Pages per text-block request in edit mode, as in app.js
+TEXT_BLOCKS_BATCH = 100
+
+
+class InProcessTransport:
+    """Drives the Flask app directly through a per-user test client"""
+
+    def __init__(self, app_module):
+        self.client = app_module.app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_json(silent=True), len(response.get_data())
+
+    def post_json(self, path, body):
+        response = self.client.post(path, json=body)
+        return response.status_code, response.get_json(silent=True), len(response.get_data())
+
+    def upload(self, path, filename, data):
+        response = self.client.post(path, data={'file': (io.BytesIO(data), filename)})
+        return response.status_code, response.get_json(silent=True), len(response.get_data())
+
+
+class HttpTransport:
+    """Drives a running server over HTTP, keeping a cookie jar per user"""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post_json(self, path, body):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        return self._send(request)
+
+    def upload(self, path, filename, data):
+        boundary = uuid.uuid4().hex
+        payload = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'
+        ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=payload,
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        )
+        return self._send(request)
+
+    def _send(self, request):
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            body = error.read()
+            status = error.code
+        try:
+            parsed = json.loads(body)
+        except ValueError:
+            parsed = None
+        return status, parsed, len(body)
+
+
+class LoadRecorder:
+    """Collects per-route latency samples from all simulated users"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def timed(self, route, call, *args):
+        started = time.perf_counter()
+        try:
+            status, body, _ = call(*args)
+        except Exception:
+            status, body = 599, None
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, body
+
+
+def run_user(transport, recorder, pdf_bytes, edits):
+    """One simulated editing session, mirroring the app.js workflow"""
+    status, body = recorder.timed('POST /upload', transport.upload, '/upload', 'loadtest.pdf', pdf_bytes)
+    if status != 200 or not body:
+        return
+    filename = body['filename']
+
+    page_count = _load_preview(transport, recorder, filename)
+    # Edit mode asks for the mounted pages; one batch from the top stands in for them
+    blocks = _load_text_blocks(transport, recorder, filename, range(1, min(page_count, TEXT_BLOCKS_BATCH) + 1))
+
+    for edit_index in range(edits):
+        block = _first_block(blocks)
+        if block is None:
+            break
+
+        status, result = recorder.timed('POST /edit_text', transport.post_json, '/edit_text', {
+            'filename': filename,
+            'page_num': block['page_num'],
+            'old_text': block['text'],
+            'new_text': f"Edited {edit_index + 1}",
+            'bbox': block['bbox'],
+            'font_info': {key: block.get(key) for key in ('font', 'size', 'flags', 'color')},
+            'preserve_formatting': True
+        })
+        if status != 200 or not result:
+            break
+        filename = result['modified_filename']
+
+        # app.js keeps unchanged pages and refetches only the changed ones
+        changed = result.get('changed_pages') or []
+        _load_preview(transport, recorder, filename, changed)
+        blocks.update(_load_text_blocks(transport, recorder, filename, changed))
+
+    recorder.timed('GET /convert_to_word', transport.get, f'/convert_to_word/{filename}')
+
+
+def _load_preview(transport, recorder, filename, page_numbers=None):
+    """Fetch the preview (of ``page_numbers`` only, if given) and then its page images; returns the page count"""
+    path = f'/preview/{filename}'
+    if page_numbers is not None:
+        if not page_numbers:
+            return 0
+        path += f'?pages={_pages_param(page_numbers)}'
+    status, body = recorder.timed('GET /preview', transport.get, path)
+    if status != 200 or not body:
+        return 0
+    for page in body['pages']:
+        recorder.timed('GET /page_image', transport.get, page['image'])
+    return body['total_pages']
+
+
+def _load_text_blocks(transport, recorder, filename, page_numbers):
+    """Fetch text blocks of ``page_numbers``; returns ``{page: blocks}``"""
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return {}
+    status, body = recorder.timed(
+        'GET /get_text_blocks', transport.get, f'/get_text_blocks/{filename}?pages={_pages_param(page_numbers)}'
+    )
+    if status != 200 or not body or not body.get('success'):
+        return {}
+    return {page['page_num']: page['blocks'] for page in body['pages_blocks']}
+
+
+def _pages_param(page_numbers):
+    """Page list as app.js sends it, with runs written as ranges: ``1-3,7``"""
+    ranges = []
+    for page_number in sorted(set(page_numbers)):
+        if ranges and page_number == ranges[-1][1] + 1:
+            ranges[-1][1] = page_number
+        else:
+            ranges.append([page_number, page_number])
+    return ','.join(str(first) if first == last else f'{first}-{last}' for first, last in ranges)
+
+
+def _first_block(blocks):
+    for page_number in sorted(blocks):
+        for block in blocks[page_number]:
+            return dict(block, page_num=page_number)
+    return None
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process and its children from /proc"""
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak_rss = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._cpu_start = {}
+        self._cpu_end = {}
+
+    def start(self):
+        self._cpu_start = self._cpu_times()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._cpu_end = self._cpu_times()
+
+    def report(self, wall_seconds):
+        processes = []
+        ticks = os.sysconf('SC_CLK_TCK')
+        for pid, end in self._cpu_end.items():
+            cpu_seconds = (end - self._cpu_start.get(pid, end)) / ticks
+            processes.append({
+                'pid': pid,
+                'cpu_seconds': round(cpu_seconds, 3),
+                'cpu_utilisation': round(cpu_seconds / wall_seconds, 3) if wall_seconds else None,
+                'peak_rss_mb': round(self.peak_rss.get(pid, 0) / (1024 * 1024), 1)
+            })
+        return processes
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for pid in self._pids():
+                rss = _read_rss(pid)
+                if rss is not None:
+                    self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+
+    def _pids(self):
+        pids = [self.root_pid]
+        try:
+            for entry in os.listdir('/proc'):
+                if not entry.isdigit():
+                    continue
+                stat = _read_stat(int(entry))
+                if stat and stat[1] == self.root_pid:
+                    pids.append(int(entry))
+        except OSError:
+            pass
+        return pids
+
+    def _cpu_times(self):
+        times = {}
+        for pid in self._pids():
+            stat = _read_stat(pid)
+            if stat:
+                times[pid] = stat[0]
+        return times
+
+
+def _read_stat(pid):
+    """Return ``(utime + stime ticks, ppid)`` from /proc/<pid>/stat, or None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        return int(fields[11]) + int(fields[12]), int(fields[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _read_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarise(recorder, wall_seconds):
+    routes = []
+    for route, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        routes.append({
+            'route': route,
+            'requests': len(ordered),
+            'errors': recorder.errors.get(route, 0),
+            'throughput_rps': round(len(ordered) / wall_seconds, 2) if wall_seconds else None,
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 1),
+            'max_ms': round(ordered[-1] * 1000, 1)
+        })
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate concurrent editing sessions against the PDF editor')
+    parser.add_argument('--users', type=int, default=4, help='number of simultaneous simulated users')
+    parser.add_argument('--iterations', type=int, default=1, help='workflows each user runs back to back')
+    parser.add_argument('--edits', type=int, default=3, help='/edit_text calls per workflow')
+    parser.add_argument('--pages', type=int, default=10, help='pages in the synthetic test document')
+    parser.add_argument('--layout', default='mixed', choices=('text', 'image', 'mixed'))
+    parser.add_argument('--url', help='base URL of a running server (default: drive the app in-process)')
+    parser.add_argument('--gunicorn-pid', type=int, help='gunicorn master pid, to sample worker CPU and RSS')
+    parser.add_argument('--output', help='write the report as JSON to this path')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from benchmark import generate_pdf
+
+    workdir = tempfile.mkdtemp(prefix='pdf-load-')
+    source = os.path.join(workdir, 'loadtest.pdf')
+    generate_pdf(source, args.pages, args.layout)
+    with open(source, 'rb') as pdf_file:
+        pdf_bytes = pdf_file.read()
+
+    previous_cwd = os.getcwd()
+    if args.url:
+        make_transport = lambda: HttpTransport(args.url)
+        sampled_pid = args.gunicorn_pid
+    else:
+        # The app creates its working folders relative to the current directory
+        os.chdir(workdir)
+        import app as app_module
+        app_module.app.logger.disabled = True
+        make_transport = lambda: InProcessTransport(app_module)
+        sampled_pid = os.getpid()
+
+    recorder = LoadRecorder()
+
+    def user_loop():
+        transport = make_transport()
+        for _ in range(args.iterations):
+            run_user(transport, recorder, pdf_bytes, args.edits)
+
+    sampler = ProcessSampler(sampled_pid) if sampled_pid and os.path.isdir('/proc') else None
+    if sampler:
+        sampler.start()
+
+    print(f'Running {args.users} users x {args.iterations} workflow(s), '
+          f'{args.edits} edits each, on a {args.pages}-page {args.layout} document...')
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user_loop) for _ in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    if sampler:
+        sampler.stop()
+    os.chdir(previous_cwd)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    routes = summarise(recorder, wall_seconds)
+    total_requests = sum(route['requests'] for route in routes)
+    workflows = args.users * args.iterations
+    report = {
+        'users': args.users,
+        'iterations': args.iterations,
+        'edits': args.edits,
+        'pages': args.pages,
+        'layout': args.layout,
+        'target': args.url or 'in-process',
+        'wall_seconds': round(wall_seconds, 3),
+        'total_requests': total_requests,
+        'throughput_rps': round(total_requests / wall_seconds, 2),
+        'workflows_per_second': round(workflows / wall_seconds, 3),
+        'routes': routes,
+        'processes': sampler.report(wall_seconds) if sampler else []
+    }
+
+    print(f'\n{"route":<24}{"reqs":>7}{"errs":>6}{"rps":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for route in routes:
+        print(f'{route["route"]:<24}{route["requests"]:>7}{route["errors"]:>6}{route["throughput_rps"]:>9}'
+              f'{route["p50_ms"]:>10}{route["p95_ms"]:>10}{route["p99_ms"]:>10}')
+    print(f'\n{total_requests} requests in {wall_seconds:.2f}s '
+          f'({report["throughput_rps"]} req/s, {report["workflows_per_second"]} workflows/s)')
+    for process in report['processes']:
+        print(f'pid {process["pid"]}: {process["cpu_seconds"]}s CPU '
+              f'({process["cpu_utilisation"]} cores), peak RSS {process["peak_rss_mb"]} MB')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
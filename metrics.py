@@ -0,0 +1,247 @@
+"""
+Lightweight Prometheus-style metrics for the PDF editor.
+
+Counters, gauges and histograms are kept in plain dicts guarded by one lock,
+so recording a sample costs a dict lookup and an addition. Under gunicorn each
+worker periodically writes a snapshot to a shared folder and the ``/metrics``
+endpoint merges all snapshots, so a scrape sees the whole box no matter which
+worker answers it.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Gauges from other workers are ignored once their snapshot is this old
+GAUGE_STALE_SECONDS = 10
+
+
+class MetricsRegistry:
+    """Process-local metric store with Prometheus text exposition"""
+
+    def __init__(self, folder=None, flush_interval=1.0):
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self._metrics = {}  # name -> (kind, help, buckets)
+        self._values = {}  # name -> {label_tuple: value}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text, None)
+        self._values.setdefault(name, {})
+
+    def gauge(self, name, help_text):
+        self._metrics[name] = ('gauge', help_text, None)
+        self._values.setdefault(name, {})
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._metrics[name] = ('histogram', help_text, tuple(buckets))
+        self._values.setdefault(name, {})
+
+    def add_collector(self, collector):
+        """Register a callable returning ``(name, labels, value)`` samples at snapshot time"""
+        self._collectors.append(collector)
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._metrics[name][2]
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe the wall time of the ``with`` block into histogram ``name``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Return a JSON-serialisable copy of every series, including collected ones"""
+        collected = []
+        for collector in self._collectors:
+            try:
+                collected.extend(collector())
+            except Exception:
+                pass
+
+        with self._lock:
+            for name, labels, value in collected:
+                self._values[name][_label_key(labels)] = value
+            return {
+                name: [[list(key), _copy_value(value)] for key, value in series.items()]
+                for name, series in self._values.items()
+            }
+
+    def take(self):
+        """Return and reset the counters and histograms recorded so far, for :meth:`absorb`"""
+        with self._lock:
+            taken = {}
+            for name, series in self._values.items():
+                if series and self._metrics[name][0] != 'gauge':
+                    taken[name] = [[list(key), value] for key, value in series.items()]
+                    self._values[name] = {}
+            return taken
+
+    def absorb(self, taken):
+        """Add counters and histograms taken in another process, such as an executor pool process"""
+        with self._lock:
+            self._merge(self._values, taken, include_gauges=False)
+
+    def maybe_flush(self):
+        """Write this worker's snapshot to the shared folder, at most once per interval"""
+        if not self.folder:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            path = os.path.join(self.folder, f"{os.getpid()}.json")
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as snapshot_file:
+                json.dump(self.snapshot(), snapshot_file)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def render(self):
+        """Render all workers' metrics in the Prometheus text exposition format"""
+        merged = {}
+        self._merge(merged, self.snapshot(), include_gauges=True)
+
+        if self.folder and os.path.isdir(self.folder):
+            own_snapshot = f"{os.getpid()}.json"
+            now = time.time()
+            for entry in os.listdir(self.folder):
+                if entry == own_snapshot or not entry.endswith('.json'):
+                    continue
+                path = os.path.join(self.folder, entry)
+                try:
+                    fresh = now - os.path.getmtime(path) < GAUGE_STALE_SECONDS
+                    with open(path, 'r', encoding='utf-8') as snapshot_file:
+                        self._merge(merged, json.load(snapshot_file), include_gauges=fresh)
+                except (OSError, ValueError):
+                    continue
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value[0]):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else _format_number(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_number(value[1])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {value[2]}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {_format_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _merge(self, merged, snapshot, include_gauges):
+        for name, series in snapshot.items():
+            if name not in self._metrics:
+                continue
+            kind = self._metrics[name][0]
+            if kind == 'gauge' and not include_gauges:
+                continue
+            target = merged.setdefault(name, {})
+            for labels, value in series:
+                key = tuple(tuple(pair) for pair in labels)
+                if kind == 'histogram':
+                    current = target.get(key)
+                    if current is None:
+                        target[key] = _copy_value(value)
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                else:
+                    target[key] = target.get(key, 0) + value
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _copy_value(value):
+    if isinstance(value, list):
+        return [list(value[0]), value[1], value[2]]
+    return value
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in key
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+registry.counter('pdf_http_requests_total', 'HTTP requests handled, by route, method and status')
+registry.histogram('pdf_http_request_duration_seconds', 'HTTP request latency by route')
+registry.gauge('pdf_http_requests_in_flight', 'Requests currently being handled, by route')
+registry.counter('pdf_http_request_bytes_total', 'Request body bytes received, by route')
+registry.counter('pdf_http_response_bytes_total', 'Response body bytes sent, by route')
+registry.histogram('pdf_stage_duration_seconds', 'Time spent in internal processing stages')
+registry.counter('pdf_pages_processed_total', 'Pages processed, by operation')
+registry.counter('pdf_cache_hits_total', 'Per-page cache hits, by cache')
+registry.counter('pdf_cache_misses_total', 'Per-page cache misses, by cache')
+registry.gauge('pdf_cache_entries', 'Entries currently held in each per-page cache')
+registry.gauge('pdf_cache_bytes', 'Approximate bytes held in each per-page cache')
+registry.counter('pdf_admission_total', 'Expensive requests admitted or rejected (503), by operation')
+registry.histogram('pdf_admission_wait_seconds', 'Time admitted requests waited for capacity, by priority')
+registry.counter('pdf_singleflight_total', 'Coalesced computations by operation: computed here or shared from a concurrent request')
+registry.gauge('pdf_startup_seconds', 'Seconds spent importing the app, building it and preloading, per process')
+
+
+def stage(name):
+    """Time an internal processing stage such as ``fitz_open`` or ``docx_build``"""
+    return registry.time('pdf_stage_duration_seconds', stage=name)
+
+
+def observe_stage(name, seconds):
+    """Record a stage timing measured elsewhere, e.g. inside an executor process"""
+    registry.observe('pdf_stage_duration_seconds', seconds, stage=name)
+
+
+def pages_processed(operation, count):
+    registry.inc('pdf_pages_processed_total', count, operation=operation)
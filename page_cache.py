@@ -0,0 +1,111 @@
+"""
+In-memory LRU caches for rendered preview pages and extracted text blocks.
+
+Entries are keyed by ``(filename, page_num, ...)``. Every edit writes a new
+file, so an entry never goes stale for its filename; entries are only dropped
+when the LRU bound is hit or when a version is discarded from the edit history.
+
+Unchanged pages of a new version share their value with the parent's entry.
+Bytes are counted once per distinct value for as long as any entry holds it,
+so the byte bound stays true after the parent's entries are evicted.
+"""
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    """Thread-safe LRU cache for per-page data, bounded by entries and bytes"""
+
+    def __init__(self, max_entries=4096, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._values = {}  # id(value) -> [entries holding it, size]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """Return the cached value without counting a hit or miss or refreshing its position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def put(self, key, value, size=0):
+        with self._lock:
+            self._store(key, value, size)
+
+    def copy_pages(self, source, target, skip_pages=()):
+        """Reuse the entries of ``source`` for every page of ``target`` not in ``skip_pages``"""
+        skip_pages = set(skip_pages)
+        with self._lock:
+            carried = [
+                ((target,) + key[1:], entry)
+                for key, entry in self._entries.items()
+                if key[0] == source and key[1] not in skip_pages
+            ]
+            for key, (value, size) in carried:
+                self._store(key, value, size)
+        return len(carried)
+
+    def invalidate(self, filename, pages=None):
+        """Drop entries for ``filename`` (only the given pages when ``pages`` is set)"""
+        pages = set(pages) if pages is not None else None
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if key[0] == filename and (pages is None or key[1] in pages)
+            ]
+            for key in stale:
+                self._release(self._entries.pop(key))
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._values.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _store(self, key, value, size):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._release(previous)
+        self._entries[key] = (value, size)
+        shared = self._values.get(id(value))
+        if shared is None:
+            self._values[id(value)] = [1, size]
+            self._bytes += size
+        else:
+            shared[0] += 1
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._release(evicted)
+
+    def _release(self, entry):
+        """Drop one entry's hold on its value; its bytes go once no entry holds it"""
+        shared = self._values[id(entry[0])]
+        shared[0] -= 1
+        if not shared[0]:
+            del self._values[id(entry[0])]
+            self._bytes -= shared[1]
@@ -0,0 +1,1114 @@
+"""
+Headless PDF operations: text and image extraction, text edits, split, merge,
+optimisation and Word conversion.
+
+These functions take file paths and return plain data, with no Flask request
+or app context, so the web routes, batch jobs (see batch.py) and other Python
+code share one implementation. python-docx and PyPDF2 are imported on first
+use, like in app.py.
+
+Documents are opened from read-only memory maps, so every worker process on a
+host reads the same page-cache-backed copy of a hot file instead of copying
+it into its own buffers.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+
+import executor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Windows cannot delete a mapped file, which would break cleanup_old_files
+MMAP_DOCUMENTS = os.environ.get('PDF_EDITOR_MMAP', '1' if os.name == 'posix' else '0') == '1'
+MMAP_CACHE_SIZE = 64  # mapped files kept per process
+
+# Image filters whose stream is a complete image file; such streams are copied
+# out of the PDF byte for byte instead of being decoded and re-encoded
+PASSTHROUGH_FILTERS = {'/DCTDecode': 'jpg', '/JPXDecode': 'jp2'}
+EXTRACTED_EXTENSIONS = {'jpeg': 'jpg', 'jpx': 'jp2'}
+# extract_image formats Word displays as they are; others are converted to PNG
+WORD_IMAGE_FORMATS = ('jpeg', 'png')
+
+_mapped_files = OrderedDict()  # (path, inode, size, mtime_ns) -> mmap
+_mapped_files_lock = threading.Lock()
+
+
+def open_document(filepath):
+    """
+    Open a PDF with PyMuPDF, reading it through a shared memory map.
+
+    Files are never rewritten in place (every edit writes a new file), so a
+    mapping stays valid for as long as any document opened from it is alive.
+    Falls back to a plain ``fitz.open`` when mapping is disabled or the file
+    is empty.
+    """
+    buffer = _map_file(filepath) if MMAP_DOCUMENTS else None
+    if buffer is None:
+        return fitz.open(filepath)
+    # PyMuPDF reads straight from the buffer; the memoryview keeps the map alive
+    return fitz.open(stream=memoryview(buffer), filetype='pdf')
+
+
+def _map_file(filepath):
+    stat = os.stat(filepath)
+    if not stat.st_size:
+        return None
+
+    key = (os.path.abspath(filepath), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _mapped_files_lock:
+        buffer = _mapped_files.get(key)
+        if buffer is not None:
+            _mapped_files.move_to_end(key)
+            return buffer
+
+    with open(filepath, 'rb') as pdf_file:
+        buffer = mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with _mapped_files_lock:
+        buffer = _mapped_files.setdefault(key, buffer)
+        _mapped_files.move_to_end(key)
+        while len(_mapped_files) > MMAP_CACHE_SIZE:
+            # Not closed explicitly: documents still open keep their map alive
+            _mapped_files.popitem(last=False)
+    return buffer
+
+
+def page_count(filepath):
+    """Number of pages in the PDF at ``filepath``"""
+    with metrics.stage('fitz_open'):
+        doc = open_document(filepath)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def extract_text(filepath, page_numbers=None):
+    """
+    Extract plain text; returns ``[{'page_num': n, 'text': ...}]`` in page order.
+
+    ``page_numbers`` are 1-based and default to every page. Extraction runs in
+    the executor pool when one is configured.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, page_count(filepath) + 1)
+    page_numbers = list(page_numbers)
+
+    results = executor.map_pages(executor.extract_plain_text, filepath, page_numbers)
+    pages_text = []
+    for page_number in page_numbers:
+        text, seconds = results[page_number]
+        metrics.observe_stage('text_extraction', seconds)
+        pages_text.append({
+            'page_num': page_number,
+            'text': text
+        })
+
+    metrics.pages_processed('extract_text', len(pages_text))
+    return pages_text
+
+
+def split_pdf(filepath, output_path, start_page=1, end_page=None):
+    """
+    Write pages ``start_page``..``end_page`` (1-based, inclusive) to ``output_path``.
+
+    ``end_page`` defaults to the last page. Returns ``(end_page, pages_written)``.
+    """
+    import PyPDF2
+
+    with open(filepath, 'rb') as input_file:
+        reader = PyPDF2.PdfReader(input_file)
+        writer = PyPDF2.PdfWriter()
+
+        total_pages = len(reader.pages)
+        if not end_page:
+            end_page = total_pages
+
+        for page_num in range(start_page - 1, min(end_page, total_pages)):
+            writer.add_page(reader.pages[page_num])
+
+        with metrics.stage('save'):
+            with open(output_path, 'wb') as output_file:
+                writer.write(output_file)
+
+        pages_written = len(writer.pages)
+
+    metrics.pages_processed('split', pages_written)
+    return end_page, pages_written
+
+
+def merge_pdfs(filepaths, output_path):
+    """Concatenate ``filepaths`` in order into ``output_path``; returns the page count"""
+    import PyPDF2
+
+    merger = PyPDF2.PdfMerger()
+    try:
+        for filepath in filepaths:
+            merger.append(filepath)
+
+        with metrics.stage('save'):
+            with open(output_path, 'wb') as output_file:
+                merger.write(output_file)
+
+        total_pages = len(merger.pages)
+    finally:
+        merger.close()
+
+    metrics.pages_processed('merge', total_pages)
+    return total_pages
+
+
+def optimize(filepath, output_path, preset):
+    """
+    Write a smaller copy of ``filepath`` to ``output_path``; returns the page count.
+
+    ``preset`` is one of app.OPTIMIZE_PRESETS: images above ``dpi_threshold``
+    are resampled to ``dpi_target`` at JPEG ``quality`` and fonts are subset
+    if ``subset_fonts`` is set.
+    """
+    with metrics.stage('fitz_open'):
+        doc = open_document(filepath)
+    try:
+        with metrics.stage('optimize'):
+            if preset['dpi_threshold']:
+                doc.rewrite_images(
+                    dpi_threshold=preset['dpi_threshold'],
+                    dpi_target=preset['dpi_target'],
+                    quality=preset['quality']
+                )
+            if preset['subset_fonts']:
+                doc.subset_fonts()
+
+        with metrics.stage('save'):
+            doc.save(
+                output_path,
+                garbage=4,  # drop unused objects and merge duplicates
+                clean=True,
+                deflate=True,
+                deflate_images=True,
+                deflate_fonts=True,
+                use_objstms=1
+            )
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def add_text(filepath, output_path, page_num, text, x, y, font_size=12, color=(0, 0, 0)):
+    """
+    Write ``text`` on page ``page_num`` and save the result to ``output_path``.
+
+    ``x`` and ``y`` are measured from the top-left corner, as the editor shows
+    the page; returns the PDF coordinates the text was placed at.
+    """
+    with metrics.stage('fitz_open'):
+        doc = open_document(filepath)
+    try:
+        page = doc.load_page(page_num - 1)
+
+        # PDF coordinates have their origin at the bottom-left
+        pdf_x = x
+        pdf_y = page.rect.height - y
+
+        # Create text rectangle for better positioning
+        text_rect = fitz.Rect(pdf_x, pdf_y - font_size, pdf_x + 200, pdf_y + 5)
+
+        # Insert text with better formatting
+        page.insert_textbox(
+            text_rect,
+            text,
+            fontsize=font_size,
+            color=color,
+            fontname="helv",  # Helvetica font
+            align=0  # Left align
+        )
+
+        with metrics.stage('save'):
+            doc.save(output_path)
+    finally:
+        doc.close()
+    metrics.pages_processed('add_text', 1)
+    return pdf_x, pdf_y
+
+
+def edit_text(filepath, output_path, page_num, bbox, new_text, mode='redact', origin=None,
+              font_info=None, preserve_formatting=True):
+    """
+    Replace the text in ``bbox`` on page ``page_num`` and save the result to ``output_path``.
+
+    ``mode`` 'redact' removes the old glyphs from the content stream, 'cover'
+    paints a white box over them. ``new_text`` goes on the old text's
+    baseline (``origin``, looked up from the span at ``bbox`` if not given),
+    in the original font when ``font_info`` is given.
+    """
+    with metrics.stage('fitz_open'):
+        doc = open_document(filepath)
+    try:
+        page = doc.load_page(page_num - 1)
+
+        # Validate and adjust bbox coordinates if needed
+        bbox = list(bbox)
+        page_rect = page.rect
+        bbox[0] = max(0, min(bbox[0], page_rect.width))
+        bbox[1] = max(0, min(bbox[1], page_rect.height))
+        bbox[2] = max(bbox[0], min(bbox[2], page_rect.width))
+        bbox[3] = max(bbox[1], min(bbox[3], page_rect.height))
+
+        # The replacement goes on the old text's baseline. Placing it relative
+        # to the bbox instead moves it down on every edit of the same line,
+        # until the removal area reaches the next line. The span is looked up
+        # before its glyphs are removed if the editor did not send its origin.
+        if not (isinstance(origin, (list, tuple)) and len(origin) == 2):
+            origin = _span_origin(page, bbox)
+
+        if mode == 'redact':
+            # Remove the old glyphs from the content stream instead of painting
+            # over them, so hidden text never piles up across edits. Span boxes
+            # of neighbouring lines overlap, and redaction drops every glyph the
+            # area touches, so the area is inset rather than padded.
+            inset_y = (bbox[3] - bbox[1]) * 0.25
+            inset_x = min(0.5, (bbox[2] - bbox[0]) / 4)
+            rect = fitz.Rect(bbox[0] + inset_x, bbox[1] + inset_y, bbox[2] - inset_x, bbox[3] - inset_y)
+            page.add_redact_annot(rect, fill=False)
+            page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=fitz.PDF_REDACT_LINE_ART_NONE)
+            logger.info(f'Removed old text in area: {rect}')
+        else:
+            # Create a white rectangle to cover the old text with minimal padding
+            padding = 1  # Minimal padding to avoid covering adjacent text
+            rect = fitz.Rect(
+                max(0, bbox[0] - padding),
+                max(0, bbox[1] - padding),
+                min(page_rect.width, bbox[2] + padding),
+                min(page_rect.height, bbox[3] + padding)
+            )
+            page.draw_rect(rect, color=None, fill=(1, 1, 1))  # White fill
+            logger.info(f'Covered old text area: {rect}')
+
+        if new_text and new_text.strip():
+            _insert_replacement_text(page, bbox, new_text, origin, font_info or {}, preserve_formatting)
+
+        if mode == 'redact':
+            # Merge the streams added by insert_text into one compact stream
+            page.clean_contents()
+
+        _save_edited(doc, output_path, garbage=2 if mode == 'redact' else 0)
+    finally:
+        doc.close()
+    metrics.pages_processed('edit_text', 1)
+
+
+def _span_origin(page, bbox):
+    """Baseline start of the text span whose box is ``bbox``, or None if there is no such span"""
+    best, best_distance = None, 1.0  # points; span boxes round-trip through JSON exactly
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                distance = max(abs(a - b) for a, b in zip(span["bbox"], bbox))
+                if distance < best_distance:
+                    best, best_distance = span["origin"], distance
+    return best
+
+
+def _insert_replacement_text(page, bbox, new_text, origin, font_info, preserve_formatting):
+    """Write ``new_text`` for :func:`edit_text`, trying simpler fonts if the original cannot be used"""
+    if preserve_formatting and font_info:
+        # Use original font properties
+        font_size = font_info.get('size', 12)
+        font_name = font_info.get('font', 'Arial')
+        font_color = font_info.get('color', 0)
+        font_flags = font_info.get('flags', 0)
+
+        logger.info(f'Using preserved formatting - Font: {font_name}, Size: {font_size}, Color: {font_color}, Flags: {font_flags}')
+
+        # Convert font color from integer to RGB tuple
+        if isinstance(font_color, int):
+            if font_color == 0:
+                color_rgb = (0, 0, 0)  # Black
+            else:
+                # Extract RGB components from integer (BGR format in PyMuPDF)
+                blue = (font_color & 0xFF) / 255.0
+                green = ((font_color >> 8) & 0xFF) / 255.0
+                red = ((font_color >> 16) & 0xFF) / 255.0
+                color_rgb = (red, green, blue)
+        else:
+            color_rgb = (0, 0, 0)  # Default to black
+
+        # Enhanced font mapping with better support for common fonts
+        base_font = 'helv'  # Default fallback
+        font_name_lower = font_name.lower()
+
+        # Map common font families
+        if any(name in font_name_lower for name in ['arial', 'helvetica']):
+            base_font = 'helv'
+        elif any(name in font_name_lower for name in ['times', 'roman']):
+            base_font = 'times'
+        elif any(name in font_name_lower for name in ['courier', 'mono']):
+            base_font = 'cour'
+        elif 'symbol' in font_name_lower:
+            base_font = 'symb'
+        elif 'zapf' in font_name_lower:
+            base_font = 'zadb'
+
+        # Apply style flags more robustly
+        is_bold = bool(font_flags & (1 << 4)) or 'bold' in font_name_lower
+        is_italic = bool(font_flags & (1 << 6)) or any(style in font_name_lower for style in ['italic', 'oblique'])
+
+        if is_bold and is_italic:
+            if base_font == 'times':
+                base_font = 'times-bolditalic'
+            elif base_font == 'helv':
+                base_font = 'helv-boldoblique'
+            elif base_font == 'cour':
+                base_font = 'cour-boldoblique'
+        elif is_bold:
+            base_font += '-bold'
+        elif is_italic:
+            if base_font == 'times':
+                base_font += '-italic'
+            else:
+                base_font += '-oblique'
+
+        logger.info(f'Mapped font: {font_name} -> {base_font}')
+    else:
+        # Use default formatting
+        bbox_height = bbox[3] - bbox[1]
+        font_size = min(12, max(8, bbox_height * 0.7))
+        base_font = 'helv'
+        color_rgb = (0, 0, 0)
+
+    # Calculate text position: the original baseline, or for text that
+    # is not a span (a region drawn by hand) slightly above the bbox bottom
+    if origin:
+        text_x, text_y = origin
+    else:
+        text_x = bbox[0]
+        text_y = bbox[3] - 2
+
+    # Try multiple insertion methods with better error handling
+    text_inserted = False
+
+    # Method 1: Try with preserved font
+    if preserve_formatting and font_info:
+        try:
+            page.insert_text(
+                (text_x, text_y),
+                new_text,
+                fontsize=font_size,
+                color=color_rgb,
+                fontname=base_font
+            )
+            logger.info(f'Text inserted with preserved font: {base_font}')
+            text_inserted = True
+        except Exception as font_error:
+            logger.warning(f'Preserved font insertion failed: {font_error}')
+
+    # Method 2: Try with basic helvetica
+    if not text_inserted:
+        try:
+            page.insert_text(
+                (text_x, text_y),
+                new_text,
+                fontsize=font_size,
+                color=color_rgb,
+                fontname='helv'
+            )
+            logger.info('Text inserted with helvetica fallback')
+            text_inserted = True
+        except Exception as helv_error:
+            logger.warning(f'Helvetica insertion failed: {helv_error}')
+
+    # Method 3: Try with no font specification
+    if not text_inserted:
+        try:
+            page.insert_text(
+                (text_x, text_y),
+                new_text,
+                fontsize=font_size,
+                color=(0, 0, 0)
+            )
+            logger.info('Text inserted with default font')
+            text_inserted = True
+        except Exception as default_error:
+            logger.warning(f'Default font insertion failed: {default_error}')
+
+    # Method 4: Last resort - use textbox
+    if not text_inserted:
+        try:
+            text_rect = fitz.Rect(bbox[0], bbox[1], bbox[2], bbox[3])
+            page.insert_textbox(
+                text_rect,
+                new_text,
+                fontsize=font_size,
+                color=(0, 0, 0),
+                align=0
+            )
+            logger.info('Text inserted using textbox fallback')
+            text_inserted = True
+        except Exception as textbox_error:
+            logger.error(f'All text insertion methods failed: {textbox_error}')
+
+    if not text_inserted:
+        raise Exception("Failed to insert text using any method")
+
+
+def _save_edited(doc, output_path, garbage):
+    """Save an edited document, retrying with plainer options and via a temporary file"""
+    try:
+        # Redaction leaves the old content streams unreferenced, so edits pass
+        # garbage=2 to drop them rather than carry them into every version
+        with metrics.stage('save'):
+            doc.save(output_path, garbage=garbage)
+        logger.info('PDF saved successfully with standard method')
+        return
+    except Exception as save_error:
+        logger.warning(f'Standard save failed: {save_error}')
+
+    try:
+        doc.save(output_path, garbage=0, clean=False, deflate=False)
+        logger.info('PDF saved successfully with alternative options')
+        return
+    except Exception as alt_save_error:
+        logger.warning(f'Alternative save failed: {alt_save_error}')
+
+    import shutil
+    import tempfile
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
+        temp_path = temp_file.name
+    try:
+        doc.save(temp_path, garbage=garbage)
+        shutil.move(temp_path, output_path)
+        logger.info('PDF saved successfully using temporary file method')
+    except Exception as temp_save_error:
+        logger.error(f'All save methods failed: {temp_save_error}')
+        raise Exception("Failed to save PDF using any method")
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def convert_to_word(filepath, output_path):
+    """
+    Convert a PDF to a .docx at ``output_path``, keeping fonts, sizes, colours and images.
+
+    Returns ``{'pages': n, 'text_blocks': n, 'images': n}``. A page that fails
+    to convert is replaced by a red error note instead of failing the whole
+    document. Each PDF image is read once and stored once in the .docx however
+    many pages show it.
+    """
+    _word_template_bytes()
+    from docx.shared import Inches, Pt, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    # Open PDF document
+    with metrics.stage('fitz_open'):
+        doc = open_document(filepath)
+
+    # Create Word document
+    word_doc = _new_word_document()
+
+    # Set document margins (narrower for better content fit)
+    sections = word_doc.sections
+    for section in sections:
+        section.top_margin = Inches(0.5)
+        section.bottom_margin = Inches(0.5)
+        section.left_margin = Inches(0.75)
+        section.right_margin = Inches(0.75)
+    text_width = sections[0].page_width - sections[0].left_margin - sections[0].right_margin
+
+    # Process each page
+    build_started = time.perf_counter()
+    total_text_blocks = 0
+    total_images = 0
+    word_images = {}  # xref -> bytes to embed (None if unusable), shared by all pages
+    for page_num in range(len(doc)):
+        try:
+            page = doc.load_page(page_num)
+
+            # Add page break for pages after the first
+            if page_num > 0:
+                word_doc.add_page_break()
+
+            # Add page header (optional, can be disabled for cleaner output)
+            if len(doc) > 1:  # Only add page numbers for multi-page documents
+                page_header = word_doc.add_paragraph()
+                page_header.add_run(f"Page {page_num + 1}").bold = True
+                page_header.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                page_header.space_after = Pt(6)
+
+            # Extract text blocks with formatting
+            text_blocks = _extract_formatted_text_blocks(page)
+            total_text_blocks += len(text_blocks)
+
+            # Images keep their width relative to the page and go between the
+            # lines of text by vertical position
+            placements = _page_image_placements(page)
+            emu_per_point = text_width / page.rect.width
+
+            if text_blocks:
+                # Group text blocks by approximate lines
+                lines = _group_text_blocks_into_lines(text_blocks)
+
+                # Convert lines to Word paragraphs
+                for line in lines:
+                    while placements and placements[0][0].y0 <= line[0]['bbox'][1]:
+                        total_images += _add_image_to_word_doc(
+                            word_doc, doc, placements.pop(0), word_images, emu_per_point
+                        )
+                    _add_line_to_word_doc(word_doc, line)
+            else:
+                # Fallback: extract simple text
+                simple_text = page.get_text()
+                if simple_text.strip():
+                    # Split into paragraphs more intelligently
+                    paragraphs = []
+                    current_para = []
+
+                    for line in simple_text.split('\n'):
+                        line = line.strip()
+                        if line:
+                            current_para.append(line)
+                        else:
+                            if current_para:
+                                paragraphs.append(' '.join(current_para))
+                                current_para = []
+
+                    # Add the last paragraph
+                    if current_para:
+                        paragraphs.append(' '.join(current_para))
+
+                    # Add paragraphs to Word document
+                    for para_text in paragraphs:
+                        if para_text.strip():
+                            para = word_doc.add_paragraph(para_text.strip())
+                            para.space_after = Pt(6)
+
+            for placement in placements:
+                total_images += _add_image_to_word_doc(
+                    word_doc, doc, placement, word_images, emu_per_point
+                )
+
+            # Add some spacing between pages (but not after the last page)
+            if page_num < len(doc) - 1:
+                word_doc.add_paragraph()
+
+        except Exception as page_error:
+            logger.error(f'Error processing page {page_num + 1}: {str(page_error)}')
+            # Add error message to document
+            error_para = word_doc.add_paragraph()
+            error_run = error_para.add_run(f"[Error processing page {page_num + 1}: {str(page_error)}]")
+            error_run.font.color.rgb = RGBColor(255, 0, 0)  # Red color
+            error_run.italic = True
+
+    metrics.observe_stage('docx_build', time.perf_counter() - build_started)
+
+    total_pages = len(doc)
+    doc.close()
+    metrics.pages_processed('convert_to_word', total_pages)
+
+    # Save Word document
+    with metrics.stage('save'):
+        word_doc.save(output_path)
+
+    return {'pages': total_pages, 'text_blocks': total_text_blocks, 'images': total_images}
+
+
+def images_zip(filepath, summary=None):
+    """
+    Yield a zip archive of every image in the PDF, in chunks, one image at a time.
+
+    Each image object is read once however many pages use it, and images with
+    identical bytes are stored once. JPEG and JPEG 2000 images are stored as
+    their original streams; other images are converted to PNG by PyMuPDF.
+    Soft masks are stored as separate images. ``manifest.json`` at the end of
+    the archive lists every image with its pages, size and file. If given,
+    ``summary`` is filled with the counts once the archive is complete.
+    """
+    output = _ChunkWriter()
+    if summary is None:
+        summary = {}
+    summary.update({'pages': 0, 'images': 0, 'files': 0, 'passthrough': 0, 'bytes': 0})
+
+    with open_document(filepath) as doc, zipfile.ZipFile(output, 'w') as archive:
+        images = _collect_images(doc)
+        written = {}  # sha1 of the image bytes -> file name in the archive
+        manifest = []
+        for image in images.values():
+            data, ext, passthrough = _image_data(doc, image['xref'])
+            digest = hashlib.sha1(data).hexdigest()
+            if digest not in written:
+                name = f"images/page{image['pages'][0]:04d}-xref{image['xref']}.{ext}"
+                # Image formats are already compressed; deflating them again only costs CPU
+                archive.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+                written[digest] = name
+                summary['files'] += 1
+                summary['bytes'] += len(data)
+                summary['passthrough'] += passthrough
+            image['file'] = written[digest]
+            image['passthrough'] = passthrough
+            manifest.append(image)
+            chunk = output.take()
+            if chunk:
+                yield chunk
+
+        summary['pages'] = len(doc)
+        summary['images'] = len(manifest)
+        for image in manifest:
+            if image['smask']:
+                image['smask'] = images[image['smask']]['file']
+        archive.writestr(
+            zipfile.ZipInfo('manifest.json', time.localtime()[:6]),
+            json.dumps({'source': os.path.basename(filepath), 'images': manifest, 'summary': summary}, indent=2),
+            compress_type=zipfile.ZIP_DEFLATED
+        )
+    yield output.take()
+    metrics.pages_processed('extract_images', summary['pages'])
+
+
+def write_images_zip(filepath, output_path):
+    """Write the :func:`images_zip` archive to ``output_path``; returns its summary"""
+    summary = {}
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with metrics.stage('save'):
+            with open(temp_path, 'wb') as output_file:
+                for chunk in images_zip(filepath, summary):
+                    output_file.write(chunk)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return summary
+
+
+def _collect_images(doc):
+    """Every image object used by a page, once each: ``{xref: info}`` in page order"""
+    images = OrderedDict()
+    for page in doc:
+        # full=True includes images inside form XObjects
+        for xref, smask, width, height, bpc, colorspace, *_ in page.get_images(full=True):
+            if xref not in images:
+                images[xref] = {
+                    'xref': xref,
+                    'pages': [],
+                    'width': width,
+                    'height': height,
+                    'bpc': bpc,
+                    'colorspace': colorspace,
+                    'smask': smask or None
+                }
+            if page.number + 1 not in images[xref]['pages']:
+                images[xref]['pages'].append(page.number + 1)
+
+    for image in list(images.values()):
+        smask = image['smask']
+        if smask and smask not in images:
+            images[smask] = {
+                'xref': smask,
+                'pages': image['pages'],
+                'width': image['width'],
+                'height': image['height'],
+                'bpc': None,
+                'colorspace': 'mask',
+                'smask': None
+            }
+    return images
+
+
+def _image_data(doc, xref):
+    """Return ``(bytes, extension, passthrough)`` for one image object"""
+    kind, image_filter = doc.xref_get_key(xref, 'Filter')
+    if kind == 'name' and image_filter in PASSTHROUGH_FILTERS:
+        return doc.xref_stream_raw(xref), PASSTHROUGH_FILTERS[image_filter], True
+
+    # Also keeps JPEGs whole when they only sit under a transport filter such as
+    # ASCII85Decode; everything else is decoded and written as PNG
+    extracted = doc.extract_image(xref)
+    ext = EXTRACTED_EXTENSIONS.get(extracted['ext'], extracted['ext'])
+    return extracted['image'], ext, ext in PASSTHROUGH_FILTERS.values()
+
+
+class _ChunkWriter:
+    """Write-only file for zipfile that hands out what was written since the last take"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_word_template = None
+_word_template_lock = threading.Lock()
+
+
+def _word_template_bytes():
+    """Import python-docx and read its default template once per process (or once in a preloading master)"""
+    global _word_template
+    if _word_template is None:
+        # Concurrent first imports of python-docx from several threads can deadlock
+        with _word_template_lock:
+            if _word_template is None:
+                from docx.api import _default_docx_path
+                with open(_default_docx_path(), 'rb') as template_file:
+                    _word_template = template_file.read()
+    return _word_template
+
+
+def _new_word_document():
+    """Create an empty Word document from the cached default template"""
+    from docx import Document
+    return Document(io.BytesIO(_word_template_bytes()))
+
+
+def _extract_page_text_blocks(page):
+    """Extract positioned text spans from a page, with fallbacks for unusual PDFs"""
+    text_blocks = []
+
+    try:
+        # Try to get structured text blocks first
+        blocks = page.get_text("dict")
+
+        for block in blocks["blocks"]:
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        if span["text"].strip():  # Only include non-empty text
+                            text_blocks.append({
+                                'text': span["text"],
+                                'bbox': span["bbox"],  # [x0, y0, x1, y1]
+                                'origin': span["origin"],  # baseline start, where replacements are written
+                                'font': span.get("font", "unknown"),
+                                'size': span.get("size", 12),
+                                'flags': span.get("flags", 0),
+                                'color': span.get("color", 0)
+                            })
+
+        # If no structured text found, try alternative methods
+        if not text_blocks:
+            # Try getting text with bboxes using a different method
+            text_dict = page.get_text("rawdict")
+            for block in text_dict.get("blocks", []):
+                if block.get("type") == 0:  # Text block
+                    for line in block.get("lines", []):
+                        for span in line.get("spans", []):
+                            if span.get("text", "").strip():
+                                text_blocks.append({
+                                    'text': span["text"],
+                                    'bbox': span["bbox"],
+                                    'origin': span["origin"],
+                                    'font': span.get("font", "unknown"),
+                                    'size': span.get("size", 12),
+                                    'flags': span.get("flags", 0),
+                                    'color': span.get("color", 0)
+                                })
+
+        # If still no text, try simple text extraction with manual bbox estimation
+        if not text_blocks:
+            simple_text = page.get_text()
+            if simple_text.strip():
+                # Create a single text block for the entire page content
+                page_rect = page.rect
+                text_blocks.append({
+                    'text': simple_text,
+                    'bbox': [50, 50, page_rect.width - 50, page_rect.height - 50],
+                    'font': "unknown",
+                    'size': 12,
+                    'flags': 0,
+                    'color': 0
+                })
+
+    except Exception:
+        # Fallback for problematic pages
+        try:
+            simple_text = page.get_text()
+            if simple_text.strip():
+                page_rect = page.rect
+                text_blocks.append({
+                    'text': simple_text,
+                    'bbox': [50, 50, page_rect.width - 50, page_rect.height - 50],
+                    'font': "unknown",
+                    'size': 12,
+                    'flags': 0,
+                    'color': 0
+                })
+        except:
+            pass  # Skip problematic pages
+
+    return text_blocks
+
+
+def _extract_formatted_text_blocks(page):
+    """Extract text blocks with detailed formatting information"""
+    text_blocks = []
+
+    try:
+        # Get structured text data
+        text_dict = page.get_text("dict")
+
+        for block in text_dict.get("blocks", []):
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        if span["text"].strip():
+                            # Extract formatting details
+                            font_info = {
+                                'text': span["text"],
+                                'bbox': span["bbox"],
+                                'font': span.get("font", "Arial"),
+                                'size': span.get("size", 12),
+                                'flags': span.get("flags", 0),
+                                'color': span.get("color", 0),
+                                'origin': span.get("origin", [0, 0])
+                            }
+
+                            # Determine text properties
+                            font_info['is_bold'] = bool(font_info['flags'] & (1 << 4))
+                            font_info['is_italic'] = bool(font_info['flags'] & (1 << 6))
+                            font_info['is_underline'] = bool(font_info['flags'] & (1 << 2))
+
+                            # Convert color to RGB
+                            color_int = font_info['color']
+                            if color_int == 0:
+                                font_info['rgb_color'] = (0, 0, 0)  # Black
+                            else:
+                                b = (color_int & 0xFF)
+                                g = ((color_int >> 8) & 0xFF)
+                                r = ((color_int >> 16) & 0xFF)
+                                font_info['rgb_color'] = (r, g, b)
+
+                            text_blocks.append(font_info)
+
+    except Exception as e:
+        logger.warning(f'Error extracting formatted text blocks: {str(e)}')
+
+    return text_blocks
+
+
+def _group_text_blocks_into_lines(text_blocks):
+    """Group text blocks into logical lines based on Y coordinates"""
+    if not text_blocks:
+        return []
+
+    # Sort blocks by Y coordinate (top to bottom), then X coordinate (left to right)
+    sorted_blocks = sorted(text_blocks, key=lambda b: (b['bbox'][1], b['bbox'][0]))
+
+    lines = []
+    current_line = []
+    current_y = None
+    y_tolerance = 5  # Pixels tolerance for same line
+
+    for block in sorted_blocks:
+        block_y = block['bbox'][1]  # Top Y coordinate
+
+        if current_y is None or abs(block_y - current_y) <= y_tolerance:
+            # Same line
+            current_line.append(block)
+            current_y = block_y
+        else:
+            # New line
+            if current_line:
+                lines.append(current_line)
+            current_line = [block]
+            current_y = block_y
+
+    # Add the last line
+    if current_line:
+        lines.append(current_line)
+
+    return lines
+
+
+def _add_line_to_word_doc(word_doc, line_blocks):
+    """Add a line of text blocks to Word document with formatting"""
+    if not line_blocks:
+        return
+
+    from docx.shared import Pt, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    # Create paragraph
+    paragraph = word_doc.add_paragraph()
+
+    # Determine paragraph alignment based on text position
+    page_width = 595  # Approximate A4 width in points
+    avg_x = sum(block['bbox'][0] for block in line_blocks) / len(line_blocks)
+
+    if avg_x < page_width * 0.2:
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
+    elif avg_x > page_width * 0.8:
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    elif page_width * 0.4 < avg_x < page_width * 0.6:
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    else:
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+    # Add text runs with formatting
+    for block in line_blocks:
+        run = paragraph.add_run(block['text'])
+
+        # Apply font formatting
+        try:
+            # Font size
+            run.font.size = Pt(max(8, min(72, block['size'])))
+
+            # Font family (map PDF fonts to Word fonts)
+            font_name = _map_pdf_font_to_word(block['font'])
+            run.font.name = font_name
+
+            # Font style
+            run.font.bold = block['is_bold']
+            run.font.italic = block['is_italic']
+            run.font.underline = block['is_underline']
+
+            # Font color
+            r, g, b = block['rgb_color']
+            run.font.color.rgb = RGBColor(r, g, b)
+
+        except Exception as e:
+            logger.warning(f'Error applying formatting to text run: {str(e)}')
+
+        # Add space between blocks if they're not adjacent
+        if block != line_blocks[-1]:  # Not the last block
+            next_block = line_blocks[line_blocks.index(block) + 1]
+            current_right = block['bbox'][2]
+            next_left = next_block['bbox'][0]
+
+            # Add space if there's a gap
+            if next_left - current_right > 5:  # 5 pixel threshold
+                paragraph.add_run(' ')
+
+
+def _page_image_placements(page):
+    """``[(rect, xref, smask)]`` for the images drawn on a page, top to bottom"""
+    placements = []
+    for item in page.get_images(full=True):
+        # Found from the image's name in the content stream, without decoding it
+        rect = page.get_image_bbox(item) & page.rect
+        if rect.is_empty or rect.is_infinite or rect.width < 1 or rect.height < 1:
+            continue
+        placements.append((rect, item[0], item[1]))
+    placements.sort(key=lambda placement: (placement[0].y0, placement[0].x0))
+    return placements
+
+
+def _add_image_to_word_doc(word_doc, doc, placement, word_images, emu_per_point):
+    """Add one image as its own paragraph; returns 1 if it was added, else 0"""
+    from docx.shared import Emu
+
+    rect, xref, smask = placement
+    if xref not in word_images:
+        try:
+            word_images[xref] = _word_image_bytes(doc, xref, smask)
+        except Exception as e:
+            logger.warning(f'Skipping image {xref} in Word output: {str(e)}')
+            word_images[xref] = None
+    if word_images[xref] is None:
+        return 0
+
+    # python-docx stores identical image bytes as one media part, so an image
+    # repeated on every page (a logo) is embedded once
+    word_doc.add_paragraph().add_run().add_picture(
+        io.BytesIO(word_images[xref]),
+        width=Emu(int(rect.width * emu_per_point)),
+        height=Emu(int(rect.height * emu_per_point))
+    )
+    return 1
+
+
+def _word_image_bytes(doc, xref, smask):
+    """
+    Image file bytes for the .docx.
+
+    RGB and grayscale JPEGs are the PDF's own stream, and images PyMuPDF
+    extracts as PNG are used as they come. Only images with a soft mask, CMYK
+    images and formats Word cannot show (JPEG 2000, JBIG2) are decoded and
+    written as PNG.
+    """
+    extracted = doc.extract_image(xref)
+    if not smask and extracted['ext'] in WORD_IMAGE_FORMATS and extracted['colorspace'] <= 3:
+        return extracted['image']
+
+    pixmap = fitz.Pixmap(doc, xref)
+    if pixmap.colorspace and pixmap.colorspace.n > 3:
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    if smask:
+        pixmap = fitz.Pixmap(pixmap, fitz.Pixmap(doc, smask))
+    return pixmap.tobytes('png')
+
+
+# PDF font names to Word-compatible font names. Built once at import, so
+# workers forked from a preloading master share it.
+WORD_FONT_MAPPING = {
+    # Helvetica family
+    'helv': 'Arial',
+    'helvetica': 'Arial',
+    'helveticabold': 'Arial',
+    'helvetica-bold': 'Arial',
+    'helveticaneue': 'Arial',
+    'helveticaneueb': 'Arial',
+
+    # Times family
+    'times': 'Times New Roman',
+    'times-roman': 'Times New Roman',
+    'times-bold': 'Times New Roman',
+    'times-italic': 'Times New Roman',
+    'times-bolditalic': 'Times New Roman',
+    'timesnewroman': 'Times New Roman',
+
+    # Courier family
+    'cour': 'Courier New',
+    'courier': 'Courier New',
+    'courier-bold': 'Courier New',
+    'courier-oblique': 'Courier New',
+    'couriernew': 'Courier New',
+
+    # Other common fonts
+    'arial': 'Arial',
+    'calibri': 'Calibri',
+    'verdana': 'Verdana',
+    'georgia': 'Georgia',
+    'trebuchet': 'Trebuchet MS',
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _map_pdf_font_to_word(pdf_font):
+    """Map PDF font names to Word-compatible font names"""
+    font_mapping = WORD_FONT_MAPPING
+
+    # Clean and normalize font name
+    clean_font = pdf_font.lower().replace('-', '').replace(' ', '')
+
+    # Try exact match first
+    if clean_font in font_mapping:
+        return font_mapping[clean_font]
+
+    # Try partial matches
+    for pdf_name, word_name in font_mapping.items():
+        if pdf_name in clean_font or clean_font in pdf_name:
+            return word_name
+
+    # Default fallback
+    return 'Arial'
@@ -0,0 +1,137 @@
+"""
+Opt-in per-request profiling.
+
+When enabled in the app config, a request carrying an ``X-Profile: 1`` header
+or a ``profile=1`` query flag runs under cProfile and tracemalloc. The pstats
+dump and a JSON summary (route, file, wall time, peak memory, hottest
+functions and allocation sites) are written to the profiles folder for
+offline analysis.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+
+class RequestProfiler:
+    """Captures a CPU profile and peak-memory summary for a single request"""
+
+    # tracemalloc is process-wide, so only one request is profiled at a time
+    _active_lock = threading.Lock()
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._profile = None
+        self._started = None
+        self._owns_lock = False
+
+    def start(self):
+        """Begin profiling; returns False if another request is already being profiled"""
+        if not self._active_lock.acquire(blocking=False):
+            return False
+        self._owns_lock = True
+
+        tracemalloc.start(10)
+        self._profile = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._profile.enable()
+        return True
+
+    def stop(self, route, filename, status_code, top=25):
+        """Stop profiling and write the profile plus a JSON summary; returns the profile id"""
+        try:
+            self._profile.disable()
+            duration = time.perf_counter() - self._started
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().statistics('lineno')[:top]
+        finally:
+            tracemalloc.stop()
+            self._release()
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{_slug(route)}_{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.folder, exist_ok=True)
+        self._profile.dump_stats(os.path.join(self.folder, f"{profile_id}.prof"))
+
+        summary = {
+            'id': profile_id,
+            'route': route,
+            'filename': filename,
+            'status': status_code,
+            'created': time.time(),
+            'duration_seconds': round(duration, 6),
+            'peak_memory_bytes': peak_bytes,
+            'top_functions': _top_functions(self._profile, top),
+            'top_allocations': [
+                {
+                    'location': str(stat.traceback[0]),
+                    'size_bytes': stat.size,
+                    'count': stat.count
+                }
+                for stat in allocations
+            ]
+        }
+        with open(os.path.join(self.folder, f"{profile_id}.json"), 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+
+        return profile_id
+
+    def abort(self):
+        """Stop profiling without saving anything"""
+        if self._profile is not None:
+            self._profile.disable()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._release()
+
+    def _release(self):
+        if self._owns_lock:
+            self._owns_lock = False
+            self._active_lock.release()
+
+
+def list_profiles(folder):
+    """Return the saved profile summaries, newest first"""
+    if not os.path.isdir(folder):
+        return []
+
+    profiles = []
+    for entry in os.listdir(folder):
+        if not entry.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(folder, entry), 'r', encoding='utf-8') as summary_file:
+                summary = json.load(summary_file)
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            key: summary.get(key)
+            for key in ('id', 'route', 'filename', 'status', 'created', 'duration_seconds', 'peak_memory_bytes')
+        })
+
+    profiles.sort(key=lambda profile: profile['created'] or 0, reverse=True)
+    return profiles
+
+
+def _top_functions(profile, top):
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    rows = []
+    for (path, line, function), (_, calls, own_time, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f"{os.path.basename(path)}:{line}({function})",
+            'calls': calls,
+            'own_seconds': round(own_time, 6),
+            'cumulative_seconds': round(cumulative, 6)
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:top]
+
+
+def _slug(route):
+    cleaned = ''.join(char if char.isalnum() else '_' for char in route.strip('/'))
+    return cleaned.strip('_')[:40] or 'root'
@@ -0,0 +1,207 @@
+"""
+Single-flight coalescing of identical concurrent computations.
+
+When several users open a shared document at once, every request for the
+same page image or text blocks would otherwise do the same work. ``run(key,
+compute)`` lets one caller compute while the others with an equal key wait
+and reuse its result:
+
+- within a process, followers wait on an event set by the leader;
+- across gunicorn workers, the leader holds an ``flock`` on a lock file named
+  after the key. Followers leave a marker, wait for the lock to be released
+  and read the result the leader wrote because the marker was there.
+
+Keys name immutable document versions, so a result is valid for as long as
+it exists; result files are only kept briefly to hand them to followers.
+If a leader fails or disappears, a follower simply computes the value itself.
+
+Results are handed over as JSON followed by raw bytes, never as pickles, so
+a file planted in the folder cannot run code in a worker. The folder must
+belong to the service user and not be writable by anyone else; otherwise
+coalescing stays within each process.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within each process
+    fcntl = None
+
+POLL_INTERVAL = 0.02
+WAIT_SECONDS = 60
+RESULT_TTL = 30  # seconds a result file (and its lock file) is kept for followers
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value = None
+
+
+class SingleFlight:
+    """Coalesce concurrent ``compute()`` calls with the same key, in and across processes"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._checked_folders = {}
+
+    def run(self, key, compute):
+        """
+        Return ``(value, shared)``: ``compute()``'s result, and whether it came
+        from a computation started by another request.
+
+        ``key`` is a tuple of the operation, document version and parameters;
+        values are shared between processes if they are made of JSON types,
+        bytes, tuples and dicts (with any of those as keys).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(WAIT_SECONDS) and call.ok:
+                return call.value, True
+            return compute(), False
+
+        try:
+            value, shared = self._run_across_processes(key, compute)
+            call.value = value
+            call.ok = True
+            return value, shared
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_across_processes(self, key, compute):
+        if fcntl is None or not self.folder or not self._private_folder():
+            return compute(), False
+
+        base = os.path.join(self.folder, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+        with open(f'{base}.lock', 'a') as lock_file:
+            if not self._try_lock(lock_file):
+                # Another worker is computing: ask it to publish the result and wait
+                with open(f'{base}.wait', 'a'):
+                    pass
+                deadline = time.monotonic() + WAIT_SECONDS
+                locked = False
+                while not locked and time.monotonic() < deadline:
+                    time.sleep(POLL_INTERVAL)
+                    locked = self._try_lock(lock_file)
+                value = self._read_result(f'{base}.result')
+                if value is not None:
+                    return value, True
+
+            os.utime(f'{base}.lock')  # keeps a lock file in use from being pruned
+            value = compute()
+            if os.path.exists(f'{base}.wait'):
+                self._write_result(f'{base}.result', value)
+                os.remove(f'{base}.wait')
+            self._prune()
+            return value, False
+
+    def _try_lock(self, lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _private_folder(self):
+        """Create the folder for this user only; refuse one that someone else owns or can write to"""
+        folder = self.folder
+        if folder not in self._checked_folders:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+            info = os.stat(folder)
+            private = info.st_uid == os.getuid() and not info.st_mode & 0o022
+            if not private:
+                logger.warning(f'Not coalescing across processes: {folder} is shared with other users')
+            self._checked_folders[folder] = private
+        return self._checked_folders[folder]
+
+    def _read_result(self, path):
+        """The value in a result file: a JSON line, then the raw bytes it refers to"""
+        try:
+            with open(path, 'rb') as result_file:
+                header = json.loads(result_file.readline())
+                blobs = [result_file.read(size) for size in header['sizes']]
+            if [len(blob) for blob in blobs] != header['sizes']:
+                return None  # cut short
+            return _decode(header['value'], blobs)
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None
+
+    def _write_result(self, path, value):
+        blobs = []
+        try:
+            header = json.dumps({'value': _encode(value, blobs), 'sizes': [len(blob) for blob in blobs]})
+        except TypeError:
+            return  # not shareable; followers compute it themselves
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as result_file:
+            result_file.write(header.encode('utf-8') + b'\n')
+            for blob in blobs:
+                result_file.write(blob)
+        os.replace(temp_path, path)
+
+    def _prune(self):
+        """Drop result, marker and lock files older than ``RESULT_TTL``, at most once per TTL per process"""
+        now = time.time()
+        if now - self._last_prune < RESULT_TTL:
+            return
+        self._last_prune = now
+
+        for entry in os.listdir(self.folder):
+            path = os.path.join(self.folder, entry)
+            try:
+                if now - os.path.getmtime(path) > RESULT_TTL:
+                    # A worker that opened a lock file just before it is removed
+                    # may compute alongside a new leader; results are identical
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+def _encode(value, blobs):
+    """
+    JSON form of a result; bytes are moved to ``blobs``.
+
+    Dicts and tuples are tagged so they decode with their key and item types.
+    """
+    if isinstance(value, bytes):
+        blobs.append(value)
+        return {'bytes': len(blobs) - 1}
+    if isinstance(value, tuple):
+        return {'tuple': [_encode(item, blobs) for item in value]}
+    if isinstance(value, dict):
+        return {'dict': [[_encode(key, blobs), _encode(item, blobs)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return [_encode(item, blobs) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f'{type(value).__name__} results are not shared between processes')
+
+
+def _decode(value, blobs):
+    if isinstance(value, list):
+        return [_decode(item, blobs) for item in value]
+    if isinstance(value, dict):
+        if 'bytes' in value:
+            return blobs[value['bytes']]
+        if 'tuple' in value:
+            return tuple(_decode(item, blobs) for item in value['tuple'])
+        return {_decode(key, blobs): _decode(item, blobs) for key, item in value['dict']}
+    return value
@@ -4,7 +4,11 @@ let currentPages = [];
 let selectedPage = 1;
 let editMode = false;
 let textBlocks = [];
+let pendingTextBlocks = new Set();
 let selectedTextBlock = null;
+let previewZoom = 1.5;
+let currentVersion = 0;
+let versionEvents = null;
 
 // DOM elements
 const fileInput = document.getElementById('fileInput');
@@ -16,18 +20,77 @@ const loadingOverlay = document.getElementById('loadingOverlay');
 // Tool buttons
 const addTextBtn = document.getElementById('addTextBtn');
 const editTextBtn = document.getElementById('editTextBtn');
+const undoBtn = document.getElementById('undoBtn');
+const redoBtn = document.getElementById('redoBtn');
 const extractTextBtn = document.getElementById('extractTextBtn');
+const extractImagesBtn = document.getElementById('extractImagesBtn');
 const ocrBtn = document.getElementById('ocrBtn');
 const splitPdfBtn = document.getElementById('splitPdfBtn');
 const mergePdfBtn = document.getElementById('mergePdfBtn');
+const optimizeBtn = document.getElementById('optimizeBtn');
 const downloadBtn = document.getElementById('downloadBtn');
 const convertToWordBtn = document.getElementById('convertToWordBtn');
 
 // Initialize app
 document.addEventListener('DOMContentLoaded', function() {
     setupEventListeners();
+    registerServiceWorker();
+    restoreSession();
 });
 
+async function restoreSession() {
+    // Reopening the app continues with this session's current version, whose
+    // preview and page images the service worker already holds
+    try {
+        const response = await fetch('/history');
+        const result = await response.json();
+        const history = result.history;
+        if (!result.success || !history.current || currentPdf) return;
+        // Old files are cleaned up after a day
+        const exists = await fetch(`/download/${history.current}`, { method: 'HEAD' });
+        if (!exists.ok || currentPdf) return;
+        
+        currentPdf = history.current;
+        currentVersion = history.version;
+        updateHistoryButtons(history);
+        await loadPdfPreview(currentPdf);
+        enableTools();
+        connectVersionEvents();
+        loadDocumentInfo(currentPdf);
+    } catch (error) {
+        console.warn('Could not restore the previous document:', error);
+    }
+}
+
+// SERVICE WORKER CACHE
+function registerServiceWorker() {
+    if (!('serviceWorker' in navigator)) return;
+    
+    navigator.serviceWorker.register('/service-worker.js').catch(error => {
+        console.warn('Service worker registration failed:', error);
+    });
+}
+
+async function carryOverCachedPages(source, target, changedPages) {
+    // Copy the parent version's cached pages to the new version, except the
+    // changed ones, so only those are fetched again
+    const controller = navigator.serviceWorker && navigator.serviceWorker.controller;
+    if (!controller || !source || source === target) return;
+    
+    await new Promise(resolve => {
+        const channel = new MessageChannel();
+        channel.port1.onmessage = resolve;
+        controller.postMessage({
+            type: 'carry-over',
+            source: source,
+            target: target,
+            changedPages: changedPages
+        }, [channel.port2]);
+        // Never hold up the preview if the worker does not answer
+        setTimeout(resolve, 2000);
+    });
+}
+
 function setupEventListeners() {
     // File upload
     uploadBtn.addEventListener('click', () => fileInput.click());
@@ -36,9 +99,13 @@ function setupEventListeners() {
     // Tool buttons
     addTextBtn.addEventListener('click', () => openModal('addTextModal'));
     editTextBtn.addEventListener('click', toggleEditMode);
+    undoBtn.addEventListener('click', undoEdit);
+    redoBtn.addEventListener('click', redoEdit);
     extractTextBtn.addEventListener('click', extractText);
+    extractImagesBtn.addEventListener('click', extractImages);
     ocrBtn.addEventListener('click', performOCR);
     splitPdfBtn.addEventListener('click', () => openModal('splitModal'));
+    optimizeBtn.addEventListener('click', optimizePdf);
     downloadBtn.addEventListener('click', downloadCurrentPdf);
     convertToWordBtn.addEventListener('click', convertToWord);
     
@@ -53,6 +120,13 @@ function setupEventListeners() {
     
     // Drag and drop
     setupDragAndDrop();
+    
+    // Overlay canvases are sized in device pixels, so redraw them when the layout changes
+    window.addEventListener('resize', () => {
+        if (editMode) {
+            pdfContainer.querySelectorAll('.text-overlay').forEach(drawTextOverlay);
+        }
+    });
 }
 
 function setupDragAndDrop() {
@@ -120,9 +194,13 @@ async function handleFileUpload(event) {
         
         if (result.success) {
             currentPdf = result.filename;
+            currentVersion = result.history.version;
+            updateHistoryButtons(null);
             showToast('PDF uploaded successfully!', 'success');
             await loadPdfPreview(result.filename);
             enableTools();
+            connectVersionEvents();
+            loadDocumentInfo(result.filename);
         } else {
             showToast(result.error || 'Upload failed', 'error');
         }
@@ -137,13 +215,15 @@ async function loadPdfPreview(filename) {
     showLoading(true);
     
     try {
-        // Add cache-busting parameter to ensure fresh preview
-        const timestamp = new Date().getTime();
-        const response = await fetch(`/preview/${filename}?t=${timestamp}`);
+        // Every version has its own filename, so previews and page images
+        // are cached by the browser without any cache busting
+        const response = await fetch(`/preview/${filename}`);
         const result = await response.json();
         
         if (result.success) {
             currentPages = result.pages;
+            resetTextBlocks();
+            previewZoom = result.zoom || previewZoom;
             displayPdfPages(result.pages);
             updatePagesList(result.pages);
             
@@ -161,32 +241,39 @@ async function loadPdfPreview(filename) {
     }
 }
 
+// Pages are virtualized: every page gets a placeholder sized from the
+// preview metadata, but only pages near the viewport hold an <img>.
+// Images of pages scrolled far away are released again.
+const PAGE_MOUNT_MARGIN = '150% 0px';
+const PAGE_MOUNT_DELAY = 100; // ms; pages skimmed past while scrolling are never fetched
+let pageObserver = null;
+
 function displayPdfPages(pages) {
+    // Reloading a new version of the same document keeps the reader's place
+    const sameLayout = pages.length === pdfContainer.querySelectorAll('.pdf-page').length;
+    const scrollTop = sameLayout ? pdfContainer.scrollTop : 0;
+    
+    if (pageObserver) {
+        pageObserver.disconnect();
+    }
+    pageObserver = new IntersectionObserver(handlePageVisibility, {
+        root: pdfContainer,
+        rootMargin: PAGE_MOUNT_MARGIN
+    });
+    
     pdfContainer.innerHTML = '';
     
-    pages.forEach((page, index) => {
+    pages.forEach(page => {
         const pageDiv = document.createElement('div');
         pageDiv.className = 'pdf-page';
+        pageDiv.dataset.page = page.page_num;
         
         if (page.image) {
-            let pageContent = `
+            pageDiv.innerHTML = `
                 <div class="page-number">Page ${page.page_num}</div>
-                <img src="${page.image}" alt="Page ${page.page_num}" 
-                     data-page="${page.page_num}" 
-                     onclick="selectPage(${page.page_num})"
-                     onload="handleImageLoad(this)">
+                <div class="page-frame" style="aspect-ratio: ${page.width} / ${page.height}; max-width: ${page.width}px"></div>
             `;
-            
-            // Add indicator for image-based PDFs
-            if (page.is_image_based) {
-                pageContent += `
-                    <div class="ocr-indicator">
-                        <i class="fas fa-camera"></i> Image-based PDF
-                    </div>
-                `;
-            }
-            
-            pageDiv.innerHTML = pageContent;
+            pageObserver.observe(pageDiv);
         } else {
             // Handle pages that failed to render
             pageDiv.innerHTML = `
@@ -202,14 +289,102 @@ function displayPdfPages(pages) {
         pdfContainer.appendChild(pageDiv);
     });
     
-    // If in edit mode, refresh text overlays after images load
-    if (editMode) {
-        setTimeout(() => {
-            displayTextOverlays();
-        }, 200);
+    pdfContainer.scrollTop = scrollTop;
+}
+
+function handlePageVisibility(entries) {
+    entries.forEach(entry => {
+        const pageDiv = entry.target;
+        clearTimeout(pageDiv.mountTimer);
+        
+        if (entry.isIntersecting) {
+            pageDiv.mountTimer = setTimeout(() => mountPage(pageDiv), PAGE_MOUNT_DELAY);
+        } else {
+            unmountPage(pageDiv);
+        }
+    });
+}
+
+function mountPage(pageDiv) {
+    const frame = pageDiv.querySelector('.page-frame');
+    // Timers can outlive a reload that has already replaced this placeholder
+    if (!pageDiv.isConnected || !frame || frame.querySelector('img')) return;
+    
+    const pageNum = parseInt(pageDiv.dataset.page);
+    const page = currentPages[pageNum - 1];
+    if (!page) return;
+    
+    const img = document.createElement('img');
+    img.alt = `Page ${pageNum}`;
+    img.dataset.page = pageNum;
+    img.decoding = 'async';
+    img.onclick = () => selectPage(pageNum);
+    img.onload = () => handleImageLoad(img);
+    img.src = page.image;
+    if (page.thumbnail) {
+        // The ingest thumbnail stands in, stretched, until the full image arrives
+        frame.style.backgroundImage = `url("${page.thumbnail}")`;
+    }
+    frame.appendChild(img);
+    
+    // Add indicator for image-based PDFs
+    if (page.is_image_based) {
+        addOcrIndicator(frame);
+    }
+}
+
+function addOcrIndicator(frame) {
+    if (frame.querySelector('.ocr-indicator')) return;
+    frame.insertAdjacentHTML('beforeend', `
+        <div class="ocr-indicator">
+            <i class="fas fa-camera"></i> Image-based PDF
+        </div>
+    `);
+}
+
+async function loadDocumentInfo(filename) {
+    // Upload analysis runs in the background; poll until it is done
+    for (let attempt = 0; attempt < 120 && filename === currentPdf; attempt++) {
+        try {
+            const response = await fetch(`/document_info/${filename}`);
+            if (response.status === 202) {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                continue;
+            }
+            const info = await response.json();
+            if (!info.success || filename !== currentPdf) return;
+            
+            info.pages.forEach(pageInfo => {
+                const page = currentPages[pageInfo.page_num - 1];
+                if (!page) return;
+                page.is_image_based = pageInfo.is_image_based;
+                page.classification = pageInfo.classification;
+                const frame = document.querySelector(`.pdf-page[data-page="${pageInfo.page_num}"] .page-frame`);
+                if (frame && frame.querySelector('img') && page.is_image_based) {
+                    addOcrIndicator(frame);
+                }
+            });
+            if (info.is_image_based) {
+                showToast('This PDF is scanned images; use OCR to get its text', 'warning');
+            }
+            return;
+        } catch (error) {
+            return;
+        }
     }
 }
 
+function unmountPage(pageDiv) {
+    const frame = pageDiv.querySelector('.page-frame');
+    const img = frame && frame.querySelector('img');
+    if (!img) return;
+    
+    // Dropping the src lets the browser free the decoded bitmap (or cancel the fetch)
+    img.removeAttribute('src');
+    frame.innerHTML = '';
+    frame.style.backgroundImage = '';
+}
+
 function handleImageLoad(img) {
     // Add a subtle animation to show the image has loaded
     img.style.opacity = '0';
@@ -217,11 +392,34 @@ function handleImageLoad(img) {
     setTimeout(() => {
         img.style.opacity = '1';
     }, 50);
+    
+    if (editMode) {
+        const pageNum = parseInt(img.dataset.page);
+        if (textBlocks[pageNum - 1]) {
+            displayPageTextOverlay(img.closest('.pdf-page'));
+        } else {
+            queueTextBlocks(pageNum);
+        }
+    }
+}
+
+let queuedTextBlocks = new Set();
+let textBlocksTimer = null;
+
+function queueTextBlocks(pageNum) {
+    // Pages mounted together while scrolling share one request
+    queuedTextBlocks.add(pageNum);
+    clearTimeout(textBlocksTimer);
+    textBlocksTimer = setTimeout(() => {
+        const pageNums = [...queuedTextBlocks];
+        queuedTextBlocks.clear();
+        loadTextBlocks(pageNums);
+    }, PAGE_MOUNT_DELAY);
 }
 
 function showUpdatedIndicator(pageNum) {
     // Find the specific page and add an "updated" indicator
-    const pageDiv = document.querySelector(`[data-page="${pageNum}"]`)?.closest('.pdf-page');
+    const pageDiv = pdfContainer.querySelector(`.pdf-page[data-page="${pageNum}"]`);
     if (pageDiv) {
         const indicator = document.createElement('div');
         indicator.className = 'updated-indicator';
@@ -240,28 +438,58 @@ function showUpdatedIndicator(pageNum) {
     }
 }
 
+// The sidebar is virtualized too: fixed-height rows inside a spacer, with
+// only the rows in view (plus a few either side) in the DOM
+const PAGE_ITEM_HEIGHT = 40;
+const PAGE_ITEM_OVERSCAN = 5;
+
 function updatePagesList(pages) {
     pagesList.innerHTML = '';
     
-    pages.forEach(page => {
+    const spacer = document.createElement('div');
+    spacer.className = 'pages-list-spacer';
+    spacer.style.height = (pages.length * PAGE_ITEM_HEIGHT) + 'px';
+    pagesList.appendChild(spacer);
+    
+    pagesList.onscroll = renderVisiblePageItems;
+    renderVisiblePageItems();
+}
+
+function renderVisiblePageItems() {
+    const spacer = pagesList.querySelector('.pages-list-spacer');
+    if (!spacer) return;
+    
+    const first = Math.max(0, Math.floor(pagesList.scrollTop / PAGE_ITEM_HEIGHT) - PAGE_ITEM_OVERSCAN);
+    const last = Math.min(
+        currentPages.length,
+        Math.ceil((pagesList.scrollTop + pagesList.clientHeight) / PAGE_ITEM_HEIGHT) + PAGE_ITEM_OVERSCAN
+    );
+    
+    spacer.innerHTML = '';
+    for (let index = first; index < last; index++) {
+        const pageNum = index + 1;
         const pageItem = document.createElement('div');
         pageItem.className = 'page-item';
-        pageItem.innerHTML = `Page ${page.page_num}`;
-        pageItem.onclick = () => selectPage(page.page_num);
-        pagesList.appendChild(pageItem);
-    });
+        pageItem.classList.toggle('active', pageNum === selectedPage);
+        pageItem.style.top = (index * PAGE_ITEM_HEIGHT) + 'px';
+        pageItem.textContent = `Page ${pageNum}`;
+        pageItem.onclick = () => selectPage(pageNum);
+        spacer.appendChild(pageItem);
+    }
 }
 
 function selectPage(pageNum) {
     selectedPage = pageNum;
     
-    // Update page list selection
-    document.querySelectorAll('.page-item').forEach((item, index) => {
-        item.classList.toggle('active', index + 1 === pageNum);
-    });
+    // Keep the selected row in view in the sidebar, then redraw its rows
+    const itemTop = (pageNum - 1) * PAGE_ITEM_HEIGHT;
+    if (itemTop < pagesList.scrollTop || itemTop + PAGE_ITEM_HEIGHT > pagesList.scrollTop + pagesList.clientHeight) {
+        pagesList.scrollTop = itemTop - (pagesList.clientHeight - PAGE_ITEM_HEIGHT) / 2;
+    }
+    renderVisiblePageItems();
     
-    // Scroll to page
-    const pageElement = document.querySelector(`[data-page="${pageNum}"]`);
+    // Scroll to page (its placeholder exists even when the image is not mounted)
+    const pageElement = pdfContainer.querySelector(`.pdf-page[data-page="${pageNum}"]`);
     if (pageElement) {
         pageElement.scrollIntoView({ behavior: 'smooth', block: 'center' });
     }
@@ -278,8 +506,10 @@ function enableTools() {
     addTextBtn.disabled = false;
     editTextBtn.disabled = false;
     extractTextBtn.disabled = false;
+    extractImagesBtn.disabled = false;
     ocrBtn.disabled = false;
     splitPdfBtn.disabled = false;
+    optimizeBtn.disabled = false;
     downloadBtn.disabled = false;
     convertToWordBtn.disabled = false;
 }
@@ -294,8 +524,10 @@ async function toggleEditMode() {
         editTextBtn.innerHTML = '<i class="fas fa-times"></i> Exit Edit';
         editTextBtn.style.background = '#e53e3e';
         showEditModeIndicator();
-        await loadTextBlocks();
         displayTextOverlays();
+        showLoading(true);
+        await loadTextBlocks(mountedPageNums());
+        showLoading(false);
     } else {
         editTextBtn.innerHTML = '<i class="fas fa-edit"></i> Edit Text';
         editTextBtn.style.background = '';
@@ -317,77 +549,179 @@ function showEditModeIndicator() {
     }, 3000);
 }
 
-async function loadTextBlocks() {
-    if (!currentPdf) return;
-    
-    showLoading(true);
+// Text blocks are fetched for mounted pages only, in batches, as pages come
+// into view; page lists are sent as ranges so the request line stays short
+const TEXT_BLOCKS_BATCH = 100;
+
+function resetTextBlocks() {
+    textBlocks = [];
+    pendingTextBlocks = new Set();
+}
+
+function mountedPageNums() {
+    return [...pdfContainer.querySelectorAll('.page-frame img')].map(img => parseInt(img.dataset.page));
+}
+
+function pagesParam(pageNums) {
+    // [1, 2, 3, 7] -> "1-3,7"
+    const sorted = [...new Set(pageNums)].sort((a, b) => a - b);
+    const parts = [];
+    for (let i = 0; i < sorted.length; i++) {
+        const start = sorted[i];
+        while (i + 1 < sorted.length && sorted[i + 1] === sorted[i] + 1) i++;
+        parts.push(start === sorted[i] ? `${start}` : `${start}-${sorted[i]}`);
+    }
+    return parts.join(',');
+}
+
+async function loadTextBlocks(pageNums) {
+    const filename = currentPdf;
+    const pending = pendingTextBlocks;
+    pageNums = pageNums.filter(pageNum => !textBlocks[pageNum - 1] && !pending.has(pageNum));
+    if (!filename || pageNums.length === 0) return;
     
+    pageNums.forEach(pageNum => pending.add(pageNum));
     try {
-        const response = await fetch(`/get_text_blocks/${currentPdf}`);
-        const result = await response.json();
-        
-        if (result.success) {
-            textBlocks = result.pages_blocks;
-        } else {
-            showToast(result.error || 'Failed to load text blocks', 'error');
+        for (let start = 0; start < pageNums.length; start += TEXT_BLOCKS_BATCH) {
+            const batch = pageNums.slice(start, start + TEXT_BLOCKS_BATCH);
+            const response = await fetch(`/get_text_blocks/${filename}?pages=${pagesParam(batch)}`);
+            const result = await response.json();
+            if (filename !== currentPdf || pending !== pendingTextBlocks) {
+                // A newer version replaced the document while this was loading;
+                // pages still on screen are asked for again for that version
+                if (editMode) {
+                    const mounted = new Set(mountedPageNums());
+                    pageNums.filter(pageNum => mounted.has(pageNum)).forEach(queueTextBlocks);
+                }
+                return;
+            }
+            
+            if (!result.success) {
+                showToast(result.error || 'Failed to load text blocks', 'error');
+                return;
+            }
+            result.pages_blocks.forEach(pageBlocks => {
+                textBlocks[pageBlocks.page_num - 1] = pageBlocks;
+                if (editMode) {
+                    displayPageTextOverlay(pdfContainer.querySelector(`.pdf-page[data-page="${pageBlocks.page_num}"]`));
+                }
+            });
         }
     } catch (error) {
         showToast('Failed to load text blocks: ' + error.message, 'error');
     } finally {
-        showLoading(false);
+        pageNums.forEach(pageNum => pending.delete(pageNum));
     }
 }
 
+// Edit mode draws each page's text spans on one canvas instead of one DOM
+// node per span. Only pages with a mounted image (i.e. near the viewport)
+// get a canvas, and clicks are mapped back to spans by hit testing.
 function displayTextOverlays() {
     removeTextOverlays();
     
-    const pdfPages = document.querySelectorAll('.pdf-page');
-    
-    pdfPages.forEach((pageDiv, pageIndex) => {
-        const img = pageDiv.querySelector('img');
-        if (!img || !textBlocks[pageIndex]) return;
-        
-        const overlay = document.createElement('div');
-        overlay.className = 'text-overlay';
-        
-        // Calculate scale factors based on actual image dimensions vs PDF dimensions
-        const imgRect = img.getBoundingClientRect();
-        const imgWidth = img.offsetWidth;
-        const imgHeight = img.offsetHeight;
-        
-        // Get the maximum coordinates from text blocks to determine PDF dimensions
-        let maxX = 0, maxY = 0;
-        textBlocks[pageIndex].blocks.forEach(block => {
-            maxX = Math.max(maxX, block.bbox[2]);
-            maxY = Math.max(maxY, block.bbox[3]);
-        });
-        
-        const scaleX = imgWidth / maxX;
-        const scaleY = imgHeight / maxY;
-        
-        textBlocks[pageIndex].blocks.forEach((block, blockIndex) => {
-            if (!block.text.trim()) return;
-            
-            const textDiv = document.createElement('div');
-            textDiv.className = 'text-block';
-            textDiv.style.left = (block.bbox[0] * scaleX) + 'px';
-            textDiv.style.top = (block.bbox[1] * scaleY) + 'px';
-            textDiv.style.width = ((block.bbox[2] - block.bbox[0]) * scaleX) + 'px';
-            textDiv.style.height = ((block.bbox[3] - block.bbox[1]) * scaleY) + 'px';
-            textDiv.title = block.text; // Show text on hover
-            
-            textDiv.addEventListener('click', (e) => {
-                e.stopPropagation();
-                selectTextBlock(pageIndex + 1, blockIndex, block);
-            });
-            
-            overlay.appendChild(textDiv);
-        });
+    // Pages mounted later get their overlay when the image loads (see handleImageLoad)
+    pdfContainer.querySelectorAll('.pdf-page').forEach(pageDiv => {
+        if (pageDiv.querySelector('img')?.complete) {
+            displayPageTextOverlay(pageDiv);
+        }
+    });
+}
+
+function displayPageTextOverlay(pageDiv) {
+    const img = pageDiv && pageDiv.querySelector('img');
+    const pageIndex = pageDiv ? parseInt(pageDiv.dataset.page) - 1 : -1;
+    if (!img || !textBlocks[pageIndex] || !currentPages[pageIndex]) return;
+    
+    let canvas = pageDiv.querySelector('.text-overlay');
+    if (!canvas) {
+        canvas = document.createElement('canvas');
+        canvas.className = 'text-overlay';
+        canvas.addEventListener('mousemove', handleOverlayHover);
+        canvas.addEventListener('mouseleave', handleOverlayHover);
+        canvas.addEventListener('click', handleOverlayClick);
+        img.parentElement.appendChild(canvas);
+    }
+    canvas.pageIndex = pageIndex;
+    canvas.hoveredBlock = -1;
+    drawTextOverlay(canvas);
+}
+
+function overlayScale(canvas) {
+    // Page images are rendered at previewZoom pixels per PDF point
+    const page = currentPages[canvas.pageIndex];
+    return canvas.clientWidth / (page.width / previewZoom);
+}
+
+function drawTextOverlay(canvas) {
+    const ratio = window.devicePixelRatio || 1;
+    canvas.width = Math.round(canvas.clientWidth * ratio);
+    canvas.height = Math.round(canvas.clientHeight * ratio);
+    
+    const context = canvas.getContext('2d');
+    const scale = overlayScale(canvas) * ratio;
+    context.clearRect(0, 0, canvas.width, canvas.height);
+    
+    const blocks = textBlocks[canvas.pageIndex].blocks;
+    const selected = selectedTextBlock && selectedTextBlock.pageNum === canvas.pageIndex + 1
+        ? selectedTextBlock.blockIndex : -1;
+    
+    [canvas.hoveredBlock, selected].forEach((blockIndex, pass) => {
+        const block = blocks[blockIndex];
+        if (!block) return;
         
-        pageDiv.appendChild(overlay);
+        const [x0, y0, x1, y1] = block.bbox;
+        context.fillStyle = pass === 0 ? 'rgba(102, 126, 234, 0.2)' : 'rgba(102, 126, 234, 0.3)';
+        context.fillRect(x0 * scale, y0 * scale, (x1 - x0) * scale, (y1 - y0) * scale);
+        if (pass === 1) {
+            context.strokeStyle = '#667eea';
+            context.lineWidth = 2 * ratio;
+            context.strokeRect(x0 * scale, y0 * scale, (x1 - x0) * scale, (y1 - y0) * scale);
+        }
     });
 }
 
+function hitTestTextBlock(canvas, event) {
+    const rect = canvas.getBoundingClientRect();
+    const scale = overlayScale(canvas);
+    const x = (event.clientX - rect.left) / scale;
+    const y = (event.clientY - rect.top) / scale;
+    
+    // Later spans are drawn on top, so they win when boxes overlap
+    const blocks = textBlocks[canvas.pageIndex].blocks;
+    for (let index = blocks.length - 1; index >= 0; index--) {
+        const [x0, y0, x1, y1] = blocks[index].bbox;
+        if (x >= x0 && x <= x1 && y >= y0 && y <= y1 && blocks[index].text.trim()) {
+            return index;
+        }
+    }
+    return -1;
+}
+
+function handleOverlayHover(event) {
+    const canvas = event.currentTarget;
+    const blockIndex = event.type === 'mouseleave' ? -1 : hitTestTextBlock(canvas, event);
+    if (blockIndex === canvas.hoveredBlock) return;
+    
+    canvas.hoveredBlock = blockIndex;
+    canvas.style.cursor = blockIndex >= 0 ? 'pointer' : 'default';
+    canvas.title = blockIndex >= 0 ? textBlocks[canvas.pageIndex].blocks[blockIndex].text : '';
+    drawTextOverlay(canvas);
+}
+
+function handleOverlayClick(event) {
+    const canvas = event.currentTarget;
+    const blockIndex = hitTestTextBlock(canvas, event);
+    if (blockIndex < 0) {
+        // Clicks between spans select the page, as clicks on the image do
+        selectPage(canvas.pageIndex + 1);
+        return;
+    }
+    
+    event.stopPropagation();
+    selectTextBlock(canvas.pageIndex + 1, blockIndex, textBlocks[canvas.pageIndex].blocks[blockIndex]);
+}
+
 function removeTextOverlays() {
     document.querySelectorAll('.text-overlay').forEach(overlay => {
         overlay.remove();
@@ -397,20 +731,15 @@ function removeTextOverlays() {
 function selectTextBlock(pageNum, blockIndex, block) {
     if (!editMode) return;
     
-    // Remove previous selection
-    document.querySelectorAll('.text-block.selected').forEach(el => {
-        el.classList.remove('selected');
-    });
-    
-    // Select current block
-    event.target.classList.add('selected');
-    
     selectedTextBlock = {
         pageNum: pageNum,
         blockIndex: blockIndex,
         block: block
     };
     
+    // Redraw the overlays so the previous selection is cleared and this one shows
+    pdfContainer.querySelectorAll('.text-overlay').forEach(drawTextOverlay);
+    
     // Open edit modal
     openEditTextModal(block, pageNum);
 }
@@ -484,6 +813,8 @@ async function updateText() {
             old_text: originalText,
             new_text: newText,
             bbox: selectedTextBlock.block.bbox,
+            // The replacement is written on the old text's baseline
+            origin: selectedTextBlock.block.origin,
             preserve_formatting: preserveFormatting
         };
         
@@ -503,39 +834,24 @@ async function updateText() {
         const result = await response.json();
         
         if (result.success) {
-            // Update current PDF reference
-            currentPdf = result.modified_filename;
             const message = preserveFormatting ? 
                 'Text updated with original formatting preserved!' : 
                 'Text updated successfully!';
             showToast(message, 'success');
             
-            // Store the edited page number for indicator
-            const editedPageNum = selectedTextBlock.pageNum;
-            
-            // Force reload the PDF preview with the edited content
-            await loadPdfPreview(currentPdf);
-            
-            // Show updated indicator on the edited page
-            setTimeout(() => {
-                showUpdatedIndicator(editedPageNum);
-            }, 300);
+            selectedTextBlock = null;
             
-            // If in edit mode, refresh the text blocks for the new file
-            if (editMode) {
-                // Reset edit mode state
-                editMode = false;
-                editTextBtn.innerHTML = '<i class="fas fa-edit"></i> Edit Text';
-                editTextBtn.style.background = '';
-                removeTextOverlays();
-                selectedTextBlock = null;
-                document.body.classList.remove('edit-mode');
-                
-                // Re-enter edit mode with updated content
-                setTimeout(async () => {
-                    await toggleEditMode();
-                }, 500); // Small delay to ensure preview is loaded
-            }
+            // Only the edited page is refetched; the /events stream may already
+            // have applied this version, in which case this is a no-op
+            await applyVersion({
+                version: result.history.version,
+                filename: result.modified_filename,
+                parent: result.parent,
+                changed_pages: result.changed_pages,
+                history: result.history
+            });
+        } else if (response.status === 409) {
+            await applyEditConflict(result);
         } else {
             showToast(result.error || 'Failed to update text', 'error');
         }
@@ -571,36 +887,21 @@ async function deleteText() {
         const result = await response.json();
         
         if (result.success) {
-            // Update current PDF reference
-            currentPdf = result.modified_filename;
             showToast('Text deleted successfully!', 'success');
             
-            // Store the edited page number for indicator
-            const editedPageNum = selectedTextBlock.pageNum;
+            selectedTextBlock = null;
             
-            // Force reload the PDF preview with the edited content
-            await loadPdfPreview(currentPdf);
-            
-            // Show updated indicator on the edited page
-            setTimeout(() => {
-                showUpdatedIndicator(editedPageNum);
-            }, 300);
-            
-            // If in edit mode, refresh the text blocks for the new file
-            if (editMode) {
-                // Reset edit mode state
-                editMode = false;
-                editTextBtn.innerHTML = '<i class="fas fa-edit"></i> Edit Text';
-                editTextBtn.style.background = '';
-                removeTextOverlays();
-                selectedTextBlock = null;
-                document.body.classList.remove('edit-mode');
-                
-                // Re-enter edit mode with updated content
-                setTimeout(async () => {
-                    await toggleEditMode();
-                }, 500); // Small delay to ensure preview is loaded
-            }
+            // Only the edited page is refetched; the /events stream may already
+            // have applied this version, in which case this is a no-op
+            await applyVersion({
+                version: result.history.version,
+                filename: result.modified_filename,
+                parent: result.parent,
+                changed_pages: result.changed_pages,
+                history: result.history
+            });
+        } else if (response.status === 409) {
+            await applyEditConflict(result);
         } else {
             showToast(result.error || 'Failed to delete text', 'error');
         }
@@ -611,6 +912,146 @@ async function deleteText() {
     }
 }
 
+// UNDO / REDO
+async function undoEdit() {
+    await stepHistory('/undo', 'Undone');
+}
+
+async function redoEdit() {
+    await stepHistory('/redo', 'Redone');
+}
+
+async function stepHistory(url, label) {
+    if (!currentPdf) return;
+    
+    showLoading(true);
+    
+    try {
+        const response = await fetch(url, { method: 'POST' });
+        const result = await response.json();
+        
+        if (result.success) {
+            // Only the pages touched by the edit differ between versions
+            await applyVersion({
+                version: result.history.version,
+                filename: result.filename,
+                parent: result.parent,
+                changed_pages: result.changed_pages,
+                history: result.history
+            });
+            showToast(`${label} change on page ${result.changed_pages.join(', ')}`, 'success');
+        } else {
+            showToast(result.error || 'Nothing to change', 'warning');
+        }
+    } catch (error) {
+        showToast('Failed to update history: ' + error.message, 'error');
+    } finally {
+        showLoading(false);
+    }
+}
+
+// VERSION NOTIFICATIONS
+function connectVersionEvents() {
+    if (versionEvents || !window.EventSource) return;
+    
+    // The server pushes "version N ready, pages [k] changed" for this session
+    // as soon as a save completes, including saves made from other tabs
+    versionEvents = new EventSource('/events');
+    versionEvents.addEventListener('version', event => {
+        applyVersion(JSON.parse(event.data));
+    });
+    versionEvents.onerror = () => {
+        // A disabled or failed stream closes for good; edit responses still apply versions
+        if (versionEvents.readyState === EventSource.CLOSED) {
+            versionEvents = null;
+        }
+    };
+}
+
+async function applyVersion(change) {
+    // The edit response and the event stream both report each version; the
+    // first to arrive applies it
+    if (!change.version || change.version <= currentVersion) return;
+    
+    const consecutive = change.version === currentVersion + 1 && change.parent === currentPdf;
+    const previousPdf = currentPdf;
+    currentVersion = change.version;
+    currentPdf = change.filename;
+    updateHistoryButtons(change.history);
+    selectedTextBlock = null;
+    
+    if (consecutive && change.changed_pages) {
+        await carryOverCachedPages(previousPdf, currentPdf, change.changed_pages);
+        await refreshChangedPages(change.changed_pages);
+    } else {
+        // Versions were skipped (or every page changed): reload everything;
+        // text blocks follow as the pages mount
+        await loadPdfPreview(currentPdf);
+    }
+}
+
+async function applyEditConflict(result) {
+    // Another tab or user changed the same page first: show the document's
+    // latest version so the edit can be made again on top of it. That version
+    // may come from another session, so it is loaded even if this session's
+    // history did not move.
+    showToast(result.error, 'warning');
+    selectedTextBlock = null;
+    updateHistoryButtons(result.history);
+    currentVersion = Math.max(currentVersion, result.history.version);
+    if (result.current === currentPdf) return;
+    
+    currentPdf = result.current;
+    await loadPdfPreview(currentPdf);
+}
+
+async function fetchChangedPages(base, target) {
+    // Returns null (reload everything) if the versions cannot be compared
+    try {
+        const response = await fetch(`/diff/${base}/${target}`);
+        const result = await response.json();
+        if (!result.success || result.added_pages.length || result.removed_pages.length) return null;
+        return result.changed_pages;
+    } catch (error) {
+        return null;
+    }
+}
+
+async function refreshChangedPages(pageNums) {
+    if (!pageNums || pageNums.length === 0) return;
+    
+    const response = await fetch(`/preview/${currentPdf}?pages=${pagesParam(pageNums)}`);
+    const result = await response.json();
+    
+    if (!result.success) {
+        showToast(result.error || 'Failed to refresh pages', 'error');
+        return;
+    }
+    
+    result.pages.forEach(page => {
+        currentPages[page.page_num - 1] = page;
+        const img = document.querySelector(`img[data-page="${page.page_num}"]`);
+        if (img) {
+            img.src = page.image;
+        }
+    });
+    
+    // Blocks of unchanged pages carry over; changed pages are fetched again
+    // now if mounted, or when they are scrolled to
+    pageNums.forEach(pageNum => delete textBlocks[pageNum - 1]);
+    if (editMode) {
+        const mounted = new Set(mountedPageNums());
+        await loadTextBlocks(pageNums.filter(pageNum => mounted.has(pageNum)));
+    }
+    
+    pageNums.forEach(pageNum => showUpdatedIndicator(pageNum));
+}
+
+function updateHistoryButtons(history) {
+    undoBtn.disabled = !(history && history.can_undo);
+    redoBtn.disabled = !(history && history.can_redo);
+}
+
 // OTHER PDF OPERATIONS
 async function addText() {
     const text = document.getElementById('textInput').value;
@@ -646,31 +1087,20 @@ async function addText() {
         const result = await response.json();
         
         if (result.success) {
-            // Update current PDF reference
-            currentPdf = result.modified_filename;
             showToast('Text added successfully!', 'success');
             
-            // Force reload the PDF preview with the new text
-            await loadPdfPreview(currentPdf);
-            
             // Clear form
             document.getElementById('textInput').value = '';
             
-            // If in edit mode, refresh the text blocks for the new file
-            if (editMode) {
-                // Reset and refresh edit mode
-                editMode = false;
-                editTextBtn.innerHTML = '<i class="fas fa-edit"></i> Edit Text';
-                editTextBtn.style.background = '';
-                removeTextOverlays();
-                selectedTextBlock = null;
-                document.body.classList.remove('edit-mode');
-                
-                // Re-enter edit mode with updated content
-                setTimeout(async () => {
-                    await toggleEditMode();
-                }, 500);
-            }
+            await applyVersion({
+                version: result.history.version,
+                filename: result.modified_filename,
+                parent: result.parent,
+                changed_pages: result.changed_pages,
+                history: result.history
+            });
+        } else if (response.status === 409) {
+            await applyEditConflict(result);
         } else {
             showToast(result.error || 'Failed to add text', 'error');
         }
@@ -835,6 +1265,50 @@ async function splitPdf() {
     }
 }
 
+async function optimizePdf() {
+    if (!currentPdf) return;
+    
+    showLoading(true);
+    
+    try {
+        const response = await fetch('/optimize', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                filename: currentPdf,
+                preset: 'balanced'
+            })
+        });
+        
+        const result = await response.json();
+        
+        if (result.success) {
+            // Resampling can touch any page; the fingerprint diff says which ones really changed
+            await applyVersion({
+                version: result.history.version,
+                filename: result.optimized_filename,
+                parent: result.parent,
+                changed_pages: await fetchChangedPages(result.parent, result.optimized_filename),
+                history: result.history
+            });
+            
+            const before = (result.bytes_before / 1024).toFixed(1);
+            const after = (result.bytes_after / 1024).toFixed(1);
+            showToast(`PDF optimized: ${before} KB -> ${after} KB`, 'success');
+        } else if (response.status === 409) {
+            await applyEditConflict(result);
+        } else {
+            showToast(result.error || 'Failed to optimize PDF', 'error');
+        }
+    } catch (error) {
+        showToast('Failed to optimize PDF: ' + error.message, 'error');
+    } finally {
+        showLoading(false);
+    }
+}
+
 function downloadCurrentPdf() {
     if (!currentPdf) return;
     
@@ -848,6 +1322,19 @@ function downloadCurrentPdf() {
     showToast('Download started!', 'success');
 }
 
+function extractImages() {
+    if (!currentPdf) return;
+    
+    // The zip is streamed as images are read, so the download starts right away
+    const link = document.createElement('a');
+    link.href = `/extract_images/${currentPdf}`;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+    
+    showToast('Image download started!', 'success');
+}
+
 async function convertToWord() {
     if (!currentPdf) return;
     
@@ -944,6 +1431,19 @@ document.addEventListener('keydown', function(e) {
                 e.preventDefault();
                 if (currentPdf) downloadCurrentPdf();
                 break;
+            case 'z':
+            case 'Z':
+                e.preventDefault();
+                if (e.shiftKey) {
+                    if (!redoBtn.disabled) redoEdit();
+                } else if (!undoBtn.disabled) {
+                    undoEdit();
+                }
+                break;
+            case 'y':
+                e.preventDefault();
+                if (!redoBtn.disabled) redoEdit();
+                break;
         }
     }
     
@@ -0,0 +1,190 @@
+// Service worker: keeps page images, previews and text blocks in Cache Storage.
+//
+// Every document version has its own filename and the server marks these
+// responses immutable, so anything cached for a URL can be served without
+// going to the network. Text blocks are stored one page per entry so a request
+// for many pages only fetches the pages that are missing. After an edit the
+// page asks us (see carryOverCachedPages in app.js) to copy the unchanged
+// pages of the parent version to the new version's URLs.
+
+const CACHE_NAME = 'pdf-editor-pages-v1';
+const MAX_CACHE_ENTRIES = 6000;
+
+self.addEventListener('install', () => {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/page_image/') || url.pathname.startsWith('/preview/') ||
+            url.pathname.startsWith('/thumbnail/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.pathname.startsWith('/get_text_blocks/') && url.searchParams.get('pages')) {
+        event.respondWith(textBlocksByPage(url));
+    }
+});
+
+self.addEventListener('message', event => {
+    const message = event.data || {};
+    if (message.type !== 'carry-over') return;
+
+    const reply = event.ports[0];
+    event.waitUntil(
+        carryOver(message.source, message.target, message.changedPages)
+            .then(count => reply && reply.postMessage({ copied: count }))
+            .catch(error => reply && reply.postMessage({ error: error.message }))
+    );
+});
+
+async function cacheFirst(request) {
+    const cache = await caches.open(CACHE_NAME);
+    // Vary: Accept is ignored; a browser always sends the same Accept for a request type
+    const cached = await cache.match(request, { ignoreVary: true });
+    if (cached) return cached;
+
+    const response = await fetchWithRetry(request);
+    // Previews of a document still being ingested are served no-cache and gain
+    // thumbnails and page classes later, so only immutable responses are kept
+    if (response.ok && (response.headers.get('Cache-Control') || '').includes('immutable')) {
+        await cache.put(request, response.clone());
+        trimCache(cache);
+    }
+    return response;
+}
+
+async function fetchWithRetry(request) {
+    // A busy server turns requests away with 503 and Retry-After; an <img>
+    // cannot retry by itself, so wait and try again a few times here
+    let response = await fetch(request);
+    for (let attempt = 0; attempt < 3 && response.status === 503; attempt++) {
+        const seconds = Math.min(parseInt(response.headers.get('Retry-After'), 10) || 1, 10);
+        await new Promise(resolve => setTimeout(resolve, seconds * 1000));
+        response = await fetch(request);
+    }
+    return response;
+}
+
+function textBlocksUrl(filename, pageNum) {
+    return `/get_text_blocks/${filename}?pages=${pageNum}`;
+}
+
+// Page lists use ranges ("1-40,45") so requests for large documents stay
+// within the server's request line limit
+function parsePages(value) {
+    const pageNums = [];
+    for (const part of value.split(',')) {
+        const [first, last] = part.split('-').map(Number);
+        if (!first) continue;
+        for (let pageNum = first; pageNum <= (last || first); pageNum++) {
+            pageNums.push(pageNum);
+        }
+    }
+    return [...new Set(pageNums)];
+}
+
+function formatPages(pageNums) {
+    const parts = [];
+    for (let i = 0; i < pageNums.length; i++) {
+        const start = pageNums[i];
+        while (i + 1 < pageNums.length && pageNums[i + 1] === pageNums[i] + 1) i++;
+        parts.push(start === pageNums[i] ? `${start}` : `${start}-${pageNums[i]}`);
+    }
+    return parts.join(',');
+}
+
+async function textBlocksByPage(url) {
+    const filename = url.pathname.slice('/get_text_blocks/'.length);
+    const pageNums = parsePages(url.searchParams.get('pages'));
+    const cache = await caches.open(CACHE_NAME);
+
+    const blocksByPage = {};
+    const missing = [];
+    for (const pageNum of pageNums) {
+        const cached = await cache.match(textBlocksUrl(filename, pageNum));
+        if (cached) {
+            blocksByPage[pageNum] = (await cached.json()).pages_blocks[0];
+        } else {
+            missing.push(pageNum);
+        }
+    }
+
+    if (missing.length > 0) {
+        const response = await fetchWithRetry(textBlocksUrl(filename, formatPages(missing)));
+        if (!response.ok) return response;
+
+        const result = await response.json();
+        for (const pageBlocks of result.pages_blocks) {
+            blocksByPage[pageBlocks.page_num] = pageBlocks;
+            await cache.put(textBlocksUrl(filename, pageBlocks.page_num), jsonResponse({
+                success: true,
+                pages_blocks: [pageBlocks]
+            }));
+        }
+        trimCache(cache);
+    }
+
+    return jsonResponse({
+        success: true,
+        pages_blocks: pageNums.filter(pageNum => blocksByPage[pageNum]).map(pageNum => blocksByPage[pageNum])
+    });
+}
+
+async function carryOver(source, target, changedPages) {
+    const changed = new Set(changedPages || []);
+    const cache = await caches.open(CACHE_NAME);
+    const sourceImage = `/page_image/${source}/`;
+    const sourceBlocks = `/get_text_blocks/${source}`;
+    let copied = 0;
+
+    for (const request of await cache.keys()) {
+        const url = new URL(request.url);
+        let pageNum = null;
+        let targetUrl = null;
+
+        if (url.pathname.startsWith(sourceImage)) {
+            pageNum = Number(url.pathname.slice(sourceImage.length));
+            targetUrl = `/page_image/${target}/${pageNum}${url.search}`;
+        } else if (url.pathname === sourceBlocks) {
+            pageNum = Number(url.searchParams.get('pages'));
+            targetUrl = textBlocksUrl(target, pageNum);
+        }
+
+        if (!pageNum || changed.has(pageNum)) continue;
+
+        const response = await cache.match(request, { ignoreVary: true });
+        if (response) {
+            await cache.put(targetUrl, response);
+            copied++;
+        }
+    }
+
+    trimCache(cache);
+    return copied;
+}
+
+function jsonResponse(body) {
+    return new Response(JSON.stringify(body), {
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+async function trimCache(cache) {
+    // Keys come back in insertion order, so the oldest entries go first
+    const keys = await cache.keys();
+    for (let index = 0; index < keys.length - MAX_CACHE_ENTRIES; index++) {
+        await cache.delete(keys[index]);
+    }
+}
@@ -0,0 +1,153 @@
+"""
+Tests for host-wide admission control: slot costs, capacity reserved for
+interactive work, per-operation limits, the bounded queue and the 503 answer.
+"""
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, Rejected
+from conftest import make_pdf, upload
+
+
+@pytest.fixture(autouse=True)
+def short_waits(monkeypatch):
+    monkeypatch.setattr(admission, 'WAIT_SECONDS', {'interactive': 0.3, 'batch': 0.3})
+
+
+def test_cost_grows_with_pages_and_size():
+    controller = AdmissionController(None)
+    assert controller.cost() == 1
+    assert controller.cost(pages=120) == 3
+    assert controller.cost(pages=1, size=40 * 1024 * 1024) == 3
+
+
+def test_batch_work_leaves_the_reserved_slots_to_interactive_work(tmp_path):
+    controller = AdmissionController(str(tmp_path), capacity=3, reserved=1)
+    batch = controller.acquire('convert_to_word', 'batch', 5)
+    assert batch.cost == 2  # capped at what batch work may use
+
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire('merge', 'batch', 1)
+    assert (rejected.value.reason, rejected.value.retry_after) == ('timed out waiting for capacity', 5)
+
+    interactive = controller.acquire('page_image', 'interactive', 1)
+    batch.release()
+    assert controller.acquire('merge', 'batch', 1).waited < 0.3
+    interactive.release()
+
+
+def test_operation_limits_apply_below_capacity(tmp_path):
+    controller = AdmissionController(str(tmp_path), capacity=8, reserved=0, limits={'ocr_text': 1})
+    ticket = controller.acquire('ocr_text', 'batch', 1)
+    with pytest.raises(Rejected):
+        controller.acquire('ocr_text', 'batch', 1)
+    controller.acquire('extract_text', 'batch', 1).release()
+
+    ticket.release()
+    controller.acquire('ocr_text', 'batch', 1).release()
+
+
+def test_full_queue_rejects_without_waiting(tmp_path):
+    controller = AdmissionController(str(tmp_path), capacity=1, reserved=0, queue_size=1)
+    held = controller.acquire('preview', 'interactive', 1)
+    waiter = threading.Thread(target=lambda: pytest.raises(Rejected, controller.acquire, 'preview', 'interactive', 1))
+    waiter.start()
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire('preview', 'interactive', 1)
+    assert rejected.value.reason == 'queue full'
+    assert time.monotonic() - started < 0.2
+    waiter.join()
+    held.release()
+
+
+def test_busy_server_answers_503_with_retry_after(app, client):
+    import app as app_module
+
+    filename = upload(client, make_pdf(pages=1))
+    app.config['ADMISSION_ENABLED'] = True
+    # Another worker holding every slot
+    other_worker = AdmissionController(app.config['ADMISSION_FOLDER'], capacity=app_module.admission.capacity, reserved=0)
+    ticket = other_worker.acquire('convert_to_word', 'interactive', app_module.admission.capacity)
+    try:
+        response = client.get(f'/extract_text/{filename}')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+        assert response.get_json()['reason'] == 'timed out waiting for capacity'
+        # Routes outside admission control still answer
+        assert client.get('/history').status_code == 200
+    finally:
+        ticket.release()
+
+    assert client.get(f'/extract_text/{filename}').status_code == 200
+
+
+def test_large_request_is_not_starved_by_single_slot_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, 'WAIT_SECONDS', {'interactive': 3, 'batch': 3})
+    controller = AdmissionController(str(tmp_path), capacity=4, reserved=1)
+    stop = threading.Event()
+
+    def scroll():
+        # A user scrolling: one page image after another, back to back
+        while not stop.is_set():
+            try:
+                ticket = controller.acquire('page_image', 'interactive', 1)
+            except Rejected:
+                continue
+            time.sleep(0.03)
+            ticket.release()
+
+    scrollers = [threading.Thread(target=scroll) for _ in range(3)]
+    for scroller in scrollers:
+        scroller.start()
+    try:
+        time.sleep(0.1)
+        ticket = controller.acquire('text_blocks', 'interactive', 4)
+        assert ticket.cost == 4
+        ticket.release()
+    finally:
+        stop.set()
+        for scroller in scrollers:
+            scroller.join()
+
+
+def test_page_requests_are_charged_for_uncached_work(app, client):
+    import app as app_module
+
+    filename = upload(client, make_pdf(pages=120, lines=1))
+    with app.test_request_context(f'/preview/{filename}'):
+        assert app_module._admission_cost('preview') == 1
+
+    with app.test_request_context(f'/get_text_blocks/{filename}'):
+        assert app_module._admission_cost('text_blocks') == 1  # page count not known yet
+    client.get(f'/get_text_blocks/{filename}?pages=1,2,3')
+    with app.test_request_context(f'/get_text_blocks/{filename}'):
+        assert app_module._admission_cost('text_blocks') == app_module.admission.cost(pages=117)
+    with app.test_request_context(f'/get_text_blocks/{filename}?pages=1,2,3'):
+        assert app_module._admission_cost('text_blocks') == 1
+
+
+def test_ingest_waits_for_batch_capacity(app, client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(admission, 'RETRY_AFTER', {'interactive': 0.05, 'batch': 0.05})
+    app.config['ADMISSION_ENABLED'] = True
+    app.config['INGEST_ENABLED'] = True
+    other_worker = AdmissionController(app.config['ADMISSION_FOLDER'], capacity=app_module.admission.capacity, reserved=0)
+    ticket = other_worker.acquire('convert_to_word', 'interactive', app_module.admission.capacity)
+    try:
+        filename = upload(client, make_pdf(pages=2))
+        time.sleep(0.5)
+        assert app_module.ingest_store.status(filename) == 'pending'
+    finally:
+        ticket.release()
+
+    deadline = time.monotonic() + 10
+    while app_module.ingest_store.status(filename) == 'pending' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert app_module.ingest_store.status(filename) == 'ready'
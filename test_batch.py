@@ -0,0 +1,97 @@
+"""
+Tests for the batch runner: outputs, resuming from the progress log, and
+recovery when a worker process dies.
+"""
+import argparse
+import json
+import os
+
+import batch
+from conftest import make_pdf
+
+_process_file = batch.process_file
+
+
+def crashing_process_file(operation, path, output_path, options):
+    """Kill the worker process for files named crash*.pdf, like a segfault in a PDF library"""
+    if os.path.basename(path).startswith('crash'):
+        os._exit(1)
+    return _process_file(operation, path, output_path, options)
+
+
+def batch_args(source, output, **overrides):
+    args = {
+        'operation': 'extract_text', 'source': str(source), 'manifest': None, 'output': str(output),
+        'workers': 2, 'tasks_per_child': 200, 'start_page': 1, 'end_page': None,
+        'restart': False, 'report_interval': 60.0
+    }
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def progress(output):
+    with open(os.path.join(output, batch.PROGRESS_FILENAME), 'r', encoding='utf-8') as progress_file:
+        return [json.loads(line) for line in progress_file]
+
+
+def test_extract_text_and_resume(tmp_path):
+    source = tmp_path / 'in'
+    (source / 'nested').mkdir(parents=True)
+    (source / 'a.pdf').write_bytes(make_pdf(pages=2))
+    (source / 'nested' / 'b.pdf').write_bytes(make_pdf(pages=3))
+    output = tmp_path / 'out'
+
+    summary = batch.run(batch_args(source, output))
+    assert (summary['ok'], summary['failed'], summary['pages']) == (2, 0, 5)
+    assert 'Page 3 line number 1' in (output / 'nested' / 'b.txt').read_text(encoding='utf-8')
+
+    # A rerun skips everything recorded as done in the progress log
+    summary = batch.run(batch_args(source, output))
+    assert (summary['skipped'], summary['ok']) == (2, 0)
+
+
+def test_worker_crash_only_fails_the_file_that_caused_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, 'process_file', crashing_process_file)
+    source = tmp_path / 'in'
+    source.mkdir()
+    (source / 'crash.pdf').write_bytes(make_pdf(pages=1))
+    for index in range(6):
+        (source / f'file{index}.pdf').write_bytes(make_pdf(pages=1))
+    output = tmp_path / 'out'
+
+    summary = batch.run(batch_args(source, output))
+    assert (summary['ok'], summary['failed']) == (6, 1)
+    failed = [record['path'] for record in progress(output) if record['status'] == 'failed']
+    assert failed == [str(source / 'crash.pdf')]
+
+
+def test_manifest_entries_outside_its_folder_are_written_inside_the_output(tmp_path):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'jobs').mkdir()
+    source = tmp_path / 'in' / 'a.pdf'
+    source.write_bytes(make_pdf(pages=3))
+    original = source.read_bytes()
+    manifest = tmp_path / 'jobs' / 'm.txt'
+    manifest.write_text(f'{source}\n../in/a.pdf\n', encoding='utf-8')
+    output = tmp_path / 'out'
+
+    summary = batch.run(batch_args(None, output, operation='split', manifest=str(manifest), end_page=1))
+    assert source.read_bytes() == original
+    # Both entries name the same file, which is only processed once
+    assert (summary['ok'], summary['failed']) == (1, 1)
+    written = output / 'external' / str(source).lstrip(os.sep)
+    assert written.exists()
+    failed = next(record for record in progress(output) if record['status'] == 'failed')
+    assert 'already written' in failed['error']
+
+
+def test_output_that_would_replace_its_input_is_refused(tmp_path):
+    source = tmp_path / 'in'
+    source.mkdir()
+    (source / 'a.pdf').write_bytes(make_pdf(pages=3))
+    original = (source / 'a.pdf').read_bytes()
+
+    summary = batch.run(batch_args(source, source, operation='split', end_page=1))
+    assert (summary['ok'], summary['failed']) == (0, 1)
+    assert (source / 'a.pdf').read_bytes() == original
+    assert 'overwrite the input' in progress(source)[0]['error']
@@ -0,0 +1,51 @@
+"""
+Tests for the benchmark harness: the synthetic corpus, every operation
+succeeding against the app, and regression detection between runs.
+"""
+import json
+import shutil
+
+import fitz
+import pytest
+
+import benchmark
+
+
+@pytest.mark.parametrize('layout', benchmark.LAYOUTS)
+def test_generated_corpus_is_reproducible(tmp_path, layout):
+    first, second = tmp_path / 'first.pdf', tmp_path / 'second.pdf'
+    benchmark.generate_pdf(str(first), 3, layout, seed=7)
+    benchmark.generate_pdf(str(second), 3, layout, seed=7)
+
+    with fitz.open(str(first)) as doc, fitz.open(str(second)) as again:
+        assert doc.page_count == 3
+        assert [page.get_text() for page in doc] == [page.get_text() for page in again]
+        assert bool(doc.load_page(0).get_images()) == (layout != 'text')
+
+
+def test_every_operation_succeeds(app, tmp_path):
+    import app as app_module
+
+    filename = 'bench_mixed_2.pdf'
+    benchmark.generate_pdf(str(tmp_path / filename), 2, 'mixed')
+    shutil.copy(tmp_path / filename, tmp_path / 'uploads' / filename)
+    client = app.test_client()
+
+    for operation in benchmark.OPERATIONS:
+        response = benchmark.run_operation(client, app_module, operation, filename, 2)
+        assert response.status_code == 200, operation
+    # Repeated edits follow the document's latest version instead of conflicting
+    assert benchmark.run_operation(client, app_module, 'edit', filename, 2).status_code == 200
+
+
+def test_compare_flags_slowdowns_and_skips_failures(tmp_path, capsys):
+    def row(operation, median):
+        return {'layout': 'text', 'pages': 10, 'operation': operation, 'median_seconds': median}
+
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'results': [row('preview', 1.0), row('extract', 1.0), row('edit', 1.0)]}))
+    current = {'results': [row('preview', 1.1), row('extract', 1.5), row('edit', None)]}
+
+    assert benchmark.compare(current, str(baseline), threshold=0.2) == 1
+    output = capsys.readouterr().out
+    assert 'extract' in output and 'REGRESSION' in output and 'edit' not in output
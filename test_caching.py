@@ -0,0 +1,62 @@
+"""
+Tests for HTTP caching of version-addressed responses: previews, page images
+and text blocks carry content ETags, are immutable and answer revalidation
+with 304.
+"""
+import pytest
+
+from conftest import make_pdf, upload
+
+
+@pytest.mark.parametrize('path', [
+    '/preview/{filename}',
+    '/page_image/{filename}/1',
+    '/get_text_blocks/{filename}?pages=1'
+])
+def test_version_responses_are_immutable_and_revalidate(client, path):
+    filename = upload(client, make_pdf(pages=2))
+    url = path.format(filename=filename)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'no-store' not in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+
+    # Served again from the page caches, with the same validator
+    again = client.get(url)
+    assert again.headers['ETag'] == etag and again.data == response.data
+
+    revalidated = client.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+
+def test_edited_version_has_its_own_validators(client):
+    original = upload(client, make_pdf(pages=2))
+    edited = client.post('/edit_text', json={
+        'filename': original, 'page_num': 1, 'old_text': '', 'new_text': 'changed',
+        'bbox': [72, 600, 400, 615], 'preserve_formatting': False
+    }).get_json()['modified_filename']
+
+    original_etag = client.get(f'/page_image/{original}/1').headers['ETag']
+    edited_page = client.get(f'/page_image/{edited}/1', headers={'If-None-Match': original_etag})
+    assert edited_page.status_code == 200
+    # The untouched page renders identically, so its validator carries over
+    assert client.get(f'/page_image/{edited}/2').headers['ETag'] == client.get(f'/page_image/{original}/2').headers['ETag']
+
+
+def test_service_worker_is_served_from_the_root_and_always_revalidated(client):
+    response = client.get('/service-worker.js')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/javascript'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert b"addEventListener('fetch'" in response.data
+
+
+def test_text_blocks_for_several_pages_match_single_page_requests(client):
+    """The service worker stores text blocks per page and reassembles multi-page requests"""
+    filename = upload(client, make_pdf(pages=3))
+    combined = client.get(f'/get_text_blocks/{filename}?pages=1,3').get_json()['pages_blocks']
+    single = [client.get(f'/get_text_blocks/{filename}?pages={page}').get_json()['pages_blocks'][0] for page in (1, 3)]
+    assert combined == single
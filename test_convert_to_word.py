@@ -0,0 +1,58 @@
+"""
+Tests for Word conversion: text is kept and every distinct image is
+embedded once, unchanged where Word can show it as it is.
+"""
+import io
+import zipfile
+
+import fitz
+from PIL import Image
+
+from conftest import make_pdf, upload
+
+
+def logo_pdf(logo, pages=3):
+    """Text pages that each draw the same JPEG logo under a separate image object"""
+    doc = fitz.open(stream=make_pdf(pages=pages, lines=2), filetype='pdf')
+    for page in doc:
+        # Inserting through a scratch document gives every page its own xref
+        scratch = fitz.open()
+        scratch.new_page(width=612, height=792).insert_image(fitz.Rect(72, 300, 192, 380), stream=logo)
+        page.show_pdf_page(page.rect, scratch, 0)
+        scratch.close()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def convert(app, client, data, name):
+    filename = upload(client, data, name)
+    result = client.get(f'/convert_to_word/{filename}').get_json()
+    assert result['success']
+    docx = zipfile.ZipFile(f"{app.config['PROCESSED_FOLDER']}/{result['word_filename']}")
+    media = [name for name in docx.namelist() if name.startswith('word/media/')]
+    return result, docx, media
+
+
+def test_repeated_logo_is_embedded_once_and_unchanged(app, client):
+    buffer = io.BytesIO()
+    Image.effect_noise((120, 80), 60).convert('RGB').save(buffer, format='JPEG', quality=85)
+    logo = buffer.getvalue()
+
+    result, docx, media = convert(app, client, logo_pdf(logo), 'logo.pdf')
+    assert (result['pages_processed'], result['images_processed']) == (3, 3)
+    assert len(media) == 1
+    assert docx.read(media[0]) == logo
+    assert 'Page 3 line number 2' in docx.read('word/document.xml').decode('utf-8')
+
+
+def test_images_with_transparency_are_converted_to_png(app, client):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (40, 40), (200, 30, 30, 128)).save(buffer, format='PNG')
+    doc = fitz.open(stream=make_pdf(pages=1, lines=1), filetype='pdf')
+    doc.load_page(0).insert_image(fitz.Rect(72, 300, 112, 340), stream=buffer.getvalue())
+
+    result, docx, media = convert(app, client, doc.tobytes(), 'alpha.pdf')
+    assert result['images_processed'] == 1
+    assert [name.rsplit('.', 1)[1] for name in media] == ['png']
+    assert Image.open(io.BytesIO(docx.read(media[0]))).mode == 'RGBA'
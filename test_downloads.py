@@ -0,0 +1,41 @@
+"""
+Tests for /download: byte ranges, conditional requests and cache headers.
+"""
+from conftest import make_pdf, upload
+
+
+def test_range_requests_return_partial_content(client):
+    data = make_pdf(pages=2)
+    filename = upload(client, data)
+
+    full = client.get(f'/download/{filename}')
+    assert full.status_code == 200 and full.data == data
+    assert full.headers['Accept-Ranges'] == 'bytes'
+    assert 'attachment' in full.headers['Content-Disposition']
+
+    partial = client.get(f'/download/{filename}', headers={'Range': 'bytes=0-99'})
+    assert partial.status_code == 206
+    assert partial.data == data[:100]
+    assert partial.headers['Content-Range'] == f'bytes 0-99/{len(data)}'
+
+    resumed = client.get(f'/download/{filename}', headers={'Range': f'bytes={len(data) - 10}-'})
+    assert resumed.data == data[-10:]
+
+
+def test_conditional_requests_are_answered_with_304(client):
+    filename = upload(client, make_pdf(pages=1))
+    response = client.get(f'/download/{filename}?inline=1')
+    etag = response.headers['ETag']
+
+    assert 'inline' in response.headers['Content-Disposition']
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': '"other"'}).status_code == 200
+
+    # A range request for a changed file gets the whole new file instead
+    stale = client.get(f'/download/{filename}', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert stale.status_code == 200
+
+
+def test_missing_download_is_404(client):
+    assert client.get('/download/missing.pdf').status_code == 404
@@ -0,0 +1,107 @@
+"""
+Tests for the undo/redo history, the per-page caches it keeps warm, and the
+/undo, /redo and /history routes.
+"""
+from conftest import make_pdf, upload
+from edit_history import EditHistory
+from page_cache import PageCache
+
+
+def test_undo_and_redo_step_through_versions(tmp_path):
+    history = EditHistory(str(tmp_path))
+    history.reset('session', 'v0.pdf')
+    history.record('session', 'v0.pdf', 'v1.pdf', [2])
+    history.record('session', 'v1.pdf', 'v2.pdf', [3, 3, 1])
+
+    assert history.undo('session') == ('v1.pdf', [1, 3])
+    assert history.undo('session') == ('v0.pdf', [2])
+    assert history.undo('session') is None
+    assert history.redo('session') == ('v1.pdf', [2])
+
+    state = history.state('session')
+    assert (state['current'], state['can_undo'], state['can_redo']) == ('v1.pdf', True, True)
+
+
+def test_recording_after_undo_discards_the_redo_branch(tmp_path):
+    history = EditHistory(str(tmp_path))
+    history.reset('session', 'v0.pdf')
+    history.record('session', 'v0.pdf', 'v1.pdf', [1])
+    history.undo('session')
+
+    discarded = history.record('session', 'v0.pdf', 'v1b.pdf', [2])
+    assert [entry['filename'] for entry in discarded] == ['v1.pdf']
+    assert not history.state('session')['can_redo']
+
+
+def test_history_depth_is_bounded(tmp_path):
+    history = EditHistory(str(tmp_path), max_depth=3)
+    history.reset('session', 'v0.pdf')
+    for version in range(1, 6):
+        history.record('session', f'v{version - 1}.pdf', f'v{version}.pdf', [1])
+    assert history.state('session')['undo_depth'] == 3
+
+
+def test_page_cache_carries_unchanged_pages_to_a_new_version():
+    cache = PageCache()
+    for page in (1, 2, 3):
+        cache.put(('v1.pdf', page, 'classic:medium'), bytes([page]) * 10, size=10)
+
+    assert cache.copy_pages('v1.pdf', 'v2.pdf', skip_pages=[2]) == 2
+    assert cache.get(('v2.pdf', 1, 'classic:medium')) == b'\x01' * 10
+    assert cache.get(('v2.pdf', 2, 'classic:medium')) is None
+    assert cache.stats()['bytes'] == 30  # carried entries share the value
+
+    assert cache.invalidate('v1.pdf', pages=[3]) == 1
+    assert cache.get(('v1.pdf', 3, 'classic:medium')) is None
+    # Values still held by the new version keep counting once the parent's entries are gone
+    assert cache.invalidate('v1.pdf') == 2
+    assert cache.stats()['bytes'] == 20
+
+
+def test_byte_bound_holds_after_the_parent_is_evicted():
+    cache = PageCache(max_entries=100, max_bytes=1000)
+    for page in range(1, 10):
+        cache.put(('v1.pdf', page), bytearray(100), size=100)
+    cache.copy_pages('v1.pdf', 'v2.pdf')
+    for page in range(1, 10):
+        cache.put(('v3.pdf', page), bytearray(100), size=100)
+
+    held = {id(cache.get(key)): 100 for key in list(cache._entries)}
+    assert cache.stats()['bytes'] == sum(held.values()) <= 1000
+
+
+def test_page_cache_evicts_least_recently_used():
+    cache = PageCache(max_entries=10, max_bytes=25)
+    cache.put('a', 'a', size=10)
+    cache.put('b', 'b', size=10)
+    cache.get('a')
+    cache.put('c', 'c', size=10)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a' and cache.get('c') == 'c'
+
+
+def test_undo_route_returns_the_previous_version_and_changed_pages(client):
+    import app as app_module
+
+    original = upload(client, make_pdf(pages=3))
+    for page in (1, 2):
+        client.get(f'/page_image/{original}/{page}')
+    edited = client.post('/edit_text', json={
+        'filename': original, 'page_num': 2, 'old_text': '', 'new_text': 'changed',
+        'bbox': [72, 600, 400, 615], 'preserve_formatting': False
+    }).get_json()
+    assert edited['changed_pages'] == [2]
+    edited = edited['modified_filename']
+    # Only the edited page has to be rendered again for the new version
+    assert app_module.render_cache.get((edited, 1, 'classic:medium')) is not None
+    assert app_module.render_cache.get((edited, 2, 'classic:medium')) is None
+
+    undone = client.post('/undo').get_json()
+    assert (undone['filename'], undone['parent'], undone['changed_pages']) == (original, edited, [2])
+    assert undone['history']['can_redo']
+
+    redone = client.post('/redo').get_json()
+    assert redone['filename'] == edited
+    assert client.post('/redo').status_code == 400
+    assert client.get('/history').get_json()['history']['current'] == edited
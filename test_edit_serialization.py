@@ -0,0 +1,116 @@
+"""
+Tests for per-document edit serialization: numbered versions, stale edits
+rebased or rejected against their own document's latest version.
+"""
+import fitz
+
+from conftest import make_pdf, upload
+
+
+def edit(client, filename, page_num, text, y=600):
+    """Write ``text`` into an empty area of a page through /edit_text"""
+    return client.post('/edit_text', json={
+        'filename': filename,
+        'page_num': page_num,
+        'old_text': '',
+        'new_text': text,
+        'bbox': [72, y, 400, y + 15],
+        'preserve_formatting': False
+    })
+
+
+def page_text(app, filename, page_num):
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{filename}") as doc:
+        return doc.load_page(page_num - 1).get_text()
+
+
+def test_edits_get_numbered_versions(client):
+    original = upload(client, make_pdf())
+    first = edit(client, original, 1, 'first').get_json()
+    second = edit(client, first['modified_filename'], 1, 'second').get_json()
+
+    assert first['modified_filename'].endswith('_v1.pdf')
+    assert second['modified_filename'].endswith('_v2.pdf')
+    assert second['parent'] == first['modified_filename']
+    assert not second['rebased']
+
+
+def test_stale_edit_of_another_page_is_rebased(app, client):
+    original = upload(client, make_pdf())
+    first = edit(client, original, 1, 'first tab').get_json()
+
+    response = edit(client, original, 2, 'second tab')
+    result = response.get_json()
+    assert response.status_code == 200
+    assert result['rebased']
+    assert result['parent'] == first['modified_filename']
+    assert 'first tab' in page_text(app, result['modified_filename'], 1)
+    assert 'second tab' in page_text(app, result['modified_filename'], 2)
+
+
+def test_stale_edit_of_a_changed_page_conflicts(client):
+    original = upload(client, make_pdf())
+    first = edit(client, original, 1, 'first tab').get_json()
+
+    response = edit(client, original, 1, 'second tab', y=650)
+    result = response.get_json()
+    assert response.status_code == 409
+    assert result['conflict']
+    assert result['current'] == first['modified_filename']
+
+
+def test_edits_follow_their_own_document(app, client):
+    first_doc = upload(client, make_pdf(prefix='First'), 'first.pdf')
+    second_doc = upload(client, make_pdf(prefix='Second'), 'second.pdf')
+
+    # The session's latest upload is the second document; editing the first
+    # must neither conflict with it nor be rebased onto it
+    response = edit(client, first_doc, 1, 'edit of first')
+    result = response.get_json()
+    assert response.status_code == 200
+    assert not result['rebased']
+    assert result['parent'] == first_doc
+    assert result['modified_filename'].startswith(first_doc[:-4])
+    assert 'First 1 line' in page_text(app, result['modified_filename'], 1)
+
+    second = edit(client, second_doc, 1, 'edit of second').get_json()
+    assert second['parent'] == second_doc
+
+
+def test_identical_documents_are_not_mixed_up(app, client):
+    data = make_pdf()
+    first_doc = upload(client, data, 'copy-a.pdf')
+    second_doc = upload(client, data, 'copy-b.pdf')
+    second = edit(client, second_doc, 2, 'edit of copy b').get_json()
+
+    # Every page of the first copy matches the second's head except page 2;
+    # an edit of page 1 must still go to the first copy's own lineage
+    result = edit(client, first_doc, 1, 'edit of copy a').get_json()
+    assert not result['rebased']
+    assert result['parent'] == first_doc
+    assert result['modified_filename'] != second['modified_filename']
+    assert 'edit of copy b' not in page_text(app, result['modified_filename'], 2)
+
+
+def test_edit_after_undo_starts_from_the_restored_version(client):
+    original = upload(client, make_pdf())
+    edit(client, original, 1, 'undone')
+    assert client.post('/undo').status_code == 200
+
+    response = edit(client, original, 1, 'replacement')
+    assert response.status_code == 200
+    assert response.get_json()['parent'] == original
+
+
+def test_optimize_is_a_serialized_version(client):
+    original = upload(client, make_pdf())
+    first = edit(client, original, 1, 'first').get_json()
+
+    stale = client.post('/optimize', json={'filename': original, 'preset': 'lossless'})
+    assert stale.status_code == 409
+
+    response = client.post('/optimize', json={'filename': first['modified_filename'], 'preset': 'lossless'})
+    result = response.get_json()
+    assert response.status_code == 200
+    assert result['optimized_filename'].endswith('_v2.pdf')
+    assert result['parent'] == first['modified_filename']
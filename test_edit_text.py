@@ -0,0 +1,72 @@
+"""
+Tests for /edit_text: the old text is removed by redaction, the new text
+sits on the original baseline, and neighbouring lines are never touched.
+"""
+import fitz
+import pytest
+
+from conftest import make_pdf, upload
+
+
+def text_blocks(client, filename, page_num=1):
+    result = client.get(f'/get_text_blocks/{filename}?pages={page_num}').get_json()
+    return result['pages_blocks'][0]['blocks']
+
+
+def edit_block(client, filename, block, new_text, mode='redact', send_origin=True):
+    """Replace a text block the way the editor does, preserving its formatting"""
+    return client.post('/edit_text', json={
+        'filename': filename,
+        'page_num': 1,
+        'old_text': block['text'],
+        'new_text': new_text,
+        'bbox': block['bbox'],
+        'origin': block['origin'] if send_origin else None,
+        'mode': mode,
+        'preserve_formatting': True,
+        'font_info': {key: block[key] for key in ('font', 'size', 'flags', 'color')}
+    }).get_json()
+
+
+def page_lines(app, filename):
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{filename}") as doc:
+        return doc.load_page(0).get_text(sort=True).splitlines()
+
+
+@pytest.mark.parametrize('send_origin', [True, False], ids=['origin-sent', 'origin-looked-up'])
+def test_repeated_edits_keep_the_neighbouring_lines(app, client, send_origin):
+    filename = upload(client, make_pdf(pages=1, lines=6))
+    original_top = text_blocks(client, filename)[1]['bbox'][1]
+
+    for edit_number in range(1, 6):
+        block = min(text_blocks(client, filename), key=lambda block: abs(block['bbox'][1] - original_top))
+        result = edit_block(client, filename, block, f'Edited line two, take {edit_number}', send_origin=send_origin)
+        filename = result['modified_filename']
+
+        lines = page_lines(app, filename)
+        assert lines == [
+            'Page 1 line number 1',
+            f'Edited line two, take {edit_number}',
+            'Page 1 line number 3',
+            'Page 1 line number 4',
+            'Page 1 line number 5',
+            'Page 1 line number 6'
+        ]
+
+    # The replacement is written on the original baseline, so it does not drift
+    edited = next(block for block in text_blocks(client, filename) if block['text'].startswith('Edited'))
+    assert abs(edited['bbox'][1] - original_top) < 0.5
+
+
+def test_redaction_removes_the_old_glyphs(app, client):
+    redacted = upload(client, make_pdf(pages=1, lines=3), 'redacted.pdf')
+    block = text_blocks(client, redacted)[0]
+    redacted = edit_block(client, redacted, block, 'Replaced')['modified_filename']
+    covered = upload(client, make_pdf(pages=1, lines=3), 'covered.pdf')
+    covered = edit_block(client, covered, block, 'Replaced', mode='cover')['modified_filename']
+
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{redacted}") as doc:
+        assert 'Page 1 line number 1' not in doc.load_page(0).get_text()
+    # Cover mode only paints over the old text, which stays extractable
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{covered}") as doc:
+        assert 'Page 1 line number 1' in doc.load_page(0).get_text()
@@ -0,0 +1,43 @@
+"""
+Tests for /events, the Server-Sent Events stream announcing new document
+versions to the other tabs of a session.
+"""
+import json
+
+from conftest import make_pdf, upload
+
+
+def parse_events(body):
+    events = []
+    for message in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line and not line.startswith(':'))
+        if fields.get('event') == 'version':
+            events.append((int(fields['id']), json.loads(fields['data'])))
+    return events
+
+
+def test_stream_replays_versions_after_the_last_event_id(client):
+    original = upload(client, make_pdf(pages=2))
+    edited = client.post('/edit_text', json={
+        'filename': original, 'page_num': 2, 'old_text': '', 'new_text': 'changed',
+        'bbox': [72, 600, 400, 615], 'preserve_formatting': False
+    }).get_json()['modified_filename']
+
+    response = client.get('/events', headers={'Last-Event-ID': '0'})
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    events = parse_events(response.get_data(as_text=True))
+    assert len(events) == 1
+    version, payload = events[0]
+    assert (payload['version'], payload['filename'], payload['parent'], payload['changed_pages']) == (
+        version, edited, original, [2]
+    )
+
+    # A fresh connection starts from the current version, with nothing to replay
+    assert parse_events(client.get('/events').get_data(as_text=True)) == []
+    assert parse_events(client.get('/events', headers={'Last-Event-ID': str(version)}).get_data(as_text=True)) == []
+
+
+def test_stream_can_be_disabled(app, client):
+    app.config['EVENTS_ENABLED'] = False
+    assert client.get('/events').status_code == 404
@@ -0,0 +1,73 @@
+"""
+Tests for image extraction: JPEGs copied out byte for byte, shared and
+duplicate images stored once, and the manifest mapping images to pages.
+"""
+import io
+import json
+import zipfile
+
+import fitz
+import pytest
+from PIL import Image
+
+from conftest import upload
+
+
+@pytest.fixture
+def jpeg():
+    buffer = io.BytesIO()
+    Image.effect_noise((120, 80), 60).convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def images_pdf(jpeg):
+    """Page 1 and 2 share one JPEG object, page 3 holds a separate copy of it and a PNG with alpha"""
+    buffer = io.BytesIO()
+    Image.new('RGBA', (40, 40), (200, 30, 30, 128)).save(buffer, format='PNG')
+
+    doc = fitz.open()
+    shared = doc.new_page(width=612, height=792).insert_image(fitz.Rect(72, 72, 192, 152), stream=jpeg)
+    doc.new_page(width=612, height=792).insert_image(fitz.Rect(72, 72, 192, 152), xref=shared)
+    # Built in another document, as PyMuPDF reuses the object for identical streams
+    other = fitz.open()
+    page = other.new_page(width=612, height=792)
+    page.insert_image(fitz.Rect(72, 72, 192, 152), stream=jpeg)
+    page.insert_image(fitz.Rect(300, 72, 340, 112), stream=buffer.getvalue())
+    doc.insert_pdf(other)
+    other.close()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_images_zip_has_a_manifest_and_original_jpegs(client, images_pdf, jpeg):
+    filename = upload(client, images_pdf, 'images.pdf')
+    response = client.get(f'/extract_images/{filename}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    assert 'immutable' in response.headers['Cache-Control']
+
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    manifest = json.loads(archive.read('manifest.json'))
+    jpegs = [image for image in manifest['images'] if image['file'].endswith('.jpg')]
+
+    # One object used by two pages, and a byte-identical copy, all stored in one file
+    assert [image['pages'] for image in jpegs] == [[1, 2], [3]]
+    assert len({image['file'] for image in jpegs}) == 1
+    assert all(image['passthrough'] for image in jpegs)
+    assert archive.read(jpegs[0]['file']) == jpeg
+
+    png = next(image for image in manifest['images'] if image['file'].endswith('.png') and image['smask'])
+    assert png['smask'] in archive.namelist()
+    assert manifest['summary']['pages'] == 3
+    assert manifest['summary']['files'] == len(archive.namelist()) - 1
+
+
+def test_missing_and_broken_files_get_json_errors(app, client):
+    assert client.get('/extract_images/missing.pdf').status_code == 404
+
+    with open(f"{app.config['UPLOAD_FOLDER']}/broken.pdf", 'wb') as broken:
+        broken.write(b'%PDF-1.4 not really a pdf')
+    response = client.get('/extract_images/broken.pdf')
+    assert response.status_code == 500 and 'error' in response.get_json()
@@ -0,0 +1,40 @@
+"""
+Tests for per-page fingerprints and /diff: only pages that look different
+between two versions are reported.
+"""
+import fitz
+
+from conftest import make_pdf, upload
+from fingerprints import changed_pages, structural_fingerprints
+
+
+def test_edit_with_a_new_font_only_changes_its_page():
+    doc = fitz.open(stream=make_pdf(pages=3), filetype='pdf')
+    before = structural_fingerprints(doc)
+    doc.load_page(1).insert_text((72, 500), 'Added', fontname='Courier', fontsize=11)
+    # Saving with garbage collection renumbers objects
+    doc = fitz.open(stream=doc.tobytes(garbage=4), filetype='pdf')
+    assert changed_pages(before, structural_fingerprints(doc)) == [2]
+
+
+def test_changed_pages_counts_added_and_removed_pages():
+    assert changed_pages(['a', 'b'], ['a', 'x', 'c']) == [2, 3]
+    assert changed_pages(['a', 'b', 'c'], ['a']) == [2, 3]
+
+
+def test_diff_route_reports_pages_that_render_differently(client):
+    original = upload(client, make_pdf(pages=3))
+    edited = client.post('/edit_text', json={
+        'filename': original, 'page_num': 3, 'old_text': '', 'new_text': 'changed',
+        'bbox': [72, 600, 400, 615], 'preserve_formatting': False
+    }).get_json()['modified_filename']
+
+    diff = client.get(f'/diff/{original}/{edited}').get_json()
+    assert (diff['changed_pages'], diff['added_pages'], diff['removed_pages']) == ([3], [], [])
+
+    # Lossless optimization rewrites every page's objects without changing how they render
+    optimized = client.post('/optimize', json={'filename': edited, 'preset': 'lossless'}).get_json()
+    assert optimized['history']['current'] == optimized['optimized_filename']
+    assert client.get(f"/diff/{edited}/{optimized['optimized_filename']}").get_json()['changed_pages'] == []
+
+    assert client.get(f'/diff/{original}/missing.pdf').status_code == 404
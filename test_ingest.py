@@ -0,0 +1,73 @@
+"""
+Tests for upload-time ingest: page facts, thumbnails and text stored per
+document, and the routes that answer from them.
+"""
+import io
+import time
+
+import fitz
+from PIL import Image
+
+from conftest import make_pdf, upload
+from ingest import THUMBNAIL_WIDTH, IngestStore
+
+
+def mixed_pdf():
+    """A text page, a full-page image and a blank page"""
+    image = Image.effect_noise((200, 200), 60).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+
+    doc = fitz.open(stream=make_pdf(pages=1), filetype='pdf')
+    doc.new_page(width=612, height=792).insert_image(fitz.Rect(0, 0, 612, 792), stream=buffer.getvalue())
+    doc.new_page(width=300, height=400)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_run_classifies_pages_and_stores_text_and_thumbnails(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(mixed_pdf())
+    store = IngestStore(str(tmp_path / 'ingest'))
+    assert store.status('doc.pdf') is None
+    store.start('doc.pdf')
+    assert store.status('doc.pdf') == 'pending' and store.facts('doc.pdf') is None
+
+    facts = store.run('doc.pdf', str(path))
+    assert store.status('doc.pdf') == 'ready'
+    assert [page['classification'] for page in facts['pages']] == ['text', 'image', 'empty']
+    assert (facts['pages'][2]['width'], facts['pages'][2]['height']) == (300, 400)
+    assert facts['has_text_layer'] and not facts['is_image_based']
+    assert facts['fonts'] == ['Helvetica']
+
+    page = store.page_text('doc.pdf', 1)
+    assert page['text'].startswith('Page 1 line number 1')
+    assert page['blocks'][0]['text'] == 'Page 1 line number 1'
+    assert Image.open(io.BytesIO(store.thumbnail('doc.pdf', 2))).width == THUMBNAIL_WIDTH
+
+    store.mark_failed('doc.pdf', 'broken')
+    assert store.status('doc.pdf') == 'failed' and store.facts('doc.pdf') is None
+
+
+def test_routes_answer_from_ingested_facts(app, client):
+    app.config['INGEST_ENABLED'] = True
+    filename = upload(client, mixed_pdf())
+
+    deadline = time.monotonic() + 30
+    response = client.get(f'/document_info/{filename}')
+    while response.status_code == 202 and time.monotonic() < deadline:
+        assert response.headers['Retry-After'] == '1'
+        time.sleep(0.05)
+        response = client.get(f'/document_info/{filename}')
+    assert response.status_code == 200
+    assert response.get_json()['page_count'] == 3
+
+    pages = client.get(f'/preview/{filename}').get_json()['pages']
+    assert [page['is_image_based'] for page in pages] == [False, True, False]
+    thumbnail = client.get(pages[0]['thumbnail'])
+    assert thumbnail.mimetype == 'image/jpeg'
+
+    text = client.get(f'/extract_text/{filename}').get_json()
+    assert text['pages_text'][0]['text'].startswith('Page 1 line number 1')
+    assert client.get('/document_info/missing.pdf').status_code == 404
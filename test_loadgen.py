@@ -0,0 +1,45 @@
+"""
+Tests for the load generator: concurrent in-process users completing the
+editing workflow without errors, and the latency summary.
+"""
+import threading
+import types
+
+import loadgen
+from conftest import make_pdf
+
+
+def test_concurrent_users_complete_the_workflow(app):
+    recorder = loadgen.LoadRecorder()
+    pdf_bytes = make_pdf(pages=2)
+    app_module = types.SimpleNamespace(app=app)
+    threads = [
+        threading.Thread(target=loadgen.run_user, args=(loadgen.InProcessTransport(app_module), recorder, pdf_bytes, 2))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert recorder.errors == {}
+    requests = {route['route']: route['requests'] for route in loadgen.summarise(recorder, 1.0)}
+    assert requests == {
+        'POST /upload': 3,
+        'GET /preview': 9,
+        'GET /page_image': 12,  # both pages once, then only the edited page
+        'GET /get_text_blocks': 9,
+        'POST /edit_text': 6,
+        'GET /convert_to_word': 3
+    }
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = [index / 100 for index in range(1, 101)]
+    assert loadgen.percentile(values, 0.50) == 0.5
+    assert loadgen.percentile(values, 0.99) == 0.99
+    assert loadgen.percentile([], 0.95) == 0.0
+
+    recorder = loadgen.LoadRecorder()
+    recorder.timed('GET /missing', lambda: (404, None, 0))
+    assert loadgen.summarise(recorder, 2.0)[0]['errors'] == 1
@@ -0,0 +1,52 @@
+"""
+Tests for the metrics registry and the /metrics endpoint, including merging
+snapshots written by other workers.
+"""
+import json
+
+from conftest import make_pdf, upload
+from metrics import MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        registry.observe('latency_seconds', value, route='/a')
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+
+
+def test_snapshots_from_other_workers_are_merged(tmp_path):
+    registry = MetricsRegistry(folder=str(tmp_path))
+    registry.counter('requests_total', 'Requests')
+    registry.gauge('in_flight', 'In flight')
+    registry.inc('requests_total', 2, route='/a')
+    registry.set('in_flight', 1, route='/a')
+    other_worker = {
+        'requests_total': [[[['route', '/a']], 3], [[['route', '/b']], 1]],
+        'in_flight': [[[['route', '/a']], 4]]
+    }
+    (tmp_path / '999999.json').write_text(json.dumps(other_worker), encoding='utf-8')
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="/a"} 5' in lines
+    assert 'requests_total{route="/b"} 1' in lines
+    assert 'in_flight{route="/a"} 5' in lines
+
+
+def test_metrics_endpoint_counts_requests_by_route(client):
+    filename = upload(client, make_pdf(pages=2))
+    client.get(f'/extract_text/{filename}')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'pdf_http_requests_total{method="GET",route="/extract_text/<filename>",status="200"} ' in body
+    assert 'pdf_http_request_duration_seconds_count{route="/extract_text/<filename>"} ' in body
+    assert 'pdf_pages_processed_total{operation="extract_text"} ' in body
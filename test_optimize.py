@@ -0,0 +1,64 @@
+"""
+Tests for /optimize: presets that resample images shrink image-heavy files,
+lossless optimization keeps every image untouched, and bad input is rejected.
+"""
+import io
+
+import fitz
+import pytest
+from PIL import Image
+
+from conftest import upload
+
+
+@pytest.fixture
+def image_pdf():
+    """Two pages, each with a noisy 1200px JPEG drawn 200pt wide (432 dpi)"""
+    image = Image.effect_noise((1200, 1200), 60).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+
+    doc = fitz.open()
+    for _ in range(2):
+        page = doc.new_page(width=612, height=792)
+        page.insert_image(fitz.Rect(72, 72, 272, 272), stream=buffer.getvalue())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def optimize(client, filename, preset):
+    response = client.post('/optimize', json={'filename': filename, 'preset': preset, 'linearize': False})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def image_widths(app, filename):
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{filename}") as doc:
+        return sorted(doc.extract_image(image[0])['width'] for image in doc.load_page(0).get_images())
+
+
+def test_small_preset_resamples_images(app, client, image_pdf):
+    filename = upload(client, image_pdf, 'images.pdf')
+    result = optimize(client, filename, 'small')
+
+    assert result['bytes_after'] < result['bytes_before']
+    assert result['bytes_saved'] == result['bytes_before'] - result['bytes_after']
+    assert image_widths(app, result['optimized_filename']) == [300]
+    with fitz.open(f"{app.config['PROCESSED_FOLDER']}/{result['optimized_filename']}") as doc:
+        assert doc.page_count == 2
+
+
+def test_lossless_preset_keeps_images(app, client, image_pdf):
+    filename = upload(client, image_pdf, 'images.pdf')
+    result = optimize(client, filename, 'lossless')
+    assert image_widths(app, result['optimized_filename']) == [1200]
+
+
+def test_unknown_preset_and_missing_file_are_rejected(client, image_pdf):
+    filename = upload(client, image_pdf, 'images.pdf')
+    response = client.post('/optimize', json={'filename': filename, 'preset': 'tiny'})
+    assert response.status_code == 400
+    assert 'lossless' in response.get_json()['error']
+
+    assert client.post('/optimize', json={'filename': 'missing.pdf'}).status_code == 404
@@ -0,0 +1,58 @@
+"""
+Tests for page image encoding: the format is negotiated from Accept, text
+pages stay lossless and photographic pages use the requested quality tier.
+"""
+import io
+
+import fitz
+import pytest
+from PIL import Image
+
+from conftest import make_pdf, upload
+
+
+@pytest.fixture
+def photo_pdf():
+    """One page covered by a noisy photograph"""
+    image = Image.effect_noise((400, 500), 60).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    page.insert_image(fitz.Rect(36, 36, 576, 756), stream=buffer.getvalue())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_text_pages_are_lossless(client):
+    filename = upload(client, make_pdf(pages=1))
+    response = client.get(f'/page_image/{filename}/1')
+    assert response.mimetype == 'image/png'
+    assert 'Accept' in response.headers['Vary']
+
+    webp = client.get(f'/page_image/{filename}/1', headers={'Accept': 'image/webp,*/*'})
+    assert webp.mimetype == 'image/webp'
+    # Lossless WebP decodes to exactly the PNG's pixels
+    png_pixels = Image.open(io.BytesIO(response.data)).convert('RGB').tobytes()
+    assert Image.open(io.BytesIO(webp.data)).convert('RGB').tobytes() == png_pixels
+
+
+def test_photographic_pages_use_the_quality_tier(client, photo_pdf):
+    filename = upload(client, photo_pdf, 'photo.pdf')
+    sizes = {}
+    for tier in ('low', 'medium', 'high'):
+        response = client.get(f'/page_image/{filename}/1?quality={tier}')
+        assert response.mimetype == 'image/jpeg'
+        sizes[tier] = len(response.data)
+    assert sizes['low'] < sizes['medium'] < sizes['high']
+
+    webp = client.get(f'/page_image/{filename}/1?quality=low', headers={'Accept': 'image/webp'})
+    assert webp.mimetype == 'image/webp'
+
+
+def test_unknown_quality_and_page_are_rejected(client):
+    filename = upload(client, make_pdf(pages=1))
+    assert client.get(f'/page_image/{filename}/1?quality=best').status_code == 400
+    assert client.get(f'/page_image/{filename}/2').status_code == 404
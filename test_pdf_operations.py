@@ -0,0 +1,111 @@
+"""
+Tests for the headless PDF operations module and the executor tasks built on it.
+"""
+import os
+import subprocess
+import sys
+
+import executor
+import metrics
+import pdf_operations
+from conftest import make_pdf, upload
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_headless_tasks_do_not_import_the_web_app(tmp_path):
+    """Process-pool workers and ingest must not pay for importing Flask and the routes"""
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(make_pdf(pages=2))
+    probe = (
+        'import sys, executor, ingest\n'
+        f'blocks = executor.extract_text_blocks({str(path)!r}, [1, 2])\n'
+        f'facts = ingest.analyze_pages({str(path)!r}, [1])\n'
+        'assert blocks[2][0][0]["text"] == "Page 2 line number 1"\n'
+        'print("app" in sys.modules, "flask" in sys.modules)\n'
+    )
+    completed = subprocess.run(
+        [sys.executable, '-c', probe], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    assert completed.stdout.split() == ['False', 'False']
+
+
+def test_pool_results_match_inline_results(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(make_pdf(pages=5))
+    inline = executor.map_pages(executor.extract_plain_text, str(path), range(1, 6))
+
+    executor.configure(2, chunk_size=2)
+    try:
+        pooled = executor.map_pages(executor.extract_plain_text, str(path), range(1, 6))
+    finally:
+        executor.configure(0)
+
+    assert not executor.enabled()
+    assert sorted(pooled) == [1, 2, 3, 4, 5]
+    assert {page: text for page, (text, _) in pooled.items()} == {page: text for page, (text, _) in inline.items()}
+    assert executor.map_pages(executor.extract_plain_text, str(path), []) == {}
+
+
+def pages_processed(operation):
+    series = metrics.registry.snapshot()['pdf_pages_processed_total']
+    return sum(value for key, value in series if ('operation', operation) in map(tuple, key))
+
+
+def test_whole_document_work_runs_in_the_pool_and_reports_its_metrics(app, client):
+    filename = upload(client, make_pdf(pages=2))
+    block = client.get(f'/get_text_blocks/{filename}?pages=2').get_json()['pages_blocks'][0]['blocks'][0]
+    edits_before = pages_processed('edit_text')
+
+    executor.configure(1)
+    try:
+        edited = client.post('/edit_text', json={
+            'filename': filename, 'page_num': 2, 'bbox': block['bbox'], 'new_text': 'Pooled edit'
+        }).get_json()
+        diff = client.get(f"/diff/{filename}/{edited['modified_filename']}").get_json()
+        optimized = client.post('/optimize', json={
+            'filename': edited['modified_filename'], 'preset': 'lossless', 'linearize': False
+        }).get_json()
+        images = client.get(f"/extract_images/{optimized['optimized_filename']}")
+        pooled = executor._pool is not None
+    finally:
+        executor.configure(0)
+
+    assert pooled
+    assert edited['changed_pages'] == [2]
+    assert diff['changed_pages'] == [2]
+    assert images.status_code == 200 and images.mimetype == 'application/zip'
+    with pdf_operations.open_document(f"{app.config['PROCESSED_FOLDER']}/{optimized['optimized_filename']}") as doc:
+        assert 'Pooled edit' in doc.load_page(1).get_text()
+
+    # Counters recorded in the pool process are added to this one
+    assert pages_processed('edit_text') == edits_before + 1
+
+
+def test_documents_share_a_map_until_the_file_is_replaced(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(make_pdf(pages=2))
+    with pdf_operations.open_document(str(path)) as doc:
+        assert doc.load_page(1).get_text().startswith('Page 2 line number 1')
+    assert pdf_operations._map_file(str(path)) is pdf_operations._map_file(str(path))
+
+    # Edits write a new file and move it into place, which must not serve the old map
+    replacement = tmp_path / 'replacement.pdf'
+    replacement.write_bytes(make_pdf(pages=1, prefix='Replaced'))
+    os.replace(replacement, path)
+    with pdf_operations.open_document(str(path)) as doc:
+        assert len(doc) == 1 and doc.load_page(0).get_text().startswith('Replaced 1')
+
+
+def test_evicted_maps_stay_valid_for_open_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_operations, 'MMAP_CACHE_SIZE', 2)
+    docs = []
+    for index in range(4):
+        path = tmp_path / f'doc{index}.pdf'
+        path.write_bytes(make_pdf(pages=1, prefix=f'Doc{index}'))
+        docs.append(pdf_operations.open_document(str(path)))
+
+    assert len(pdf_operations._mapped_files) <= 2
+    assert [doc.load_page(0).get_text().split()[0] for doc in docs] == ['Doc0', 'Doc1', 'Doc2', 'Doc3']
+    for doc in docs:
+        doc.close()
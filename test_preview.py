@@ -0,0 +1,58 @@
+"""
+Tests for /preview, which the virtualized viewer uses to lay out every page
+before any page image is rendered.
+"""
+import io
+
+from PIL import Image
+
+from conftest import make_pdf, upload
+
+
+def test_preview_sizes_pages_without_rendering_them(client):
+    import app as app_module
+
+    filename = upload(client, make_pdf(pages=20, lines=1))
+    result = client.get(f'/preview/{filename}').get_json()
+
+    assert result['total_pages'] == 20
+    assert [page['page_num'] for page in result['pages']] == list(range(1, 21))
+    assert all((page['width'], page['height']) == (918, 1188) for page in result['pages'])
+    assert result['pages'][4]['image'] == f'/page_image/{filename}/5'
+    assert not any(app_module.render_cache.get((filename, page, 'classic:medium')) for page in range(1, 21))
+
+
+def test_preview_can_be_limited_to_visible_pages(client):
+    filename = upload(client, make_pdf(pages=10, lines=1))
+    result = client.get(f'/preview/{filename}?pages=3,4,4,99').get_json()
+
+    assert [page['page_num'] for page in result['pages']] == [3, 4]
+    assert result['total_pages'] == 10
+
+
+def test_zoom_maps_text_blocks_onto_the_page_image(client):
+    """The edit overlay scales PDF-point boxes by the reported zoom to hit-test on the image"""
+    filename = upload(client, make_pdf(pages=1, lines=3))
+    preview = client.get(f'/preview/{filename}').get_json()
+    zoom, page = preview['zoom'], preview['pages'][0]
+
+    image = Image.open(io.BytesIO(client.get(page['image']).data))
+    assert image.size == (page['width'], page['height'])
+
+    blocks = client.get(f'/get_text_blocks/{filename}').get_json()['pages_blocks'][0]['blocks']
+    x0, y0, x1, y1 = (round(value * zoom) for value in blocks[0]['bbox'])
+    # The scaled box covers dark glyph pixels, and the margin beside it is blank
+    pixels = image.convert('L')
+    assert min(pixels.crop((x0, y0, x1, y1)).getdata()) < 128
+    assert min(pixels.crop((0, y0, x0 - 2, y1)).getdata()) == 255
+
+
+def test_page_lists_accept_ranges(client):
+    """Edit mode asks for pages as ranges, so large documents keep the request line short"""
+    filename = upload(client, make_pdf(pages=1100, lines=1))
+    result = client.get(f'/preview/{filename}?pages=2-4,9,4,1099-2000').get_json()
+    assert [page['page_num'] for page in result['pages']] == [2, 3, 4, 9, 1099, 1100]
+
+    blocks = client.get(f'/get_text_blocks/{filename}?pages=1-1100').get_json()['pages_blocks']
+    assert len(blocks) == 1100 and blocks[-1]['blocks'][0]['text'] == 'Page 1100 line number 1'
+    assert client.get(f'/get_text_blocks/{filename}?pages=x-3,-2').get_json()['pages_blocks'] == []
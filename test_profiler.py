@@ -0,0 +1,39 @@
+"""
+Tests for per-request profiling: opt-in with the X-Profile header, saved
+profiles listed and downloadable, and the routes hidden while disabled.
+"""
+import pstats
+
+from conftest import make_pdf, upload
+
+
+def test_profiling_is_disabled_by_default(client):
+    filename = upload(client, make_pdf(pages=1))
+    response = client.get(f'/extract_text/{filename}', headers={'X-Profile': '1'})
+
+    assert 'X-Profile-Id' not in response.headers
+    assert client.get('/profiles').status_code == 404
+
+
+def test_profiled_request_is_saved_and_listed(app, client, tmp_path):
+    app.config['PROFILING_ENABLED'] = True
+    filename = upload(client, make_pdf(pages=2))
+    assert 'X-Profile-Id' not in client.get(f'/extract_text/{filename}').headers
+
+    response = client.get(f'/extract_text/{filename}', headers={'X-Profile': '1'})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+
+    profiles = client.get('/profiles').get_json()['profiles']
+    assert [profile['id'] for profile in profiles] == [profile_id]
+    assert (profiles[0]['route'], profiles[0]['filename'], profiles[0]['status']) == (
+        '/extract_text/<filename>', filename, 200
+    )
+
+    summary = client.get(f'/profiles/{profile_id}?format=json').get_json()
+    assert summary['top_functions'] and summary['peak_memory_bytes'] > 0
+
+    dump = tmp_path / 'downloaded.prof'
+    dump.write_bytes(client.get(f'/profiles/{profile_id}').data)
+    assert pstats.Stats(str(dump)).total_calls > 0
+    assert client.get('/profiles/missing').status_code == 404
@@ -0,0 +1,88 @@
+"""
+Tests for single-flight coalescing within and across processes, and for the
+result files handed between workers.
+"""
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def slow_compute(counter_path, value):
+    with open(counter_path, 'a') as counter_file:
+        counter_file.write('x')
+    time.sleep(0.5)
+    return value
+
+
+def test_concurrent_calls_in_a_process_share_one_computation(tmp_path):
+    flight = SingleFlight(str(tmp_path / 'flight'))
+    counter = tmp_path / 'count'
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            flight.run(('page_image', 'doc.pdf', 1), lambda: slow_compute(counter, b'image'))))
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.read_text() == 'x'
+    assert sorted(shared for _, shared in results) == [False] + [True] * 5
+    assert all(value == b'image' for value, _ in results)
+
+
+def _run_in_process(folder, counter, queue):
+    value, shared = SingleFlight(folder).run(('text_blocks', 'doc.pdf', (1, 2)), lambda: slow_compute(
+        counter, {1: [{'text': 'a', 'bbox': (1.0, 2.0, 3.0, 4.0)}], 2: []}
+    ))
+    queue.put((value, shared))
+
+
+def test_workers_share_one_computation(tmp_path):
+    context = multiprocessing.get_context('fork')
+    folder, counter = str(tmp_path / 'flight'), str(tmp_path / 'count')
+    queue = context.Queue()
+    processes = [context.Process(target=_run_in_process, args=(folder, counter, queue)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    results = [queue.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert open(counter).read() == 'x'
+    # Values come back with their int keys and tuples, as computed
+    assert all(value == {1: [{'text': 'a', 'bbox': (1.0, 2.0, 3.0, 4.0)}], 2: []} for value, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+
+
+def test_result_files_round_trip_bytes_and_types(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    value = (b'\x89PNG\r\n\x00', 'image/png', 640, 480, {3: None, (1, 2): [True, 0.5]})
+    flight._write_result(str(tmp_path / 'result'), value)
+    assert flight._read_result(str(tmp_path / 'result')) == value
+
+
+def test_planted_pickles_are_never_loaded(tmp_path):
+    class Exploit:
+        def __reduce__(self):
+            return (open, (str(tmp_path / 'pwned'), 'w'))
+
+    (tmp_path / 'result').write_bytes(pickle.dumps(Exploit()))
+    assert SingleFlight(str(tmp_path))._read_result(str(tmp_path / 'result')) is None
+    assert not (tmp_path / 'pwned').exists()
+
+
+def test_folder_writable_by_others_is_not_used(tmp_path):
+    folder = tmp_path / 'shared'
+    folder.mkdir()
+    os.chmod(folder, 0o777)
+    value, shared = SingleFlight(str(folder)).run(('preview_sizes', 'doc.pdf'), lambda: {1: (10, 20)})
+
+    assert (value, shared) == ({1: (10, 20)}, False)
+    assert os.listdir(folder) == []
@@ -0,0 +1,47 @@
+"""
+Tests for startup: importing the app has no side effects and defers the
+heavy optional libraries until they are needed or preloaded.
+"""
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_probe(probe, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    completed = subprocess.run(
+        [sys.executable, '-c', probe], cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+    return completed.stdout.split()
+
+
+def test_import_is_lazy_and_side_effect_free(tmp_path):
+    probe = (
+        'import os, sys, app\n'
+        'print("docx" in sys.modules, "PyPDF2" in sys.modules, app._default_app is None, len(os.listdir(".")))\n'
+        'assert app.app is app.app\n'
+        'print(os.path.isdir("uploads"), os.path.isdir("processed"))\n'
+    )
+    assert run_probe(probe, tmp_path) == ['False', 'False', 'True', '0', 'True', 'True']
+
+
+def test_preload_imports_the_deferred_libraries(tmp_path):
+    probe = (
+        'import sys, app\n'
+        'app.preload_shared_state()\n'
+        'print("docx" in sys.modules, "PyPDF2" in sys.modules, *sorted(app.startup_timings))\n'
+    )
+    assert run_probe(probe, tmp_path) == ['True', 'True', 'import', 'preload']
+
+
+def test_async_config_patches_threading_before_the_app_is_loaded(tmp_path):
+    probe = (
+        'import os, runpy\n'
+        'os.environ["PDF_EDITOR_ASYNC"] = "1"\n'
+        f'runpy.run_path({os.path.join(REPO_DIR, "gunicorn.conf.py")!r})\n'
+        'import app\n'
+        'print(type(app.edit_history._lock).__module__.split(".")[0])\n'
+    )
+    assert run_probe(probe, tmp_path) == ['gevent']